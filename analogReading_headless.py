@@ -0,0 +1,193 @@
+import argparse
+import signal
+import sys
+import time
+
+from sek_acquisition import MAX_SAMPLING_RATE, MIN_SAMPLING_RATE, RECORDING_FORMATS, SEGMENT_INDEX_ROWS, \
+    AcquisitionSession, Formula, SegmentPolicy, build_channel_plan
+from sek_devices import WAVEFORMS, BridgeGroup, SignalGenerator, SimulatedOutages, create_backend
+from sek_discovery import describe_port, discover, resolve_serial_ports
+from sek_metrics import METRICS_INTERVAL
+from sek_publisher import PUBLISH_FORMATS, PUBLISH_PORT, QUEUE_POLICIES, QUEUE_SIZE
+
+# 无界面采集：不导入 PyQt5/pyqtgraph，适合在实验室电脑或树莓派上长时间运行
+
+POLL_INTERVAL = 0.2  # 取数据并写盘的间隔 (s)
+STATUS_INTERVAL = 60  # 打印采样状态的间隔 (s)
+DISCOVERY_TIMEOUT = 5.0  # 等待串口探测的最长时间 (s)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Headless SensorBridge voltage logger.")
+    parser.add_argument('--serial-port', nargs='+',
+                        help="serial ports of the SensorBridges, e.g. COM3 COM4, 'sn:SERIAL' for the SensorBridge "
+                             "with that serial number (see --list-bridges), or 'sim' / 'sim-shdlc' "
+                             "for a simulated device. Ports are numbered across devices: the first "
+                             "SensorBridge has Port1 and Port2, the second Port3 and Port4, ...")
+    parser.add_argument('--list-bridges', action='store_true',
+                        help="probe all serial ports, print the SensorBridges found with their serial "
+                             "numbers and firmware versions, and exit")
+    parser.add_argument('--supply-voltage', type=float, default=3.3, choices=[3.3, 5.0],
+                        help="supply voltage of the selected ports (default: 3.3)")
+    parser.add_argument('--ports', nargs='+', default=['Port1', 'Port2'],
+                        help="SensorBridge ports to sample (default: Port1 Port2)")
+    parser.add_argument('--rate', type=float, default=1.0,
+                        help="sampling frequency in Hz of ports without a 'SampleRate' in the header (default: 1)")
+    parser.add_argument('--header-file',
+                        help="file with the custom header dict, as entered in the GUI")
+    parser.add_argument('--formula', default='x', help="default formula, use x for voltage (default: x)")
+    parser.add_argument('--latency-column', action='store_true',
+                        help="record the duration of each read in a 'Latency' column (s); "
+                             "timestamps are taken at the middle of the read")
+    parser.add_argument('--duration', type=float, default=0,
+                        help="stop after this many seconds, 0 runs until interrupted (default: 0)")
+    parser.add_argument('--output-dir', default='', help="directory for the recording (default: current)")
+    parser.add_argument('--format', default='edf', choices=list(RECORDING_FORMATS),
+                        help="recording format; binary (.sekb) is about 5x smaller, "
+                             "convert it with convert_recording.py (default: edf)")
+    parser.add_argument('--metrics-file',
+                        help="periodically write acquisition metrics to this file: JSON if it ends with .json, "
+                             "otherwise Prometheus text format (e.g. for the node_exporter textfile collector)")
+    parser.add_argument('--metrics-interval', type=float, default=METRICS_INTERVAL,
+                        help=f"seconds between metrics file updates (default: {METRICS_INTERVAL:g})")
+    segmenting = parser.add_argument_group("segmented recording for long runs",
+                                           "write the recording as numbered segments plus a .sekidx index, which "
+                                           "the GUI and convert_recording.py open like a single recording")
+    segmenting.add_argument('--segment-size', type=float, metavar='MB',
+                            help="start a new segment when the current one reaches this size")
+    segmenting.add_argument('--segment-duration', type=float, metavar='SECONDS',
+                            help="start a new segment after this many seconds of data")
+    segmenting.add_argument('--compress-segments', action='store_true',
+                            help="gzip closed segments in the background")
+    segmenting.add_argument('--keep-segments', type=int, metavar='N',
+                            help="keep only the newest N segments, deleting older ones")
+    segmenting.add_argument('--index-rows', type=int, default=SEGMENT_INDEX_ROWS,
+                            help=f"rows per block of the time index (default: {SEGMENT_INDEX_ROWS})")
+    publishing = parser.add_argument_group("live data for other programs (see sek_publisher.py for the framing)")
+    publishing.add_argument('--publish', type=int, nargs='?', const=PUBLISH_PORT, metavar='PORT',
+                            help=f"publish the recorded rows to subscribers on localhost:PORT "
+                                 f"(default port: {PUBLISH_PORT}, 0 picks a free port)")
+    publishing.add_argument('--publish-format', default='jsonl', choices=PUBLISH_FORMATS,
+                            help="JSON lines or binary float64 frames (default: jsonl)")
+    publishing.add_argument('--publish-queue', type=int, default=QUEUE_SIZE,
+                            help=f"batches buffered per subscriber (default: {QUEUE_SIZE})")
+    publishing.add_argument('--publish-policy', default='drop-oldest', choices=QUEUE_POLICIES,
+                            help="what to do when a subscriber falls behind and its queue is full "
+                                 "(default: drop-oldest)")
+    simulation = parser.add_argument_group("simulated device (--serial-port sim / sim-shdlc)")
+    simulation.add_argument('--sim-channels', type=int, default=2,
+                            help="number of ports of 'sim', named Port1..PortN (default: 2)")
+    simulation.add_argument('--sim-latency', type=float, default=0.0,
+                            help="round-trip time of each command in seconds (default: 0)")
+    simulation.add_argument('--sim-waveform', default='sine', choices=WAVEFORMS, help="(default: sine)")
+    simulation.add_argument('--sim-frequency', type=float, default=0.1, help="waveform frequency in Hz (default: 0.1)")
+    simulation.add_argument('--sim-noise', type=float, default=0.01,
+                            help="standard deviation of the noise in V (default: 0.01)")
+    simulation.add_argument('--sim-outage', type=float, nargs=2, metavar=('PERIOD', 'DURATION'),
+                            help="make the device unreachable for DURATION seconds at the end of every "
+                                 "PERIOD seconds, to test reconnecting")
+    args = parser.parse_args(argv)
+    if args.list_bridges:
+        return args
+    missing = [option for option, value in (('--serial-port', args.serial_port), ('--header-file', args.header_file))
+               if not value]
+    if missing:
+        parser.error(f"the following arguments are required: {', '.join(missing)}")
+    if not MIN_SAMPLING_RATE <= args.rate <= MAX_SAMPLING_RATE:
+        parser.error(f"--rate must be between {MIN_SAMPLING_RATE} and {MAX_SAMPLING_RATE} Hz")
+    if args.publish_queue < 1:
+        parser.error("--publish-queue must be at least 1")
+    segmented = args.segment_size is not None or args.segment_duration is not None
+    if (args.compress_segments or args.keep_segments is not None) and not segmented:
+        parser.error("--compress-segments and --keep-segments need --segment-size or --segment-duration")
+    if any(value is not None and value <= 0 for value in (args.segment_size, args.segment_duration,
+                                                            args.keep_segments)) or args.index_rows < 1:
+        parser.error("segment size, duration, count and index rows must be positive")
+    args.segments = SegmentPolicy(int(args.segment_size * 2 ** 20) if args.segment_size else None,
+                                  args.segment_duration, args.compress_segments, args.keep_segments,
+                                  args.index_rows) if segmented else None
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.list_bridges:
+        for info in discover(DISCOVERY_TIMEOUT):
+            print(describe_port(info))
+        return 0
+    ports = list(dict.fromkeys(args.ports))
+    try:
+        serial_ports = resolve_serial_ports(args.serial_port, DISCOVERY_TIMEOUT)
+        signal_generator = SignalGenerator(args.sim_waveform, frequency=args.sim_frequency, noise=args.sim_noise)
+        backend = BridgeGroup([create_backend(name, args.sim_channels, args.sim_latency, signal_generator,
+                                              SimulatedOutages(*args.sim_outage) if args.sim_outage else None)
+                               for name in serial_ports])
+        for port in ports:
+            if port not in backend.port_dict:
+                raise ValueError(f"unknown port {port}, expected one of {', '.join(backend.port_dict)}")
+        with open(args.header_file, encoding='utf-8') as f:
+            plan = build_channel_plan(f.read(), ports, backend.port_dict, Formula(args.formula), args.latency_column)
+    except (OSError, ValueError) as e:
+        print(f"Invalid settings: {e}")
+        return 1
+
+    try:
+        backend.connect(args.supply_voltage, [backend.port_dict[port] for port in ports])
+    except Exception as e:
+        print(f"Failed to connect to device: {e}")
+        return 1
+    print("Device connected successfully.")
+
+    # SIGTERM 与 Ctrl+C 一样正常结束，保证数据写盘
+    stop = []
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop.append(signum))
+    session = None
+    try:
+        session = AcquisitionSession(backend, plan, args.rate, args.output_dir, args.format, args.segments)
+        if args.metrics_file:
+            session.export_metrics(args.metrics_file, args.metrics_interval)
+        if args.publish is not None:
+            port = session.publish(port=args.publish, framing=args.publish_format, queue_size=args.publish_queue,
+                                   policy=args.publish_policy)
+            print(f"Publishing live data ({args.publish_format}) on localhost:{port}")
+        session.start()
+        print(f"Recording to {session.file_name}")
+        start = time.monotonic()
+        last_status = start
+        while not stop:
+            time.sleep(POLL_INTERVAL)
+            session.poll()
+            now = time.monotonic()
+            if now - last_status >= STATUS_INTERVAL:
+                for stats in session.stats()['workers']:
+                    print(f"Achieved: {stats['achieved_rate']:.2f} / {stats['requested_rate']:.2f} Hz, "
+                          f"Samples: {stats['ticks']}, Missed: {stats['missed']}")
+                print(f"Read errors: {session.metrics.counter('read_errors_total')}, "
+                      f"Dropped batches: {session.metrics.counter('dropped_batches_total')}, "
+                      f"Reconnects: {session.metrics.counter('reconnects_total')}")
+                if session.publisher is not None:
+                    print(f"Subscribers: {session.metrics.gauge('subscribers')}, Dropped for subscribers: "
+                          f"{session.metrics.counter('subscriber_dropped_batches_total')}")
+                last_status = now
+            if args.duration and now - start >= args.duration:
+                break
+    except KeyboardInterrupt:
+        pass
+    except Exception as e:
+        print(f"Failed to record data: {e}")
+    finally:
+        if session is not None:
+            try:
+                session.stop()
+            except Exception as e:
+                print(f"Failed to stop recording: {e}")
+        try:
+            backend.disconnect()
+            print("Device disconnected successfully.")
+        except Exception as e:
+            print(f"Failed to disconnect device: {e}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -2,21 +2,79 @@
 import datetime as dt
 import os
 import sys
-import time
 
-import pandas as pd
+import numpy as np
 import pyqtgraph as pg
-import sensirion_fastedf as fastedf
-import serial.tools.list_ports
 from PyQt5.QtCore import QTimer, Qt
+from PyQt5.QtGui import QFontDatabase
 from PyQt5.QtWidgets import QApplication, QMainWindow, QVBoxLayout, QWidget, QLabel, QPushButton, \
-    QComboBox, QLineEdit, QSplitter, QFrame, QHBoxLayout, QTextEdit, QDoubleSpinBox, QCheckBox
-from sensirion_shdlc_driver import ShdlcSerialPort, ShdlcConnection
-from sensirion_shdlc_sensorbridge import SensorBridgeShdlcDevice
+    QComboBox, QLineEdit, QSplitter, QFrame, QHBoxLayout, QTextEdit, QDoubleSpinBox, QCheckBox, QFileDialog, \
+    QProgressDialog, QListWidget, QListWidgetItem, QAbstractItemView, QGridLayout
+
+from sek_acquisition import RECORDING_FORMATS, AcquisitionSession, Formula, build_channel_plan
+from sek_devices import PORT_DICT, SIMULATED_BACKENDS, BridgeGroup, create_backend
+from sek_discovery import BridgeDiscovery, describe_port
+from sek_filters import STAGES
+from sek_metrics import METRICS_INTERVAL, format_status
+from sek_recording import MinMaxPyramid, open_recording_file
+
+PLOT_FPS = 30  # 界面刷新帧率，与采样率无关
+PLOT_BUFFER_SIZE = 500000  # 每个通道绘图缓冲保留的点数
+PORT_PENS = {'Port1': 'r', 'Port2': 'g'}
+RAW_POINTS_PER_PIXEL = 4  # 可见样本数不超过屏幕宽度的该倍数时显示原始数据，否则显示 min/max 聚合
+DISCOVERY_DELAY = 1000  # 窗口显示后开始探测串口的延迟 (ms)，避免与启动争用
+DISCOVERY_REFRESH = 500  # 检查发现结果、刷新串口列表的间隔 (ms)
+PROBE_RETRY = 100  # 所选串口正在探测时，再次尝试连接的间隔 (ms)
+
+
+class RingBuffer:
+    # 预分配的 (时间, 值) 环形缓冲。每个点同时写入 i 和 i + capacity 两处，
+    # 因此按时间顺序的数据总是一段连续切片，取数据不需要复制
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.x = np.empty(2 * capacity, dtype=np.float64)
+        self.y = np.empty(2 * capacity, dtype=np.float64)
+        self.head = 0
+        self.size = 0
+
+    def extend(self, x, y):
+        n = len(x)
+        if n > self.capacity:
+            x = x[-self.capacity:]
+            y = y[-self.capacity:]
+            n = self.capacity
+        start = self.head
+        end = start + n
+        cap = self.capacity
+        for buf, values in ((self.x, x), (self.y, y)):
+            buf[start:end] = values
+            if end <= cap:
+                buf[start + cap:end + cap] = values
+            else:
+                split = cap - start
+                buf[start + cap:] = values[:split]
+                buf[:end - cap] = values[split:]
+        self.head = end % cap
+        self.size = min(self.size + n, cap)
+
+    def data(self):
+        if self.size < self.capacity:
+            return self.x[:self.size], self.y[:self.size]
+        return self.x[self.head:self.head + self.capacity], self.y[self.head:self.head + self.capacity]
+
+    def covers(self, x0):
+        # 缓冲中是否有 x0 之后的全部数据（尚未覆盖过旧数据，或最旧的点不晚于 x0）
+        return self.size < self.capacity or self.x[self.head] <= x0
+
+    def range(self, x0, x1):
+        x, y = self.data()
+        start, end = np.searchsorted(x, (x0, x1))
+        return x[start:end + 1], y[start:end + 1]
 
 
 class SensorApp(QMainWindow):
-    def __init__(self):
+    # discover_bridges 为 False 时不探测串口、不读写发现缓存，列表中只有模拟设备（基准测试用）
+    def __init__(self, discover_bridges=True):
         super().__init__()
 
         # 设置窗口标题
@@ -48,11 +106,16 @@ class SensorApp(QMainWindow):
 
         # 第一组控件
         group1_layout = QVBoxLayout()
-        self.serial_port_label = QLabel("Select Serial Port:")
+        self.serial_port_label = QLabel("Select Serial Port(s):")
         group1_layout.addWidget(self.serial_port_label)
-        self.serial_port_combo = QComboBox()
-        self.update_serial_ports()
-        group1_layout.addWidget(self.serial_port_combo)
+        # 可选择多台 SensorBridge，每台在自己的串口上由独立的采样线程读取
+        self.serial_port_list = QListWidget()
+        self.serial_port_list.setSelectionMode(QAbstractItemView.MultiSelection)
+        self.serial_port_list.setMaximumHeight(100)
+        group1_layout.addWidget(self.serial_port_list)
+        self.rescan_button = QPushButton("Rescan Ports")
+        self.rescan_button.clicked.connect(self.rescan_serial_ports)
+        group1_layout.addWidget(self.rescan_button)
 
         self.power_label = QLabel("Select Power Supply:")
         group1_layout.addWidget(self.power_label)
@@ -63,25 +126,16 @@ class SensorApp(QMainWindow):
         self.port_label = QLabel("Select Sensor Bridge Port:")
         group1_layout.addWidget(self.port_label)
 
-        # 创建 Port1 和 Port2 的复选框和标签
-
-        self.port1_checkbox = QCheckBox('Port1')
-        self.port1_checkbox.setChecked(True)
-        self.port1_checkbox.stateChanged.connect(self.on_port1_checkbox_changed)
-        self.port2_checkbox = QCheckBox('Port2')
-        self.port2_checkbox.setChecked(True)
-        self.port2_checkbox.stateChanged.connect(self.on_port2_checkbox_changed)
-        group1_layout_hbox = QHBoxLayout()
-        group1_layout_hbox.addWidget(self.port1_checkbox)
-        group1_layout_hbox.addWidget(self.port2_checkbox)
-
-        # 将水平布局添加到 group1_layout 中
-        group1_layout.addLayout(group1_layout_hbox)
+        # 端口复选框：每台设备一行，端口按设备顺序编号为 Port1、Port2、Port3……
+        self.port_checkboxes = {}
+        self.port_checkbox_layout = QGridLayout()
+        group1_layout.addLayout(self.port_checkbox_layout)
 
         control_layout.addLayout(group1_layout)
 
         group5_layout = QVBoxLayout()
         self.sampling_rate_label = QLabel("Sampling Frequency (Hz):")
+        self.sampling_rate_label.setToolTip("Used for ports without a 'SampleRate' in the custom header.")
         group5_layout.addWidget(self.sampling_rate_label)
         self.sampling_rate_spinbox = QDoubleSpinBox()
         self.sampling_rate_spinbox.setRange(0.01, 1000)  # 设置范围从1到1000 Hz
@@ -89,6 +143,15 @@ class SensorApp(QMainWindow):
         self.sampling_rate_spinbox.setValue(1)  # 默认值为1 Hz
         self.sampling_rate_spinbox.valueChanged.connect(self.update_sampling_rate)
         group5_layout.addWidget(self.sampling_rate_spinbox)
+        self.rate_status_label = QLabel("")
+        group5_layout.addWidget(self.rate_status_label)
+
+        self.plot_window_label = QLabel("Plot Window (s, 0 = all):")
+        group5_layout.addWidget(self.plot_window_label)
+        self.plot_window_spinbox = QDoubleSpinBox()
+        self.plot_window_spinbox.setRange(0, 604800)
+        self.plot_window_spinbox.setValue(600)
+        group5_layout.addWidget(self.plot_window_spinbox)
 
         control_layout.addLayout(group5_layout)
         # 第二组控件
@@ -97,15 +160,42 @@ class SensorApp(QMainWindow):
         group2_layout.addWidget(self.formula_label)
         self.formula_input = QLineEdit()
         self.formula_input.setText("x")
+        self.formula_input.setToolTip("Default formula for all ports. "
+                                      "A port can override it with a 'Formula' entry in the custom header.")
+        self.formula_input.textChanged.connect(self.update_formula)
         group2_layout.addWidget(self.formula_input)
 
         self.custom_header_label = QLabel("Enter Custom Header:")
         group2_layout.addWidget(self.custom_header_label)
         self.custom_header_input = QTextEdit()
         self.custom_header_input.setFixedHeight(100)
-        self.custom_header_input.setText("{'TestName':'Logi','Port1':{'SensorName':'Sen66_1','SensorId':'11','SampleRate':'1'},'Port2':{'SensorName':'Sen66_2','SensorId':'222','SampleRate':'1'}}")
+        self.custom_header_input.setText("{'TestName':'Logi','Port1':{'SensorName':'Sen66_1','SensorId':'11'},'Port2':{'SensorName':'Sen66_2','SensorId':'222'}}")
+        self.custom_header_input.setToolTip(
+            "Per port: 'SensorName', 'SensorId', optional 'Formula', 'SampleRate' and 'Derived', e.g.\n"
+            "'Derived': {'smooth': 'median(5) | ema(0.1)', 'alarm': {'Stages': 'ma(10) | above(2.5, 0.1)', "
+            "'Plot': False}}\n"
+            "Stages: " + ', '.join(f'{name}()' for name in STAGES) + ". Each derived signal is recorded as a column.")
         group2_layout.addWidget(self.custom_header_input)
 
+        self.file_format_label = QLabel("Recording Format:")
+        group2_layout.addWidget(self.file_format_label)
+        self.file_format_combo = QComboBox()
+        self.file_format_combo.addItems(list(RECORDING_FORMATS))
+        self.file_format_combo.setToolTip("binary: compact .sekb file, convert it with convert_recording.py")
+        group2_layout.addWidget(self.file_format_combo)
+        self.latency_checkbox = QCheckBox("Record Read Latency")
+        self.latency_checkbox.setToolTip("Add a 'Latency' column with the duration of each read in seconds. "
+                                         "Timestamps are taken at the middle of the read.")
+        group2_layout.addWidget(self.latency_checkbox)
+        self.metrics_checkbox = QCheckBox("Export Metrics File")
+        self.metrics_checkbox.setToolTip(f"Write the telemetry next to the recording as <recording>.prom "
+                                         f"(Prometheus text format) every {METRICS_INTERVAL:g} s.")
+        group2_layout.addWidget(self.metrics_checkbox)
+        self.publish_checkbox = QCheckBox("Publish Live Data")
+        self.publish_checkbox.setToolTip("Stream the recorded rows to other programs on localhost as JSON lines "
+                                         "(see sek_publisher.py). The port is printed when recording starts.")
+        group2_layout.addWidget(self.publish_checkbox)
+
         # 添加分割线
         line2 = QFrame()
         line2.setFrameShape(QFrame.HLine)
@@ -124,32 +214,67 @@ class SensorApp(QMainWindow):
         self.start_button.clicked.connect(self.toggle_data_collection)
         group3_layout.addWidget(self.start_button)
 
+        self.open_recording_button = QPushButton("Open Recording")
+        self.open_recording_button.clicked.connect(self.open_recording)
+        group3_layout.addWidget(self.open_recording_button)
+
 
 
         control_layout.addLayout(group3_layout)
 
+        # 采集状态面板：读取耗时、节拍延迟、写盘耗时、缓冲占用和错误数
+        self.telemetry_label = QLabel("")
+        self.telemetry_label.setFont(QFontDatabase.systemFont(QFontDatabase.FixedFont))
+        control_layout.addWidget(self.telemetry_label)
+
         control_layout.addStretch()
 
         # 将控件容器和绘图区添加到 QSplitter
         splitter.addWidget(control_container)
         splitter.addWidget(self.plot_widget)
 
-        # 初始化数据
-        self.x_data = []
-        self.y_data = []
-        self.y1_data=[]
+        # 初始化数据：每个通道一个环形缓冲、一个覆盖整个采集过程的 min/max 聚合和一条常驻曲线
+        self.plot_buffers = {}
+        self.plot_pyramids = {}
+        self.plot_curves = {}
+        self.plot_titles = {}
+        self.plot_range = None
+        self.formula = Formula(self.formula_input.text())
 
-        # 初始化定时器
+        # 初始化定时器：只负责按帧率刷新界面，采样在 SamplerWorker 中进行
         self.timer = QTimer()
         self.timer.timeout.connect(self.update_data)
+        self.session = None
+
+        # 回放已记录的文件：视图范围变化时按可见范围重新取数据
+        self.recording = None
+        self.recording_pyramids = {}
+        self.plot_widget.getViewBox().sigXRangeChanged.connect(self.update_replay_view)
 
         # 连接设备
-        self.device = None
-        self.shdlc_port = None
+        self.backend = None
         self.select_port = None
         self.file_name = None
-        self.SEK_ports=['Port1','Port2']
-        self.port_dict = {'Port1': 0, 'Port2': 1}
+        self.SEK_ports=[]
+        self.port_dict = PORT_DICT
+
+        # 后台发现 SensorBridge：先按缓存的结果显示串口列表，窗口显示后再开始探测，定时检查结果刷新列表。
+        # 用户没有手动选择串口时自动选中识别出的 SensorBridge
+        if discover_bridges:
+            self.discovery = BridgeDiscovery()
+        else:
+            self.discovery = BridgeDiscovery(cache_file=None, list_ports=list)
+        self.discovery.refresh(probe=False)
+        self.discovery_version = None
+        self.serial_ports_chosen = False
+        self.connection_pending = False
+        self.serial_port_list.itemSelectionChanged.connect(self.on_serial_ports_selected)
+        self.update_serial_ports()
+        self.discovery_timer = QTimer()
+        self.discovery_timer.timeout.connect(self.update_serial_ports)
+        self.discovery_timer.start(DISCOVERY_REFRESH)
+        if discover_bridges:
+            QTimer.singleShot(DISCOVERY_DELAY, self.discovery.start)
 
         # 初始化 TextItem
         self.voltage_text_item = pg.TextItem(color='g')
@@ -161,95 +286,307 @@ class SensorApp(QMainWindow):
         self.voltage_text_item.setPos(0.5, 5.5)  # 上方中部
         self.result_text_item.setPos(0.5, 5.0)  # 上方中部
 
-    def on_port1_checkbox_changed(self, state):
+    def on_port_checkbox_changed(self, port, state):
         if state == Qt.Checked:
-            self.SEK_ports.append('Port1')
+            self.SEK_ports.append(port)
         else:
-            self.SEK_ports.remove('Port1')
+            self.SEK_ports.remove(port)
 
-    def on_port2_checkbox_changed(self, state):
-        if state == Qt.Checked:
-            self.SEK_ports.append('Port2')
-        else:
-            self.SEK_ports.remove('Port2')
+    def selected_serial_ports(self):
+        # 列表项显示设备信息，串口名在 Qt.UserRole 中
+        return [self.serial_port_list.item(i).data(Qt.UserRole) for i in range(self.serial_port_list.count())
+                if self.serial_port_list.item(i).isSelected()]
+
+    def on_serial_ports_selected(self):
+        self.serial_ports_chosen = True
+        self.update_port_checkboxes()
 
-    def timeToEpochUTC(inputTimeStr, ):
-        # Convert string to datetime object
-        inputTime = dt.datetime.strptime(inputTimeStr, '%Y-%m-%dT%H:%M:%S')
-        # Add timezone to datetime object
-        inputTime = inputTime.replace(tzinfo=pytz.timezone('Europe/Zurich'))
-        # Return seconds since 1970
-        return (inputTime - dt.datetime(1970, 1, 1, 0, 0, 0, 0, pytz.timezone('UTC'))).total_seconds()
+    def update_port_checkboxes(self):
+        # 按选中的设备数重建端口复选框，已有端口保持原来的勾选状态，新端口默认勾选
+        if self.backend is not None:
+            return
+        bridges = max(len(self.selected_serial_ports()), 1)
+        ports = [f'Port{i + 1}' for i in range(bridges * len(PORT_DICT))]
+        for port in list(self.port_checkboxes):
+            if port not in ports:
+                self.port_checkbox_layout.removeWidget(self.port_checkboxes[port])
+                self.port_checkboxes.pop(port).deleteLater()
+                if port in self.SEK_ports:
+                    self.SEK_ports.remove(port)
+        for i, port in enumerate(ports):
+            if port not in self.port_checkboxes:
+                checkbox = QCheckBox(port)
+                checkbox.setChecked(True)
+                checkbox.stateChanged.connect(lambda state, port=port: self.on_port_checkbox_changed(port, state))
+                self.port_checkbox_layout.addWidget(checkbox, i // len(PORT_DICT), i % len(PORT_DICT))
+                self.port_checkboxes[port] = checkbox
+                self.SEK_ports.append(port)
 
     def update_serial_ports(self):
-        # 获取系统中所有可用的串口
-        ports = serial.tools.list_ports.comports()
-        self.serial_port_combo.clear()
-        for port in ports:
-            self.serial_port_combo.addItem(port.device)
-
-    def create_edf_file(self):
-        column_metadata = {'Epoch_UTC': {'Format': '.2f', 'Type': 'float64', 'Unit': 's'}}
-                           # 'voltage': {'Format': '.1f', 'Type': 'float', 'Unit': 'V'},
-                           # 'calcuted_value': {'Format': '.1f', 'Type': 'float', 'Unit': 'U'}}
-
-        header = {'appinfo': 'desigen by NWU'}
-        header.update(eval(self.custom_header_input.toPlainText()))
-        # 检查文件是否存在
-        current_time = dt.datetime.now().strftime('%Y-%m-%d_%H-%M-%S')
-        testname = header.get('TestName') if 'TestName' in header else ''
-
-        if not(testname =='' ):
-            self.file_name = current_time+'_'+testname+'.edf'
-        else:
-            self.file_name = f"{current_time}.edf"
-        columns = ['Epoch_UTC']
-        for port in self.SEK_ports:
-            if port in header:
-                column = port+header[port]['SensorName']+header[port]['SensorId']+'voltage'
-                columns = columns+[column]
-                column_metadata.update({column: {'Format': '.1f', 'Type': 'float', 'Unit': 'V'}})
-                column = port+header[port]['SensorName']+header[port]['SensorId']+'calcuted_value'
-                columns = columns+[column]
-                column_metadata.update({column: {'Format': '.1f', 'Type': 'float', 'Unit': 'U'}})
-        df = pd.DataFrame(columns=columns)
-        if not(os.path.exists(self.file_name)):
-            fastedf.to_edf(df, self.file_name, header=header, column_metadata=column_metadata)
+        # 发现结果变化时重建串口列表，保留原来的选择；重建时屏蔽信号，端口复选框只在选中的设备数变化时重建
+        if self.discovery.version == self.discovery_version:
+            return
+        self.discovery_version = self.discovery.version
+        ports = self.discovery.ports()
+        selected = set(self.selected_serial_ports())
+        if self.backend is None and not self.serial_ports_chosen:
+            # 不自动选中模拟设备，以免误把模拟数据记录下来；探测期间保持原来的选择
+            bridges = {info.port for info in ports if info.state == 'bridge'}
+            if bridges or not any(info.state == 'probing' for info in ports):
+                selected = bridges
+        self.serial_port_list.blockSignals(True)
+        self.serial_port_list.clear()
+        # 不需要硬件的模拟设备排在串口之后
+        entries = [(info.port, describe_port(info)) for info in ports] + [(name, name) for name in SIMULATED_BACKENDS]
+        for name, text in entries:
+            item = QListWidgetItem(text)
+            item.setData(Qt.UserRole, name)
+            self.serial_port_list.addItem(item)
+            item.setSelected(name in selected)
+        self.serial_port_list.blockSignals(False)
+        self.update_port_checkboxes()
+
+    def rescan_serial_ports(self):
+        # 忽略缓存，重新探测所有未连接的串口
+        self.discovery.rescan()
+        self.update_serial_ports()
 
     def connect_device(self):
 
-        if self.device is None or self.shdlc_port is None:
+        if self.backend is None:
             try:
-                baudrate = 460800
-                port = self.serial_port_combo.currentText()
-                self.shdlc_port = ShdlcSerialPort(port=port, baudrate=baudrate)
-                self.device = SensorBridgeShdlcDevice(ShdlcConnection(self.shdlc_port), slave_address=0)
                 power_voltage = float(self.power_combo.currentText().replace("V", ""))
-
-                for port in self.SEK_ports:
-                    self.device.set_supply_voltage(self.port_dict[port], voltage=power_voltage)
+                # 连接的串口不再探测；所选串口正在探测时等探测结束后再连接，不阻塞界面
+                serial_ports = self.selected_serial_ports()
+                self.discovery.set_busy(serial_ports)
+                if self.discovery.probing(serial_ports):
+                    if not self.connection_pending:
+                        print("Waiting for serial port detection to finish...")
+                        self.connection_pending = True
+                        QTimer.singleShot(PROBE_RETRY, self.retry_connection)
+                    return
+                backend = BridgeGroup([create_backend(SIMULATED_BACKENDS.get(port, port)) for port in serial_ports])
+                backend.connect(power_voltage, [backend.port_dict[port] for port in self.SEK_ports])
+                self.backend = backend
+                self.port_dict = backend.port_dict
                 print("Device connected successfully.")
             except Exception as e:
+                self.discovery.set_busy(())
                 print(f"Failed to connect to device: {e}")
         else:
             print("Device already connected.")
 
+    def retry_connection(self):
+        if self.discovery.probing(self.selected_serial_ports()):
+            QTimer.singleShot(PROBE_RETRY, self.retry_connection)
+            return
+        self.connection_pending = False
+        if self.backend is None:
+            self.toggle_connection()
+
     def update_sampling_rate(self):
         sampling_rate = self.sampling_rate_spinbox.value()
-        if sampling_rate > 0:
-            interval = int(1000 / sampling_rate)  # 将 Hz 转换为毫秒
-            self.timer.setInterval(interval)
+        if sampling_rate > 0 and self.session is not None:
+            self.session.set_sampling_rate(sampling_rate)
+
+    def init_plot(self, ports):
+        self.plot_widget.clear()
+        self.plot_buffers = {}
+        self.plot_pyramids = {}
+        self.plot_curves = {}
+        self.plot_titles = {}
+        self.plot_range = None
+        for i, port in enumerate(ports):
+            curve = self.plot_widget.plot(pen=PORT_PENS.get(port, pg.intColor(i, len(ports))), name=port)
+            # 长时间数据按像素做峰值抽取，并只处理可见范围内的点
+            curve.setDownsampling(auto=True, method='peak')
+            curve.setClipToView(True)
+            self.plot_buffers[port] = RingBuffer(PLOT_BUFFER_SIZE)
+            self.plot_pyramids[port] = MinMaxPyramid()
+            self.plot_curves[port] = curve
+
+    def visible_range(self):
+        # 按时间窗口跟随最新数据；窗口为 0 时显示整个采集过程，用户手动缩放后显示当前视图
+        first, latest = self.plot_range
+        window = self.plot_window_spinbox.value()
+        view_box = self.plot_widget.getViewBox()
+        if window > 0:
+            return latest - window, latest
+        if view_box.autoRangeEnabled()[0]:
+            return first, latest
+        return tuple(view_box.viewRange()[0])
+
+    def update_plot(self):
+        # 每条曲线只传入与屏幕宽度相当的点数：可见样本较少且仍在环形缓冲中时用原始数据，
+        # 否则从 min/max 聚合中取对应分辨率的一层，看整个采集过程也不会丢失尖峰
+        if self.plot_range is None:
+            return
+        x0, x1 = self.visible_range()
+        width = max(int(self.plot_widget.getViewBox().width()), 100)
+        for port, curve in self.plot_curves.items():
+            buffer = self.plot_buffers[port]
+            pyramid = self.plot_pyramids[port]
+            if buffer.covers(x0) and pyramid.count(x0, x1) <= RAW_POINTS_PER_PIXEL * width:
+                curve.setData(*buffer.range(x0, x1))
+            else:
+                curve.setData(*pyramid.query(x0, x1, width))
+        if self.plot_window_spinbox.value() > 0:
+            self.plot_widget.setXRange(x0, x1, padding=0)
+
+    def start_session(self, plan):
+        self.close_recording()
+        # 每个端口一条电压曲线，另加选择绘制的派生信号
+        self.init_plot([channel.port for channel in plan.channels] +
+                       [derived.column for channel in plan.channels for derived in channel.derived if derived.plot])
+        session = AcquisitionSession(self.backend, plan, self.sampling_rate_spinbox.value(),
+                                     file_format=self.file_format_combo.currentText())
+        try:
+            if self.metrics_checkbox.isChecked():
+                session.export_metrics(os.path.splitext(session.file_name)[0] + '.prom')
+            if self.publish_checkbox.isChecked():
+                print(f"Publishing live data on localhost:{session.publish()}")
+            session.start()
+        except Exception:
+            session.stop()
+            raise
+        self.session = session
+        self.file_name = session.file_name
+        self.timer.start(int(1000 / PLOT_FPS))
+
+    def stop_session(self):
+        self.timer.stop()
+        if self.session is not None:
+            session = self.session
+            self.session = None
+            self.show_rows(session, session.stop())  # 处理缓冲中剩余的数据
+
+    def closeEvent(self, event):
+        # 关闭窗口时停止采集，保证缓冲中的数据写入文件
+        self.stop_session()
+        self.close_recording()
+        self.discovery_timer.stop()
+        self.discovery.stop()
+        super().closeEvent(event)
+
+    def open_recording(self):
+        if self.session is not None:
+            print("Please stop data collection first.")
+            return
+        file_name, _ = QFileDialog.getOpenFileName(self, "Open Recording", '',
+                                                   "Recordings (*.edf *.sekb *.sekidx);;All files (*)")
+        if file_name:
+            self.load_recording(file_name)
+
+    def load_recording(self, file_name):
+        self.close_recording()
+        try:
+            recording = open_recording_file(file_name)
+        except (OSError, ValueError) as e:
+            print(f"Failed to open recording: {e}")
+            return
+
+        # 第一次打开时要完整读一遍文件建立 min/max 聚合，之后使用缓存
+        progress = QProgressDialog(f"Loading {os.path.basename(file_name)}", "Cancel", 0, 1000, self)
+        progress.setWindowModality(Qt.WindowModal)
+        progress.setMinimumDuration(500)
+
+        def update_progress(done, total):
+            progress.setValue(int(1000 * done / max(total, 1)))
+            return not progress.wasCanceled()
+
+        try:
+            pyramids = recording.build_pyramids(progress=update_progress)
+            time_range = recording.time_range()
+        except (OSError, ValueError) as e:
+            print(f"Failed to read recording: {e}")
+            pyramids = time_range = None
+        progress.close()
+        if pyramids is None or time_range is None:
+            recording.close()
+            return
+
+        self.plot_widget.clear()
+        self.plot_buffers = {}
+        self.plot_curves = {}
+        for i, column in enumerate(pyramids):
+            self.plot_curves[column] = self.plot_widget.plot(pen=pg.intColor(i, len(pyramids)), name=column)
+        self.recording = recording
+        self.recording_pyramids = pyramids
+        start, end = (dt.datetime.fromtimestamp(t).strftime('%Y-%m-%d %H:%M:%S') for t in time_range)
+        self.plot_widget.setTitle(f"{os.path.basename(file_name)}: {start} - {end}", color='#000000', size='12pt')
+        self.plot_widget.enableAutoRange(axis='y')
+        self.plot_widget.setXRange(*time_range, padding=0)
+        self.update_replay_view()
+
+    def close_recording(self):
+        if self.recording is not None:
+            self.recording.close()
+            self.recording = None
+            self.recording_pyramids = {}
+            self.plot_widget.clear()
+            self.plot_curves = {}
+            self.plot_widget.setYRange(0, 6)
+
+    def update_replay_view(self):
+        # 可见范围内样本不多时按时间范围加载原始数据，否则取与屏幕宽度相当的 min/max 聚合
+        if self.recording is None or not self.recording_pyramids:
+            return
+        view_box = self.plot_widget.getViewBox()
+        x0, x1 = view_box.viewRange()[0]
+        width = max(int(view_box.width()), 100)
+        if next(iter(self.recording_pyramids.values())).count(x0, x1) <= RAW_POINTS_PER_PIXEL * width:
+            data = self.recording.load(x0, x1)
+            for column, curve in self.plot_curves.items():
+                curve.setData(data[self.recording.columns[0]], data[column])
+        else:
+            for column, curve in self.plot_curves.items():
+                curve.setData(*self.recording_pyramids[column].query(x0, x1, width))
+
+    def update_rate_status(self, session):
+        stats = session.stats()
+        # 各端口频率不同时分别显示每个采样线程
+        rates = sorted({(item['requested_rate'], item['achieved_rate']) for item in stats['workers']}, reverse=True)
+        self.rate_status_label.setText(
+            "Achieved: " + ", ".join(f"{achieved:.2f} / {requested:.2f} Hz" for requested, achieved in rates) +
+            f", Missed: {stats['missed']}, Max late: {stats['max_lateness'] * 1000:.2f} ms")
+
+    def update_formula(self):
+        try:
+            self.formula = Formula(self.formula_input.text())
+            self.formula_input.setStyleSheet("")
+            self.formula_input.setToolTip(self.formula_input.toolTip().split('\n')[0])
+        except ValueError as e:
+            self.formula = None
+            self.formula_input.setStyleSheet("border: 1px solid red;")
+            self.formula_input.setToolTip(self.formula_input.toolTip().split('\n')[0] + f"\nInvalid formula: {e}")
+
+    def build_plan(self):
+        # 开始采集时解析一次 custom header，生成只读的通道计划；
+        # 端口可在 header 中用 'Formula' 覆盖默认公式
+        if self.formula is None:
+            raise ValueError(f"invalid formula '{self.formula_input.text()}'")
+        return build_channel_plan(self.custom_header_input.toPlainText(), self.SEK_ports,
+                                  self.port_dict, self.formula, self.latency_checkbox.isChecked())
+
     def toggle_data_collection(self):
-        if self.timer.isActive():
-            self.timer.stop()
+        if self.session is not None:
+            self.stop_session()
             self.start_button.setText("Start")
 
             # self.disconnect_device()
         else:
-            if self.device is not None and self.shdlc_port is not None:
-                self.timer.start(1000)  # 每秒更新一次
+            if self.backend is not None:
+                try:
+                    plan = self.build_plan()
+                except ValueError as e:
+                    print(f"Invalid settings: {e}")
+                    return
+                try:
+                    self.start_session(plan)
+                except Exception as e:
+                    print(f"Failed to start data collection: {e}")
+                    return
                 self.start_button.setText("Stop")
-                self.create_edf_file()
             else:
                 print("Please open the port first.")
 
@@ -257,70 +594,68 @@ class SensorApp(QMainWindow):
         if self.SEK_ports == []:
             print("Please select at least one port.")
             return
-        if self.device is not None or self.shdlc_port is not None:
+        if self.backend is None and not self.selected_serial_ports():
+            print("Please select at least one serial port.")
+            return
+        if self.backend is not None:
             self.open_port_button.setText("Open Port")
+            if self.session is not None:
+                self.stop_session()
+                self.start_button.setText("Start")
             self.disconnect_device()
-            if self.timer.isActive():
-                self.timer.stop()
         else:
-            self.open_port_button.setText("Close Port")
             self.connect_device()
+            if self.backend is not None:
+                self.open_port_button.setText("Close Port")
 
     def disconnect_device(self):
-        if self.device and self.shdlc_port:
+        if self.backend is not None:
             try:
-                for port in self.SEK_ports:
-                    self.device.switch_supply_off(self.port_dict[port])
-                self.shdlc_port.close()
-                self.device = None
-                self.shdlc_port = None
+                self.backend.disconnect()
                 print("Device disconnected successfully.")
             except Exception as e:
                 print(f"Failed to disconnect device: {e}")
+            self.backend = None
+            self.discovery.set_busy(())
+            self.update_port_checkboxes()
+
     def update_data(self):
-        if self.device:
+        if self.session is not None:
             try:
-                df = pd.DataFrame()
-                title=''
-                self.plot_widget.clear()
-                self.x_data.append(time.time())
-                for port in self.SEK_ports:
-                    volt = self.device.measure_voltage(self.port_dict[port])
-                    if port == 'Port1':
-                        self.y_data.append(volt)
-                        self.plot_widget.plot(self.x_data, self.y_data, pen='r', name=port)
-                    if port == 'Port2':
-                        self.y1_data.append(volt)
-                        self.plot_widget.plot(self.x_data, self.y1_data, pen='g', name=port)
-
-
-
-                    # 动态设置 Y 轴范围
-
-                    # 计算公式结果
-                    formula = self.formula_input.text()
-                    if formula:
-                        try:
-                            result = eval(formula.replace('x', str(volt)))
-                        except Exception as e:
-                            result = None
-                    header=eval(self.custom_header_input.toPlainText())
-                    column1 = port + header[port]['SensorName'] + header[port]['SensorId'] + 'voltage'
-                    column2 = port + header[port]['SensorName'] + header[port]['SensorId'] + 'calcuted_value'
-                    if result is not None:
-                        title = title + f"{port}Voltage: {volt:.3f} V Result: {result:.3f} &nbsp;&nbsp;&nbsp;&nbsp;&nbsp;&nbsp;"
-                        df['Epoch_UTC']=[time.time()]
-                        df[column1]=[volt]
-                        df[column2]=[result]
-
-                df.to_csv(self.file_name, header=False, sep=str("\t"), float_format=None,
-                                      encoding='utf-8', lineterminator=u"\n", mode='a', index=False)
-                self.plot_widget.setTitle(title, color='#000000', size='12pt')
-                    # else:
-                    #     self.plot_widget.setTitle(f"Voltage: {volt:.3f} V \nResult: Invalid formula or calculation error")
-
+                self.show_rows(self.session, self.session.poll())
             except Exception as e:
-                print(f"Failed to read voltage: {e}")
+                self.session.metrics.count('update_errors_total')
+                print(f"Failed to update data: {e}")
+
+    def show_rows(self, session, rows):
+        if rows is None:
+            return
+        timestamps = rows[:, 0]
+        self.plot_range = (timestamps[0] if self.plot_range is None else self.plot_range[0], timestamps[-1])
+        for channel in session.plan.channels:
+            # 多台设备时每行只有一台设备的数据，其余通道为 nan
+            voltages = rows[:, channel.voltage_index]
+            valid = ~np.isnan(voltages)
+            if not valid.any():
+                continue
+            if not valid.all():
+                x, voltages, values = timestamps[valid], voltages[valid], rows[valid, channel.value_index]
+            else:
+                x, values = timestamps, rows[:, channel.value_index]
+            self.plot_buffers[channel.port].extend(x, voltages)
+            self.plot_pyramids[channel.port].extend(x, voltages)
+            for derived in channel.derived:
+                # 派生信号在窗口填满前为 nan，不画
+                signal = rows[:, derived.index]
+                finite = valid & ~np.isnan(signal)
+                if derived.plot and finite.any():
+                    self.plot_buffers[derived.column].extend(timestamps[finite], signal[finite])
+                    self.plot_pyramids[derived.column].extend(timestamps[finite], signal[finite])
+            self.plot_titles[channel.port] = f"{channel.port}Voltage: {voltages[-1]:.3f} V Result: {values[-1]:.3f} &nbsp;&nbsp;&nbsp;&nbsp;&nbsp;&nbsp;"
+        self.update_plot()
+        self.plot_widget.setTitle(''.join(self.plot_titles.values()), color='#000000', size='12pt')
+        self.update_rate_status(session)
+        self.telemetry_label.setText(format_status(session.metrics))
 
 
 pg.setConfigOptions(background='w')
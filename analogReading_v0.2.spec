@@ -1,5 +1,17 @@
 # -*- mode: python ; coding: utf-8 -*-
+# onedir 打包：启动时不再把整个程序解压到临时目录，也不用 UPX（解压慢且易被杀毒软件拦截）。
+# 排除界面用不到的大模块；pandas/sensirion_fastedf 已不在记录路径上。
+# 打包后用 benchmark_startup.py 检查启动时间
 
+# 界面和采集都不需要的模块，包括 pyqtgraph 的可选依赖
+EXCLUDES = [
+    'pandas', 'sensirion_fastedf', 'pyarrow', 'pytz',
+    'matplotlib', 'scipy', 'PIL', 'IPython', 'jupyter_client', 'tkinter', 'OpenGL',
+    'pyqtgraph.opengl', 'pyqtgraph.examples', 'pyqtgraph.jupyter',
+    'PyQt5.QtWebEngine', 'PyQt5.QtWebEngineCore', 'PyQt5.QtWebEngineWidgets', 'PyQt5.QtWebKit',
+    'PyQt5.QtQml', 'PyQt5.QtQuick', 'PyQt5.QtMultimedia', 'PyQt5.QtBluetooth', 'PyQt5.QtLocation',
+    'PyQt5.QtPositioning', 'PyQt5.QtSensors', 'PyQt5.QtSql', 'PyQt5.QtDesigner', 'PyQt5.QtHelp',
+]
 
 a = Analysis(
     ['analogReading_v0.2.py'],
@@ -10,25 +22,22 @@ a = Analysis(
     hookspath=[],
     hooksconfig={},
     runtime_hooks=[],
-    excludes=[],
+    excludes=EXCLUDES,
     noarchive=False,
-    optimize=0,
+    optimize=1,
 )
 pyz = PYZ(a.pure)
 
 exe = EXE(
     pyz,
     a.scripts,
-    a.binaries,
-    a.datas,
     [],
+    exclude_binaries=True,
     name='analogReading_v0.2',
     debug=False,
     bootloader_ignore_signals=False,
     strip=False,
-    upx=True,
-    upx_exclude=[],
-    runtime_tmpdir=None,
+    upx=False,
     console=False,
     disable_windowed_traceback=False,
     argv_emulation=False,
@@ -36,3 +45,12 @@ exe = EXE(
     codesign_identity=None,
     entitlements_file=None,
 )
+coll = COLLECT(
+    exe,
+    a.binaries,
+    a.datas,
+    strip=False,
+    upx=False,
+    upx_exclude=[],
+    name='analogReading_v0.2',
+)
@@ -0,0 +1,427 @@
+import argparse
+import csv
+import json
+import math
+import os
+import re
+import sys
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from sek_acquisition import SEGMENT_INDEX_EXTENSION
+from sek_recording import CHUNK_BYTES, EXPORT_FORMATS, ExportWriter, open_recording_file
+
+# 批量处理整个目录的记录（.edf / .sekb / 分段记录的 .sekidx）：统计每个通道（min/max/mean/std、实际频率、间断），
+# 重采样到公共时间网格，或把多次采集合并为一个文件。每个文件由进程池中的一个进程按块流式处理，
+# 每个进程的内存只与块大小有关
+
+RECORDING_EXTENSIONS = ('.edf', '.sekb', SEGMENT_INDEX_EXTENSION)
+GAP_FACTOR = 5.0  # 相邻样本间隔超过通道典型间隔的该倍数时计为间断
+RESAMPLE_METHODS = ('mean', 'min', 'max')
+SUMMARY_FIELDS = ['file', 'column', 'samples', 'start', 'end', 'rate', 'min', 'max', 'mean', 'std',
+                  'gaps', 'gap_seconds', 'max_gap']
+
+
+def segment_files(index_file):
+    # 分段记录索引中列出的段文件名（压缩中的段同时包括压缩前后的文件名）
+    try:
+        with open(index_file, encoding='utf-8') as f:
+            segments = json.load(f)['segments']
+    except (OSError, ValueError, KeyError, TypeError):
+        return set()
+    names = set()
+    for segment in segments:
+        names.add(segment['file'])
+        if segment['file'].endswith('.gz'):
+            names.add(segment['file'][:-len('.gz')])
+    return names
+
+
+def find_recordings(paths, recursive=False):
+    # 文件直接使用；目录中按文件名排序取出记录文件，分段记录按索引文件整体处理，跳过其中的各段
+    files = []
+    for path in paths:
+        if not os.path.isdir(path):
+            files.append(path)
+            continue
+        for directory, subdirectories, names in os.walk(path):
+            subdirectories.sort()
+            segments = set()
+            for name in names:
+                if name.lower().endswith(SEGMENT_INDEX_EXTENSION):
+                    segments |= segment_files(os.path.join(directory, name))
+            files += [os.path.join(directory, name) for name in sorted(names)
+                      if name.lower().endswith(RECORDING_EXTENSIONS) and name not in segments]
+            if not recursive:
+                break
+    return files
+
+
+class ChannelSummary:
+    # 一个通道的流式统计：均值和方差按块合并（Chan 等人的并行算法），
+    # 间断以第一块中样本间隔的中位数为典型间隔
+    def __init__(self, gap):
+        self.gap = gap
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = np.inf
+        self.max = -np.inf
+        self.start = None
+        self.end = None
+        self.threshold = None
+        self.gaps = 0
+        self.gap_seconds = 0.0
+        self.max_gap = 0.0
+
+    def update(self, t, values):
+        valid = ~np.isnan(values)
+        t, values = t[valid], values[valid]
+        if not len(values):
+            return
+        n = len(values)
+        mean = float(values.mean())
+        m2 = float(((values - mean) ** 2).sum())
+        total = self.count + n
+        delta = mean - self.mean
+        self.mean += delta * n / total
+        self.m2 += m2 + delta * delta * self.count * n / total
+        self.count = total
+        self.min = min(self.min, float(values.min()))
+        self.max = max(self.max, float(values.max()))
+
+        times = t if self.end is None else np.concatenate([[self.end], t])
+        if self.start is None:
+            self.start = float(t[0])
+        self.end = float(t[-1])
+        intervals = np.diff(times)
+        if self.threshold is None:
+            if self.gap is not None:
+                self.threshold = self.gap
+            elif len(intervals):
+                self.threshold = GAP_FACTOR * float(np.median(intervals))
+            else:
+                return
+        gaps = intervals[intervals > self.threshold]
+        self.gaps += len(gaps)
+        self.gap_seconds += float(gaps.sum())
+        if len(gaps):
+            self.max_gap = max(self.max_gap, float(gaps.max()))
+
+    def result(self):
+        duration = self.end - self.start if self.count else 0.0
+        return {
+            'samples': self.count,
+            'start': self.start,
+            'end': self.end,
+            'rate': (self.count - 1) / duration if duration > 0 else None,
+            'min': self.min if self.count else None,
+            'max': self.max if self.count else None,
+            'mean': self.mean if self.count else None,
+            'std': (self.m2 / self.count) ** 0.5 if self.count else None,
+            'gaps': self.gaps,
+            'gap_seconds': self.gap_seconds,
+            'max_gap': self.max_gap,
+        }
+
+
+def summarize_file(file_name, chunk_bytes=CHUNK_BYTES, gap=None):
+    # 在工作进程中运行：返回 {'file', 'rows', 'channels': {列名: 统计}}
+    with open_recording_file(file_name) as recording:
+        time_column = recording.columns[0]
+        summaries = {column: ChannelSummary(gap) for column in recording.columns[1:]}
+        rows = 0
+        for start, stop, data in recording.iter_chunks(chunk_bytes=chunk_bytes):
+            t = np.asarray(data[time_column], dtype=np.float64)
+            rows += len(t)
+            for column, summary in summaries.items():
+                summary.update(t, np.asarray(data[column], dtype=np.float64))
+    return {'file': file_name, 'rows': rows,
+            'channels': {column: summary.result() for column, summary in summaries.items()}}
+
+
+class Resampler:
+    # 把按时间排序的数据块聚合到 interval 整数倍的网格上（各文件的网格相互对齐），
+    # 每格取有效值的 mean/min/max，没有样本的格子不输出。块末尾未完成的一格留到下一块
+    def __init__(self, columns, interval, method='mean'):
+        if method not in RESAMPLE_METHODS:
+            raise ValueError(f"unknown method '{method}', expected one of {', '.join(RESAMPLE_METHODS)}")
+        self.columns = list(columns)
+        self.interval = interval
+        self.method = method
+        self.carry = np.empty((0, len(self.columns)))
+
+    def process(self, data, final=False):
+        rows = np.concatenate([self.carry, np.column_stack([np.asarray(data[column], dtype=np.float64)
+                                                            for column in self.columns])])
+        bins = np.floor(rows[:, 0] / self.interval).astype(np.int64)
+        split = len(rows) if final or not len(rows) else int(np.searchsorted(bins, bins[-1]))
+        rows, bins, self.carry = rows[:split], bins[:split], rows[split:]
+        if not len(rows):
+            return None
+        starts = np.concatenate([[0], np.flatnonzero(np.diff(bins)) + 1])
+        values = rows[:, 1:]
+        if self.method == 'mean':
+            valid = ~np.isnan(values)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                result = np.add.reduceat(np.where(valid, values, 0.0), starts) / np.add.reduceat(valid, starts)
+        elif self.method == 'min':
+            result = np.fmin.reduceat(values, starts)
+        else:
+            result = np.fmax.reduceat(values, starts)
+        return dict(zip(self.columns, [bins[starts] * self.interval] + list(result.T)))
+
+    def flush(self):
+        return self.process({column: np.empty(0) for column in self.columns}, final=True)
+
+
+def write_rows(writer, data):
+    # 写出一块结果（None 表示没有完整的行），返回行数
+    if data is None:
+        return 0
+    writer.write(data)
+    return len(data[writer.columns[0]])
+
+
+def resample_file(file_name, output, interval, method='mean', chunk_bytes=CHUNK_BYTES):
+    # 在工作进程中运行：重采样 file_name 写入 output，返回写出的行数
+    rows = 0
+    with open_recording_file(file_name) as recording:
+        header = dict(recording.header, ResampleInterval=interval, ResampleMethod=method)
+        column_metadata = [dict(meta) for meta in recording.column_metadata]
+        # EDF 的时间列至少保留能区分网格的小数位数
+        decimals = max(math.ceil(-math.log10(interval)) + 1, 0)
+        current = re.fullmatch(r'\.(\d+)f', column_metadata[0].get('Format', ''))
+        if current is None or int(current.group(1)) < decimals:
+            column_metadata[0]['Format'] = f'.{decimals}f'
+        writer = ExportWriter(output, recording.columns, column_metadata, recording.dtypes, header)
+        resampler = Resampler(recording.columns, interval, method)
+        try:
+            for start, stop, data in recording.iter_chunks(chunk_bytes=chunk_bytes):
+                rows += write_rows(writer, resampler.process(data))
+            rows += write_rows(writer, resampler.flush())
+        finally:
+            writer.close()
+    return rows
+
+
+def merge_files(file_names, output, chunk_bytes=CHUNK_BYTES, sources=None):
+    # 把若干记录按时间顺序合并为一个文件：列取所有输入的并集（缺少的列为 nan），
+    # 时间重叠的记录按时间交错，时间戳相同的行合并为一行（同一列取有效值的平均）。
+    # 总是从已读到的最晚时间最早的输入读下一块，内存只与块大小和输入个数有关。
+    # sources 为写入表头 MergedFrom 的原始记录文件名（与 file_names 一一对应，输入为重采样的临时文件时使用）
+    sources = list(file_names if sources is None else sources)
+    recordings = [open_recording_file(file_name) for file_name in file_names]
+    try:
+        ranges = [recording.time_range() for recording in recordings]
+        order = sorted((i for i, r in enumerate(ranges) if r is not None), key=lambda i: ranges[i][0])
+        order += [i for i, r in enumerate(ranges) if r is None]
+        recordings = [recordings[i] for i in order]
+        sources = [sources[i] for i in order]
+        columns, metadata, dtypes = [], [], []
+        for recording in recordings:
+            for column, meta, dtype in zip(recording.columns, recording.column_metadata, recording.dtypes):
+                if column not in columns:
+                    columns.append(column)
+                    metadata.append(meta)
+                    dtypes.append(dtype)
+        header = dict(recordings[0].header) if recordings else {}
+        header['MergedFrom'] = [os.path.basename(source) for source in sources]
+        writer = ExportWriter(output, columns, metadata, dtypes, header)
+
+        streams = [recording.iter_chunks(chunk_bytes=chunk_bytes) for recording in recordings]
+        positions = [[columns.index(column) for column in recording.columns] for recording in recordings]
+        seen = [-np.inf] * len(streams)  # 每个输入已读到的最晚时间，读完为 inf
+        pending = np.empty((0, len(columns)))
+        rows = 0
+        try:
+            while pending.size or min(seen) < np.inf:
+                i = int(np.argmin(seen))
+                if seen[i] < np.inf:
+                    chunk = next(streams[i], None)
+                    if chunk is None:
+                        seen[i] = np.inf
+                    else:
+                        data = chunk[2]
+                        part = np.full((len(data[recordings[i].columns[0]]), len(columns)), np.nan)
+                        for column, position in zip(recordings[i].columns, positions[i]):
+                            part[:, position] = data[column]
+                        if len(part):
+                            seen[i] = part[-1, 0]
+                            pending = np.concatenate([pending, part])
+                watermark = min(seen)
+                pending = pending[np.argsort(pending[:, 0], kind='stable')]
+                split = int(np.searchsorted(pending[:, 0], watermark, 'right'))
+                ready, pending = pending[:split], pending[split:]
+                if len(ready):
+                    ready = combine_rows(ready)
+                    writer.write(dict(zip(columns, ready.T)))
+                    rows += len(ready)
+        finally:
+            writer.close()
+    finally:
+        for recording in recordings:
+            recording.close()
+    return rows
+
+
+def combine_rows(rows):
+    # 时间戳相同的行合并为一行，每列取有效值的平均
+    starts = np.concatenate([[0], np.flatnonzero(np.diff(rows[:, 0])) + 1])
+    if len(starts) == len(rows):
+        return rows
+    valid = ~np.isnan(rows)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.add.reduceat(np.where(valid, rows, 0.0), starts) / np.add.reduceat(valid, starts)
+
+
+def run_parallel(function, tasks, jobs):
+    # 按 tasks 的顺序返回 (结果, 异常)；jobs 为 1 时在本进程中运行
+    if jobs == 1:
+        results = []
+        for args in tasks:
+            try:
+                results.append((function(*args), None))
+            except Exception as e:
+                results.append((None, e))
+        return results
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        futures = [executor.submit(function, *args) for args in tasks]
+        return [(None, future.exception()) if future.exception() else (future.result(), None) for future in futures]
+
+
+def write_summary(results, output):
+    rows = [dict(file=result['file'], column=column, **summary)
+            for result in results for column, summary in result['channels'].items()]
+    if output.lower().endswith('.json'):
+        with open(output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=1)
+    else:
+        with open(output, 'w', encoding='utf-8', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=SUMMARY_FIELDS)
+            writer.writeheader()
+            writer.writerows(rows)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Summarize, resample or merge many recordings (.edf, .sekb "
+                                                 "or segmented .sekidx) in parallel.")
+    parser.add_argument('--jobs', type=int, default=os.cpu_count() or 1,
+                        help="worker processes (default: number of CPUs)")
+    parser.add_argument('--chunk-mb', type=float, default=CHUNK_BYTES / 2 ** 20,
+                        help=f"size of the chunks each worker reads at a time (default: {CHUNK_BYTES // 2 ** 20})")
+    parser.add_argument('--recursive', action='store_true', help="also search subdirectories")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    summary = commands.add_parser('summary', help="per-channel min/max/mean/std, achieved rate and gaps")
+    summary.add_argument('input', nargs='+', help="recordings or directories")
+    summary.add_argument('--output', help="write the summary as CSV, or as JSON if it ends with .json")
+    summary.add_argument('--gap', type=float,
+                         help=f"interval in seconds counted as a gap (default: {GAP_FACTOR:g}x the typical "
+                              f"interval of each channel)")
+
+    resample = commands.add_parser('resample', help="resample each recording to a common time grid")
+    resample.add_argument('input', nargs='+', help="recordings or directories")
+    resample.add_argument('--interval', type=float, required=True, help="grid interval in seconds")
+    resample.add_argument('--method', default='mean', choices=RESAMPLE_METHODS, help="(default: mean)")
+    resample.add_argument('--format', default='edf', choices=sorted(set(EXPORT_FORMATS.values())),
+                          help="output format (default: edf)")
+    resample.add_argument('--output-dir', help="directory for the resampled files (default: next to the input)")
+
+    merge = commands.add_parser('merge', help="merge recordings into one time-ordered file")
+    merge.add_argument('input', nargs='+', help="recordings or directories")
+    merge.add_argument('--output', required=True, help="merged file (.edf, .csv or .parquet)")
+    merge.add_argument('--interval', type=float,
+                       help="resample every input to this grid (in parallel) before merging, so that "
+                            "simultaneous runs end up in the same rows")
+    merge.add_argument('--method', default='mean', choices=RESAMPLE_METHODS, help="(default: mean)")
+    args = parser.parse_args(argv)
+    if getattr(args, 'interval', None) is not None and args.interval <= 0:
+        parser.error("--interval must be positive")
+    if args.jobs < 1:
+        parser.error("--jobs must be at least 1")
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    chunk_bytes = max(int(args.chunk_mb * 2 ** 20), 1)
+    files = find_recordings(args.input, args.recursive)
+    if not files:
+        print("No recordings found")
+        return 1
+    failed = 0
+
+    if args.command == 'summary':
+        results = []
+        for file_name, (result, error) in zip(files, run_parallel(
+                summarize_file, [(file_name, chunk_bytes, args.gap) for file_name in files], args.jobs)):
+            if error is not None:
+                print(f"Failed to read {file_name}: {error}")
+                failed += 1
+                continue
+            results.append(result)
+            if not result['rows']:
+                print(f"{os.path.basename(file_name)}: no samples")
+            for column, summary in result['channels'].items():
+                if summary['samples']:
+                    rate = f"{summary['rate']:.3f} Hz" if summary['rate'] is not None else "-"
+                    print(f"{os.path.basename(file_name)} {column}: n={summary['samples']} rate={rate} "
+                          f"min={summary['min']:.4g} max={summary['max']:.4g} mean={summary['mean']:.4g} "
+                          f"std={summary['std']:.4g} gaps={summary['gaps']} ({summary['gap_seconds']:.1f} s)")
+        if args.output:
+            write_summary(results, args.output)
+            print(f"Summary saved to {args.output}")
+
+    elif args.command == 'resample':
+        extension = {file_format: extension for extension, file_format in EXPORT_FORMATS.items()}[args.format]
+        if args.output_dir:
+            os.makedirs(args.output_dir, exist_ok=True)
+        tasks = []
+        for file_name in files:
+            output = f"{os.path.splitext(file_name)[0]}_{args.interval:g}s{extension}"
+            if args.output_dir:
+                output = os.path.join(args.output_dir, os.path.basename(output))
+            if os.path.exists(output):
+                print(f"Skipping {file_name}: {output} already exists")
+                failed += 1
+                continue
+            tasks.append((file_name, output, args.interval, args.method, chunk_bytes))
+        for task, (rows, error) in zip(tasks, run_parallel(resample_file, tasks, args.jobs)):
+            if error is not None:
+                print(f"Failed to resample {task[0]}: {error}")
+                failed += 1
+            else:
+                print(f"{task[0]} -> {task[1]} ({rows} rows)")
+
+    else:
+        if os.path.exists(args.output):
+            print(f"{args.output} already exists")
+            return 1
+        with tempfile.TemporaryDirectory(prefix='sek_merge_') as directory:
+            inputs = sources = files
+            if args.interval is not None:
+                # 先并行重采样到临时文件，再按时间合并
+                tasks = [(file_name, os.path.join(directory, f"{i}.edf"), args.interval, args.method, chunk_bytes)
+                         for i, file_name in enumerate(files)]
+                inputs, sources = [], []
+                for task, (rows, error) in zip(tasks, run_parallel(resample_file, tasks, args.jobs)):
+                    if error is not None:
+                        print(f"Failed to resample {task[0]}: {error}")
+                        failed += 1
+                    else:
+                        inputs.append(task[1])
+                        sources.append(task[0])
+            try:
+                rows = merge_files(inputs, args.output, chunk_bytes, sources)
+            except (OSError, ValueError, ImportError) as e:
+                print(f"Failed to merge: {e}")
+                return 1
+        print(f"Merged {len(inputs)} recordings into {args.output} ({rows} rows)")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
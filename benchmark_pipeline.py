@@ -0,0 +1,374 @@
+import argparse
+import datetime as dt
+import importlib.util
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+from sek_acquisition import AcquisitionSession, Formula, SampleScheduler, build_channel_plan, create_edf_file
+from sek_devices import BridgeGroup, SignalGenerator, create_backend
+
+# 采集 → 换算 → 写盘 → 绘图 全流程的基准测试，使用模拟设备，不需要硬件。
+# current 为当前的 AcquisitionSession 流程，legacy 按 v0.2 原先 update_data 的做法
+# （每拍逐端口读取、eval 公式和表头、一行 DataFrame + to_csv、清空重绘）运行，便于对比。
+# 结果保存为 JSON，可用 --compare 比较两次（例如两个版本）的结果
+
+DEFAULT_RATES = [1, 10, 100, 1000]
+DEFAULT_PORT_COUNTS = [1, 2]
+RESULTS_DIR = 'benchmark_results'
+MEMORY_INTERVAL = 1.0  # 记录内存占用的间隔 (s)
+MEMORY_WARMUP = 3.0  # 开始后的这段时间不计入内存增长（缓冲预分配、导入、首次写盘），最多为运行时间的一半 (s)
+POLL_INTERVAL = 1.0 / 30  # current 流程取数据的间隔，与界面帧率相同
+FORMULA = '2*x+1'
+
+
+class StageTimer:
+    # 记录某个阶段每次调用的耗时
+    def __init__(self):
+        self.durations = []
+
+    def wrap(self, func):
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.durations.append(time.perf_counter() - start)
+        return timed
+
+    def summary(self):
+        if not self.durations:
+            return None
+        values = np.array(self.durations) * 1e6
+        return {
+            'calls': len(values),
+            'mean_us': float(values.mean()),
+            'p50_us': float(np.percentile(values, 50)),
+            'p90_us': float(np.percentile(values, 90)),
+            'p99_us': float(np.percentile(values, 99)),
+            'max_us': float(values.max()),
+        }
+
+
+def current_rss():
+    # 当前进程常驻内存 (MB)；无法获取时返回 None
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 1e6
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import resource
+        # ru_maxrss 为峰值，Linux 单位 KB，macOS 单位字节
+        scale = 1e6 if sys.platform == 'darwin' else 1e3
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale
+    except ImportError:
+        return None
+
+
+class MemorySampler(threading.Thread):
+    def __init__(self):
+        super().__init__(daemon=True)
+        self.samples = []
+        self._stop_event = threading.Event()
+        self._start = time.monotonic()
+
+    def run(self):
+        while True:
+            rss = current_rss()
+            if rss is not None:
+                self.samples.append((time.monotonic() - self._start, rss))
+            if self._stop_event.wait(MEMORY_INTERVAL):
+                break
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+    def summary(self):
+        # 增长率为预热之后各样本的最小二乘斜率
+        if not self.samples:
+            return {'rss_start_mb': None, 'rss_end_mb': None, 'growth_mb_per_hour': None, 'warmup_s': None,
+                    'samples': self.samples}
+        warmup = min(MEMORY_WARMUP, self.samples[-1][0] / 2)
+        times, rss = np.array([sample for sample in self.samples if sample[0] >= warmup]).reshape(-1, 2).T
+        growth = None
+        if len(times) >= 2 and times[-1] > times[0]:
+            growth = float(np.polyfit(times, rss, 1)[0]) * 3600
+        return {
+            'rss_start_mb': self.samples[0][1],
+            'rss_end_mb': self.samples[-1][1],
+            'growth_mb_per_hour': growth,
+            'warmup_s': warmup,
+            'samples': self.samples,
+        }
+
+
+def benchmark_header(ports):
+    header = {'TestName': 'Benchmark'}
+    for i, port in enumerate(ports):
+        header[port] = {'SensorName': 'Sim', 'SensorId': str(i + 1)}
+    return repr(header)
+
+
+def load_gui_module():
+    # 界面脚本文件名带点，不能直接 import
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'analogReading_v0.2.py')
+    spec = importlib.util.spec_from_file_location('analogReading_gui', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class PlotStage:
+    # 在离屏的 SensorApp 上重现界面的绘图工作
+    def __init__(self, ports):
+        os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+        from PyQt5.QtWidgets import QApplication
+
+        self.app = QApplication.instance() or QApplication([])
+        self.window = load_gui_module().SensorApp(discover_bridges=False)
+        self.window.resize(1200, 700)
+        self.window.show()
+        self.window.init_plot(ports)
+        self.ports = ports
+
+    def update(self, session, rows):
+        self.window.show_rows(session, rows)
+        self.app.processEvents()
+
+    def update_legacy(self, x_data, y_data):
+        # v0.2 原先的做法：清空后用完整列表重新绘制
+        widget = self.window.plot_widget
+        widget.clear()
+        for port in self.ports:
+            widget.plot(x_data, y_data[port], name=port)
+        self.app.processEvents()
+
+    def close(self):
+        self.window.close()
+
+
+def run_current(backend, ports, rate, duration, directory, plot):
+    stages = {name: StageTimer() for name in ('acquire', 'formula', 'write', 'flush', 'plot')}
+    plan = build_channel_plan(benchmark_header(ports), ports, backend.port_dict, Formula(FORMULA))
+    formula = stages['formula'].wrap(plan.channels[0].formula)
+    plan = plan._replace(channels=tuple(channel._replace(formula=formula) for channel in plan.channels))
+    plot_stage = PlotStage(ports) if plot else None
+
+    session = AcquisitionSession(backend, plan, rate, directory)
+    for sampler in session.samplers:
+        sampler.reader.read = stages['acquire'].wrap(sampler.reader.read)
+    session.writer.write = stages['write'].wrap(session.writer.write)
+    session.writer.flush = stages['flush'].wrap(session.writer.flush)
+    update_plot = stages['plot'].wrap(plot_stage.update) if plot else None
+
+    memory = MemorySampler()
+    memory.start()
+    start = time.perf_counter()
+    session.start()
+    while time.perf_counter() - start < duration:
+        time.sleep(POLL_INTERVAL)
+        rows = session.poll()
+        if rows is not None and update_plot:
+            update_plot(session, rows)
+    session.stop()
+    elapsed = time.perf_counter() - start
+    if plot:
+        plot_stage.close()
+    memory.stop()
+    stats = session.stats()
+    return session.file_name, elapsed, stats, stages, memory
+
+
+def run_legacy(backend, ports, rate, duration, directory, plot):
+    import pandas as pd
+
+    stages = {name: StageTimer() for name in ('acquire', 'formula', 'header', 'dataframe', 'write', 'plot')}
+    header_text = benchmark_header(ports)
+    plan = build_channel_plan(header_text, ports, backend.port_dict, Formula(FORMULA))
+    file_name = create_edf_file(plan, directory)
+    plot_stage = PlotStage(ports) if plot else None
+    readers = {port: backend.create_reader([backend.port_dict[port]]) for port in ports}
+    x_data = []
+    y_data = {port: [] for port in ports}
+
+    # QTimer 的间隔为 int(1000 / rate) 毫秒
+    interval = max(int(1000 / rate), 1) / 1000
+    scheduler = SampleScheduler(1 / interval)
+    stop_event = threading.Event()
+    memory = MemorySampler()
+    memory.start()
+    start = time.perf_counter()
+    while time.perf_counter() - start < duration and scheduler.wait(stop_event):
+        df = pd.DataFrame()
+        x_data.append(time.time())
+        for port in ports:
+            t = time.perf_counter()
+            volt = readers[port].read()[0]
+            stages['acquire'].durations.append(time.perf_counter() - t)
+            y_data[port].append(volt)
+
+            t = time.perf_counter()
+            result = eval(FORMULA.replace('x', str(volt)))
+            stages['formula'].durations.append(time.perf_counter() - t)
+
+            t = time.perf_counter()
+            header = eval(header_text)
+            column1 = port + header[port]['SensorName'] + header[port]['SensorId'] + 'voltage'
+            column2 = port + header[port]['SensorName'] + header[port]['SensorId'] + 'calcuted_value'
+            stages['header'].durations.append(time.perf_counter() - t)
+
+            t = time.perf_counter()
+            df['Epoch_UTC'] = [time.time()]
+            df[column1] = [volt]
+            df[column2] = [result]
+            stages['dataframe'].durations.append(time.perf_counter() - t)
+
+        t = time.perf_counter()
+        df.to_csv(file_name, header=False, sep=str("\t"), float_format=None,
+                  encoding='utf-8', lineterminator=u"\n", mode='a', index=False)
+        stages['write'].durations.append(time.perf_counter() - t)
+
+        if plot:
+            stages['plot'].wrap(plot_stage.update_legacy)(x_data, y_data)
+    elapsed = time.perf_counter() - start
+    if plot:
+        plot_stage.close()
+    memory.stop()
+    stats = scheduler.stats()
+    stats['requested_rate'] = rate
+    return file_name, elapsed, stats, stages, memory
+
+
+def run_benchmark(pipeline, backend_name, bridges, port_count, rate, duration, latency, plot, directory):
+    # bridges 台设备，每台使用前 port_count 个端口
+    channels = max(port_count, 2)
+    backend = BridgeGroup([create_backend(backend_name, channels, latency, SignalGenerator(seed=i))
+                           for i in range(bridges)])
+    ports = [port for i, port in enumerate(backend.port_dict) if i % channels < port_count]
+    backend.connect(3.3, [backend.port_dict[port] for port in ports])
+    try:
+        runner = run_current if pipeline == 'current' else run_legacy
+        file_name, elapsed, stats, stages, memory = runner(backend, ports, rate, duration, directory, plot)
+    finally:
+        backend.disconnect()
+    file_size = os.path.getsize(file_name)
+    return {
+        'pipeline': pipeline,
+        'backend': backend_name,
+        'bridges': bridges,
+        'ports': port_count,
+        'requested_rate': rate,
+        'achieved_rate': stats['achieved_rate'],
+        'samples': stats['ticks'],
+        'missed': stats['missed'],
+        'duration_s': elapsed,
+        'file_bytes': file_size,
+        'file_bytes_per_s': file_size / elapsed,
+        'stages': {name: timer.summary() for name, timer in stages.items() if timer.durations},
+        'memory': memory.summary(),
+    }
+
+
+def print_run(result):
+    print(f"{result['pipeline']:>7} bridges={result.get('bridges', 1)} ports={result['ports']} rate={result['requested_rate']:g} Hz: "
+          f"achieved {result['achieved_rate']:.2f} Hz, missed {result['missed']}, "
+          f"{result['file_bytes_per_s'] / 1e3:.1f} kB/s", end='')
+    growth = result['memory']['growth_mb_per_hour']
+    print(f", memory {growth:+.1f} MB/h" if growth is not None else "")
+    for name, summary in result['stages'].items():
+        print(f"    {name:<10} calls={summary['calls']:<7} p50={summary['p50_us']:9.1f} us  "
+              f"p90={summary['p90_us']:9.1f} us  p99={summary['p99_us']:9.1f} us  max={summary['max_us']:9.1f} us")
+
+
+def compare(file_a, file_b):
+    results = []
+    for file_name in (file_a, file_b):
+        with open(file_name, encoding='utf-8') as f:
+            results.append(json.load(f))
+    runs_b = {(r['pipeline'], r.get('bridges', 1), r['ports'], r['requested_rate']): r for r in results[1]['runs']}
+    print(f"{'pipeline':>8} {'bridges':>7} {'ports':>5} {'rate':>7} | {'achieved A':>10} {'achieved B':>10} | "
+          f"{'kB/s A':>8} {'kB/s B':>8}   A={results[0]['label']} B={results[1]['label']}")
+    for run_a in results[0]['runs']:
+        key = (run_a['pipeline'], run_a.get('bridges', 1), run_a['ports'], run_a['requested_rate'])
+        run_b = runs_b.get(key)
+        if run_b is None:
+            continue
+        print(f"{key[0]:>8} {key[1]:>7} {key[2]:>5} {key[3]:>7g} | {run_a['achieved_rate']:>10.2f} {run_b['achieved_rate']:>10.2f} | "
+              f"{run_a['file_bytes_per_s'] / 1e3:>8.1f} {run_b['file_bytes_per_s'] / 1e3:>8.1f}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the acquisition -> formula -> write -> plot pipeline "
+                                                 "against a simulated SensorBridge.")
+    parser.add_argument('--pipelines', nargs='+', default=['current'], choices=['current', 'legacy'],
+                        help="pipelines to run (default: current)")
+    parser.add_argument('--backend', default='sim', choices=['sim', 'sim-shdlc'], help="(default: sim)")
+    parser.add_argument('--bridges', type=int, default=1,
+                        help="number of simulated SensorBridges, each sampled by its own thread (default: 1)")
+    parser.add_argument('--ports', nargs='+', type=int, default=DEFAULT_PORT_COUNTS,
+                        help="port counts to run (default: 1 2)")
+    parser.add_argument('--rates', nargs='+', type=float, default=DEFAULT_RATES,
+                        help="sampling rates in Hz (default: 1 10 100 1000)")
+    parser.add_argument('--duration', type=float, default=10, help="seconds per run (default: 10)")
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help="simulated round-trip time per command in seconds (default: 0)")
+    parser.add_argument('--plot', action='store_true', help="include the plot stage (needs PyQt5 and pyqtgraph)")
+    parser.add_argument('--label', default='', help="name stored with the results, e.g. a version")
+    parser.add_argument('--output', help=f"result file (default: {RESULTS_DIR}/<date>_<label>.json)")
+    parser.add_argument('--keep-files', action='store_true', help="keep the recorded EDF files")
+    parser.add_argument('--compare', nargs=2, metavar='RESULT', help="compare two result files and exit")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.compare:
+        compare(*args.compare)
+        return 0
+
+    directory = tempfile.mkdtemp(prefix='sek_benchmark_')
+    runs = []
+    try:
+        for pipeline in args.pipelines:
+            for port_count in args.ports:
+                for rate in args.rates:
+                    result = run_benchmark(pipeline, args.backend, args.bridges, port_count, rate, args.duration,
+                                           args.latency, args.plot, directory)
+                    print_run(result)
+                    runs.append(result)
+    finally:
+        if args.keep_files:
+            print(f"EDF files kept in {directory}")
+        else:
+            shutil.rmtree(directory, ignore_errors=True)
+
+    current_time = dt.datetime.now()
+    output = args.output
+    if output is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        name = current_time.strftime('%Y-%m-%d_%H-%M-%S') + (f'_{args.label}' if args.label else '')
+        output = os.path.join(RESULTS_DIR, name + '.json')
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump({
+            'label': args.label,
+            'created': current_time.isoformat(),
+            'python': sys.version.split()[0],
+            'platform': platform.platform(),
+            'settings': {key: value for key, value in vars(args).items() if key not in ('compare', 'output')},
+            'runs': runs,
+        }, f, indent=1)
+    print(f"Results saved to {output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
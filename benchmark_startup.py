@@ -0,0 +1,116 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+# 启动时间基准测试：每次在新进程中启动界面（离屏），测量从启动进程到窗口显示（time-to-window）
+# 和到第一批数据画出（time-to-first-sample，使用模拟设备）的时间，与目标值比较。
+# 同时检查窗口显示时是否已导入了应按需导入的重模块
+
+WINDOW_TARGET = 1.5  # 窗口显示时间的目标中位数 (s)
+FIRST_SAMPLE_TARGET = 2.0  # 第一批数据的目标中位数 (s)
+CHILD_TIMEOUT = 30  # 单次启动的最长时间 (s)
+SAMPLING_RATE = 100
+# 启动时不应导入的模块：只在记录、连接真实设备或导出时才需要
+DEFERRED_MODULES = ['pandas', 'pyarrow', 'sensirion_fastedf', 'sensirion_shdlc_driver', 'sensirion_shdlc_sensorbridge']
+
+
+def run_child(launched, backend):
+    # 在子进程中运行：launched 为父进程启动子进程前的 time.time()
+    os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    from PyQt5.QtWidgets import QApplication
+
+    app = QApplication(sys.argv)
+    from benchmark_pipeline import benchmark_header, load_gui_module
+
+    window = load_gui_module().SensorApp(discover_bridges=False)
+    window.show()
+    app.processEvents()
+    result = {
+        'window': time.time() - launched,
+        'deferred_modules_loaded': [name for name in DEFERRED_MODULES if name in sys.modules],
+    }
+
+    from sek_devices import SIMULATED_BACKENDS
+
+    name = {value: key for key, value in SIMULATED_BACKENDS.items()}[backend]
+    for i in range(window.serial_port_list.count()):
+        item = window.serial_port_list.item(i)
+        item.setSelected(item.text() == name)
+    window.custom_header_input.setText(benchmark_header(window.SEK_ports))
+    window.sampling_rate_spinbox.setValue(SAMPLING_RATE)
+    window.toggle_connection()
+    window.toggle_data_collection()
+    while window.plot_range is None and time.time() - launched < CHILD_TIMEOUT:
+        app.processEvents()
+        time.sleep(0.001)
+    if window.plot_range is not None:
+        result['first_sample'] = time.time() - launched
+    window.toggle_connection()
+    print(json.dumps(result))
+    return 0
+
+
+def run_once(backend, directory):
+    env = dict(os.environ, QT_QPA_PLATFORM=os.environ.get('QT_QPA_PLATFORM', 'offscreen'))
+    launched = time.time()
+    completed = subprocess.run([sys.executable, os.path.abspath(__file__), '--child', repr(launched), backend],
+                               cwd=directory, env=env, capture_output=True, text=True, timeout=CHILD_TIMEOUT + 10)
+    lines = completed.stdout.strip().splitlines()
+    if completed.returncode or not lines:
+        raise RuntimeError(f"startup run failed: {completed.stderr.strip() or completed.stdout.strip()}")
+    return json.loads(lines[-1])
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Measure the GUI's time-to-window and time-to-first-sample "
+                                                 "against a simulated SensorBridge.")
+    parser.add_argument('--runs', type=int, default=5, help="number of fresh starts (default: 5)")
+    parser.add_argument('--backend', default='sim', choices=['sim', 'sim-shdlc'], help="(default: sim)")
+    parser.add_argument('--window-target', type=float, default=WINDOW_TARGET,
+                        help=f"maximum median time-to-window in seconds (default: {WINDOW_TARGET:g})")
+    parser.add_argument('--first-sample-target', type=float, default=FIRST_SAMPLE_TARGET,
+                        help=f"maximum median time-to-first-sample in seconds (default: {FIRST_SAMPLE_TARGET:g})")
+    parser.add_argument('--child', nargs=2, metavar=('LAUNCHED', 'BACKEND'), help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.child:
+        return run_child(float(args.child[0]), args.child[1])
+
+    results = []
+    with tempfile.TemporaryDirectory(prefix='sek_startup_') as directory:
+        for i in range(args.runs):
+            result = run_once(args.backend, directory)
+            first_sample = result.get('first_sample')
+            print(f"run {i + 1}: window {result['window']:.3f} s, first sample "
+                  + (f"{first_sample:.3f} s" if first_sample is not None else "timed out"))
+            results.append(result)
+
+    failed = False
+    for key, target in (('window', args.window_target), ('first_sample', args.first_sample_target)):
+        values = [result[key] for result in results if key in result]
+        if len(values) < len(results):
+            print(f"{key}: {len(results) - len(values)} run(s) timed out")
+            failed = True
+            continue
+        median = statistics.median(values)
+        ok = median <= target
+        failed |= not ok
+        print(f"{key}: median {median:.3f} s, max {max(values):.3f} s, target {target:g} s "
+              f"{'OK' if ok else 'FAILED'}")
+    loaded = sorted({name for result in results for name in result['deferred_modules_loaded']})
+    if loaded:
+        print(f"Imported before the window was shown: {', '.join(loaded)}")
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
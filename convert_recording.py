@@ -0,0 +1,44 @@
+import argparse
+import os
+import sys
+
+from sek_recording import EXPORT_FORMATS, export_recording, open_recording_file
+
+# 把二进制记录（.sekb）、分段记录（.sekidx）或 EDF 文件转换为 EDF、CSV 或 Parquet，按块流式处理，不整体读入内存
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Convert a recording (.sekb, .sekidx or .edf) to EDF, CSV or "
+                                                 "Parquet.")
+    parser.add_argument('input', nargs='+', help="recordings to convert")
+    parser.add_argument('--format', default='edf', choices=sorted(set(EXPORT_FORMATS.values())),
+                        help="output format (default: edf)")
+    parser.add_argument('--output-dir', help="directory for the converted files (default: next to the input)")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    extension = {file_format: extension for extension, file_format in EXPORT_FORMATS.items()}[args.format]
+    failed = 0
+    for file_name in args.input:
+        output = os.path.splitext(file_name)[0] + extension
+        if args.output_dir:
+            output = os.path.join(args.output_dir, os.path.basename(output))
+        if os.path.abspath(output) == os.path.abspath(file_name) or os.path.exists(output):
+            print(f"Skipping {file_name}: {output} already exists")
+            failed += 1
+            continue
+        try:
+            with open_recording_file(file_name) as recording:
+                export_recording(recording, output, args.format)
+        except (OSError, ValueError, ImportError) as e:
+            print(f"Failed to convert {file_name}: {e}")
+            failed += 1
+            continue
+        print(f"{file_name} -> {output}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
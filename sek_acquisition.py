@@ -0,0 +1,973 @@
+# 采集核心：通道计划、采样线程和 EDF 写入，不依赖 PyQt5/pyqtgraph，
+# 供 analogReading_v0.2.py 界面和 analogReading_headless.py 命令行共用
+
+import ast
+import datetime as dt
+import json
+import os
+import struct
+import threading
+import time
+import zlib
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from sek_filters import StageChain
+from sek_metrics import METRICS_INTERVAL, Metrics, MetricsExporter
+
+SAMPLE_BUFFER_SIZE = 100000  # 采样线程与界面之间缓冲的批次数上限
+BATCH_INTERVAL = 0.02  # 采样线程每批数据的最长累积时间 (s)
+START_DELAY = 0.05  # 多个采样线程从同一个节拍开始，留出线程启动的时间 (s)
+MIN_SAMPLING_RATE = 0.01  # 采样频率范围 (Hz)
+MAX_SAMPLING_RATE = 1000
+RECONNECT_FAILURES = 3  # 连续读取失败次数达到该值时认为设备断开，开始重连
+RECONNECT_DELAY = 0.5  # 第一次重连前的等待时间 (s)，之后每次失败加倍
+RECONNECT_MAX_DELAY = 30.0  # 重连间隔的上限 (s)
+OUTAGE_COLUMNS = ['Start_UTC', 'End_UTC', 'Duration', 'Ports', 'Error']
+EDF_VERSION = '5.0'  # 写入 EDF 表头的格式版本，与 sensirion_fastedf 相同
+EDF_FLUSH_ROWS = 4096  # EDF 写入缓冲行数，满则写盘
+EDF_FLUSH_INTERVAL = 1.0  # 距上次写盘超过该时间 (s) 也写盘
+BINARY_FSYNC_INTERVAL = 5.0  # 二进制记录 fsync 到磁盘的间隔 (s)
+RECORDING_FORMATS = {'edf': '.edf', 'binary': '.sekb'}  # 记录格式及文件扩展名
+SEGMENT_INDEX_EXTENSION = '.sekidx'  # 分段记录的索引文件扩展名
+SEGMENT_INDEX_ROWS = 8192  # 分段记录每隔约该行数在索引中记一个块
+SEGMENT_COMPRESS_LEVEL = 6  # 关闭的段压缩为 gzip 的压缩级别
+
+# 二进制记录：文件头为 BINARY_MAGIC、4 字节 JSON 长度和 JSON 表头，之后是若干数据帧。
+# 每帧为 FRAME_MAGIC、行数、CRC32 和定长记录（float64 时间 + float32 通道），
+# 崩溃时最多丢失最后一个不完整的帧
+BINARY_MAGIC = b'SEKREC\x00\x01'
+FRAME_MAGIC = b'SEKF'
+FRAME_HEADER = struct.Struct('<4sII')
+
+# 公式中允许使用的函数和常量，均按数组逐元素计算
+FORMULA_NAMES = {name: getattr(np, name) for name in (
+    'abs', 'sqrt', 'exp', 'log', 'log10', 'log2', 'sin', 'cos', 'tan', 'arcsin', 'arccos', 'arctan',
+    'sinh', 'cosh', 'tanh', 'floor', 'ceil', 'round', 'sign', 'minimum', 'maximum', 'clip', 'where',
+    'power', 'pi', 'e')}
+FORMULA_NAMES.update({'ln': np.log, 'pow': np.power, 'min': np.minimum, 'max': np.maximum})
+FORMULA_NODES = (ast.Expression, ast.BinOp, ast.UnaryOp, ast.Compare, ast.Call, ast.Name, ast.Load,
+                 ast.Constant, ast.Add, ast.Sub, ast.Mult, ast.Div, ast.FloorDiv, ast.Mod, ast.Pow,
+                 ast.UAdd, ast.USub, ast.Lt, ast.LtE, ast.Gt, ast.GtE, ast.Eq, ast.NotEq)
+
+# 一个采集通道：SensorBridge 端口、电压列/计算值列的列名和在数据行中的位置、换算公式，
+# custom header 中该端口的 SampleRate（没有时为 None，使用界面/命令行设置的频率），
+# 以及由计算值得到的派生信号
+Channel = namedtuple('Channel', ['port', 'port_index', 'voltage_column', 'value_column',
+                                 'voltage_index', 'value_index', 'formula', 'sample_rate', 'derived'])
+# custom header 中端口的 'Derived': {名称: 处理级串联} 的一项，例如 'smooth': 'median(5) | ema(0.1)'，
+# 或 {'Stages': ..., 'Plot': False} 不画曲线。stages 为 sek_filters.StageChain 的文本，
+# 每个派生信号在 index 处占一列（列名为传感器名 + 名称）
+DerivedSignal = namedtuple('DerivedSignal', ['name', 'column', 'index', 'stages', 'plot'])
+# 一次采集的通道计划：开始采集时由 custom header 生成，采集过程中只读。
+# latency_index 为可选的通信耗时列在数据行中的位置，不记录时为 None
+ChannelPlan = namedtuple('ChannelPlan', ['header', 'columns', 'column_metadata', 'channels', 'latency_index'])
+LATENCY_COLUMN = 'Latency'
+# 分段记录的设置（见 SegmentedWriter）：当前段超过 max_bytes 字节或 max_seconds 秒时换下一段（None 不限），
+# compress 在后台压缩关闭的段，keep 为最多保留的段数（None 全部保留），index_rows 为索引块的行数
+SegmentPolicy = namedtuple('SegmentPolicy', ['max_bytes', 'max_seconds', 'compress', 'keep', 'index_rows'],
+                           defaults=(None, None, False, None, SEGMENT_INDEX_ROWS))
+
+
+class Formula:
+    # 用户公式只在输入改变时解析、校验并编译一次：只允许 x、数字、算术/比较运算
+    # 和 FORMULA_NAMES 中的函数，计算时 x 为整批电压数组。空公式不计算（结果为 nan）
+    def __init__(self, text):
+        self.text = text.strip()
+        self.code = None
+        if not self.text:
+            return
+        try:
+            tree = ast.parse(self.text, mode='eval')
+        except SyntaxError as e:
+            raise ValueError(f"invalid syntax in '{self.text}'") from e
+        for node in ast.walk(tree):
+            if not isinstance(node, FORMULA_NODES):
+                raise ValueError(f"'{type(node).__name__}' is not allowed in '{self.text}'")
+            if isinstance(node, ast.Name) and node.id != 'x' and node.id not in FORMULA_NAMES:
+                raise ValueError(f"unknown name '{node.id}' in '{self.text}'")
+            if isinstance(node, ast.Call) and (not isinstance(node.func, ast.Name) or node.keywords):
+                raise ValueError(f"only plain function calls are allowed in '{self.text}'")
+            if isinstance(node, ast.Constant):
+                if not isinstance(node.value, (int, float)) or isinstance(node.value, bool):
+                    raise ValueError(f"only numbers are allowed as constants in '{self.text}'")
+                # 统一为浮点数，避免 9**9**9 之类的整数运算长时间阻塞
+                node.value = float(node.value)
+        self.code = compile(tree, '<formula>', 'eval')
+        try:
+            self(np.ones(1))  # 试算一次，尽早发现参数个数等错误
+        except Exception as e:
+            raise ValueError(f"cannot evaluate '{self.text}': {e}") from e
+
+    def __call__(self, x):
+        x = np.asarray(x, dtype=np.float64)
+        if self.code is None:
+            return np.full(x.shape, np.nan)
+        with np.errstate(all='ignore'):
+            result = eval(self.code, {'__builtins__': {}}, dict(FORMULA_NAMES, x=x))
+        return np.broadcast_to(np.asarray(result, dtype=np.float64), x.shape)
+
+
+def parse_custom_header(text):
+    # 只接受字面量：Python dict 写法或 JSON，不执行任何代码
+    try:
+        header = ast.literal_eval(text.strip())
+    except (ValueError, SyntaxError) as e:
+        try:
+            header = json.loads(text)
+        except ValueError:
+            raise ValueError(f"custom header is not a valid dict literal or JSON: {e}") from None
+    if not isinstance(header, dict):
+        raise ValueError("custom header must be a dict")
+    return header
+
+
+def build_channel_plan(header_text, ports, port_dict, default_formula, record_latency=False):
+    header = {'appinfo': 'desigen by NWU'}
+    header.update(parse_custom_header(header_text))
+    columns = ['Epoch_UTC']
+    column_metadata = {'Epoch_UTC': {'Format': '.2f', 'Type': 'float64', 'Unit': 's'}}
+    channels = []
+    for port in ports:
+        entry = header.get(port)
+        if not isinstance(entry, dict):
+            raise ValueError(f"custom header has no settings dict for selected port {port}")
+        for key in ('SensorName', 'SensorId'):
+            if key not in entry:
+                raise ValueError(f"custom header entry of {port} has no '{key}'")
+        sensor = port + str(entry['SensorName']) + str(entry['SensorId'])
+        voltage_column = sensor + 'voltage'
+        value_column = sensor + 'calcuted_value'
+        if voltage_column in column_metadata:
+            raise ValueError(f"duplicate column {voltage_column}")
+        formula = Formula(str(entry['Formula'])) if 'Formula' in entry else default_formula
+        sample_rate = None
+        if 'SampleRate' in entry:
+            try:
+                sample_rate = float(entry['SampleRate'])
+            except (TypeError, ValueError):
+                sample_rate = None
+            if sample_rate is None or not MIN_SAMPLING_RATE <= sample_rate <= MAX_SAMPLING_RATE:
+                raise ValueError(f"SampleRate of {port} must be a number between "
+                                 f"{MIN_SAMPLING_RATE} and {MAX_SAMPLING_RATE} Hz")
+        voltage_index = len(columns)
+        columns += [voltage_column, value_column]
+        column_metadata[voltage_column] = {'Format': '.1f', 'Type': 'float', 'Unit': 'V'}
+        column_metadata[value_column] = {'Format': '.1f', 'Type': 'float', 'Unit': 'U'}
+        derived = []
+        entries = entry.get('Derived', {})
+        if not isinstance(entries, dict):
+            raise ValueError(f"'Derived' of {port} must be a dict of name: stages")
+        for name, spec in entries.items():
+            plot = True
+            if isinstance(spec, dict):
+                plot = bool(spec.get('Plot', True))
+                spec = spec.get('Stages', '')
+            column = sensor + str(name)
+            if column in column_metadata:
+                raise ValueError(f"duplicate column {column}")
+            try:
+                StageChain(str(spec))
+            except ValueError as e:
+                raise ValueError(f"derived signal '{name}' of {port}: {e}") from None
+            derived.append(DerivedSignal(str(name), column, len(columns), str(spec), plot))
+            columns.append(column)
+            column_metadata[column] = {'Format': '.3f', 'Type': 'float', 'Unit': 'U'}
+        channels.append(Channel(port, port_dict[port], voltage_column, value_column,
+                                voltage_index, voltage_index + 1, formula, sample_rate, tuple(derived)))
+    latency_index = None
+    if record_latency:
+        # 每行读取所用的时间：时间戳取在这段时间的中点
+        latency_index = len(columns)
+        columns.append(LATENCY_COLUMN)
+        column_metadata[LATENCY_COLUMN] = {'Format': '.6f', 'Type': 'float', 'Unit': 's'}
+    return ChannelPlan(header, tuple(columns), column_metadata, tuple(channels), latency_index)
+
+
+def write_edf_header(file_name, header, columns, column_metadata):
+    # 按 sensirion_fastedf.to_edf 的格式写出 EDF 表头：版本、日期、按键名排序的 custom header、
+    # 各列 Format/Type/Unit 和列名。与 to_edf 一样以文本模式写（换行为系统默认），
+    # 省去只为写表头而导入 pandas 和 fastedf
+    lines = [f"# EdfVersion={EDF_VERSION}", f"# Date={dt.datetime.now().astimezone().isoformat()}"]
+    lines += [f"# {key}={header[key]}" for key in sorted(header)]
+    lines.append('# ' + '\t'.join(','.join(f'{key}={value}' for key, value in column_metadata[column].items())
+                                  for column in columns))
+    lines.append('\t'.join(columns))
+    with open(file_name, 'w', encoding='utf-8') as f:
+        f.write('\n'.join(lines) + '\n')
+
+
+class EdfWriter:
+    # EDF 数据写入器：文件在整个采集期间保持打开，行先放入预分配的缓冲，
+    # 满 flush_rows 行或距上次写盘超过 flush_interval 秒时一次性格式化写出。
+    # 表头（# 注释、Format/Type/Unit 行和列名）由 write_edf_header 按 column_metadata 写好，
+    # 这里只按相同的列顺序追加制表符分隔的数据行，数值与原先 to_csv 一样按完整精度写出。
+    # 给出 metrics 时把每次写盘的耗时记入 flush_seconds
+    def __init__(self, file_name, columns, column_metadata,
+                 flush_rows=EDF_FLUSH_ROWS, flush_interval=EDF_FLUSH_INTERVAL, metrics=None):
+        self.file_name = file_name
+        self.metrics = metrics
+        self.columns = list(columns)
+        self.column_metadata = column_metadata
+        self.flush_interval = flush_interval
+        self.buffer = np.empty((flush_rows, len(self.columns)), dtype=np.float64)
+        self.count = 0
+        self.row_format = '\t'.join(['%r'] * len(self.columns)) + '\n'
+        self.last_flush = time.monotonic()
+        self.file = open(file_name, 'a', encoding='utf-8', newline='\n')
+
+    def write(self, rows):
+        rows = np.asarray(rows, dtype=np.float64).reshape(-1, len(self.columns))
+        while len(rows):
+            n = min(len(rows), len(self.buffer) - self.count)
+            self.buffer[self.count:self.count + n] = rows[:n]
+            self.count += n
+            rows = rows[n:]
+            if self.count == len(self.buffer):
+                self.flush()
+        if time.monotonic() - self.last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        start = time.perf_counter()
+        if self.count:
+            row_format = self.row_format
+            self.file.write(''.join([row_format % tuple(row) for row in self.buffer[:self.count].tolist()]))
+            self.count = 0
+        self.file.flush()
+        self.last_flush = time.monotonic()
+        if self.metrics is not None:
+            self.metrics.observe('flush_seconds', time.perf_counter() - start)
+
+    def close(self):
+        if not self.file.closed:
+            self.flush()
+            self.file.close()
+
+
+def binary_layout(plan):
+    # 二进制记录实际存储的列及其类型；公式为 x 的计算值列与电压列相同，只记为别名
+    aliases = {channel.value_column: channel.voltage_column for channel in plan.channels
+               if getattr(channel.formula, 'text', None) == 'x'}
+    stored = [column for column in plan.columns if column not in aliases]
+    dtypes = ['<f8'] + ['<f4'] * (len(stored) - 1)
+    return stored, dtypes, aliases
+
+
+class BinaryWriter:
+    # 二进制数据写入器，接口与 EdfWriter 相同：缓冲满 flush_rows 行或超过 flush_interval 秒
+    # 时写出一帧，每 fsync_interval 秒 fsync 一次，关闭时 fsync
+    def __init__(self, file_name, plan, flush_rows=EDF_FLUSH_ROWS, flush_interval=EDF_FLUSH_INTERVAL,
+                 fsync_interval=BINARY_FSYNC_INTERVAL, metrics=None):
+        self.file_name = file_name
+        self.metrics = metrics
+        self.columns = list(plan.columns)
+        stored, dtypes, _ = binary_layout(plan)
+        self.stored_indexes = [self.columns.index(column) for column in stored]
+        self.record = np.dtype([(column, dtype) for column, dtype in zip(stored, dtypes)])
+        self.flush_interval = flush_interval
+        self.fsync_interval = fsync_interval
+        self.buffer = np.empty((flush_rows, len(self.columns)), dtype=np.float64)
+        self.count = 0
+        self.last_flush = self.last_fsync = time.monotonic()
+        self.file = open(file_name, 'ab')
+
+    def write(self, rows):
+        rows = np.asarray(rows, dtype=np.float64).reshape(-1, len(self.columns))
+        while len(rows):
+            n = min(len(rows), len(self.buffer) - self.count)
+            self.buffer[self.count:self.count + n] = rows[:n]
+            self.count += n
+            rows = rows[n:]
+            if self.count == len(self.buffer):
+                self.flush()
+        if time.monotonic() - self.last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self, fsync=False):
+        start = time.perf_counter()
+        if self.count:
+            records = np.empty(self.count, dtype=self.record)
+            for name, index in zip(self.record.names, self.stored_indexes):
+                records[name] = self.buffer[:self.count, index]
+            payload = records.tobytes()
+            self.file.write(FRAME_HEADER.pack(FRAME_MAGIC, self.count, zlib.crc32(payload)) + payload)
+            self.count = 0
+        self.file.flush()
+        self.last_flush = time.monotonic()
+        if fsync or self.last_flush - self.last_fsync >= self.fsync_interval:
+            os.fsync(self.file.fileno())
+            self.last_fsync = self.last_flush
+        if self.metrics is not None:
+            self.metrics.observe('flush_seconds', time.perf_counter() - start)
+
+    def close(self):
+        if not self.file.closed:
+            self.flush(fsync=True)
+            self.file.close()
+
+
+class SharedClock:
+    # 一次采集中所有采样线程共用的时钟：创建时把单调时钟与 UTC 对应一次，之后的时间戳都由
+    # 单调时钟推算，不受 NTP 对时跳变影响，各线程的时间可以直接比较。用整数纳秒计算以免损失精度；
+    # 使用 perf_counter_ns 而不是 monotonic_ns，因为 Windows 上后者的分辨率只有约 15.6 ms
+    def __init__(self):
+        self.origin_ticks = time.perf_counter_ns()
+        self.origin_utc_ns = time.time_ns()
+
+    @staticmethod
+    def ticks():
+        return time.perf_counter_ns()
+
+    def utc(self, ticks):
+        # ticks 为 ticks() 的返回值，换算为 UTC 秒
+        return (self.origin_utc_ns + ticks - self.origin_ticks) / 1e9
+
+    def __call__(self):
+        return self.utc(time.perf_counter_ns())
+
+
+class SampleScheduler:
+    # 采样节拍：第 k 次采样的目标时刻为 anchor + k * period（单调高精度时钟），误差不累积。
+    # 先睡眠到目标前 SPIN_MARGIN 秒，再让出 GIL 自旋到目标时刻，以获得亚毫秒精度；
+    # 落后不足一拍时立即补采，错过整拍则跳过并计入 missed。
+    # start_anchor 为第一拍的时刻，多个调度器设为同一值时节拍对齐；为 None 时从第一次等待开始。
+    # 睡眠在 wakeup 上等待，修改频率或 wake() 时立即醒来重新计算目标时刻，低频率时修改也马上生效。
+    # 实际频率只统计最近一次修改频率之后的节拍
+    SPIN_MARGIN = 0.002
+
+    def __init__(self, sampling_rate, clock=time.perf_counter, start_anchor=None):
+        self.clock = clock
+        self.period = 1.0 / sampling_rate
+        self.start_anchor = start_anchor
+        self.wakeup = threading.Event()
+        self.reset()
+
+    def reset(self):
+        self.anchor = None
+        self.anchor_period = self.period
+        self.index = 0
+        self.start_time = None
+        self.last_time = None
+        self.ticks = 0
+        self.rate_ticks = 0
+        self.missed = 0
+        self.lateness_sum = 0.0
+        self.lateness_max = 0.0
+        self.last_lateness = 0.0
+
+    def set_sampling_rate(self, sampling_rate):
+        # 可在其他线程调用，正在等待的这一拍按新频率重新计算
+        self.period = 1.0 / sampling_rate
+        self.wakeup.set()
+
+    def wake(self):
+        # 设置 wait() 的 stop_event 后调用，使正在睡眠的 wait() 立即返回
+        self.wakeup.set()
+
+    def next_deadline(self):
+        now = self.clock()
+        if self.anchor is None:
+            self.anchor = now if self.start_anchor is None else self.start_anchor
+            self.anchor_period = self.period
+            self.index = 0
+            return self.anchor
+        if self.period != self.anchor_period:
+            # 频率改变：以上一拍的目标时刻为新起点，实际频率重新统计
+            self.anchor += self.index * self.anchor_period
+            self.anchor_period = self.period
+            self.index = 0
+            self.start_time = None
+            self.rate_ticks = 0
+        self.index += 1
+        deadline = self.anchor + self.index * self.period
+        if now - deadline >= self.period:
+            skipped = int((now - deadline) / self.period)
+            self.missed += skipped
+            self.index += skipped
+            deadline = self.anchor + self.index * self.period
+        return deadline
+
+    def wait(self, stop_event):
+        # 等到下一拍；等待期间被要求停止时返回 False
+        deadline = self.next_deadline()
+        while True:
+            if stop_event.is_set():
+                return False
+            remaining = deadline - self.clock()
+            if remaining <= self.SPIN_MARGIN:
+                break
+            self.wakeup.wait(remaining - self.SPIN_MARGIN)
+            self.wakeup.clear()
+            if self.period != self.anchor_period:
+                # 睡眠中修改了频率：第一拍仍在 anchor，否则退回上一拍按新频率重新计算，
+                # 上一拍到现在之间按新频率跳过的节拍不是错过的，不计入 missed
+                if self.index == 0:
+                    self.anchor_period = self.period
+                else:
+                    missed = self.missed
+                    self.index -= 1
+                    deadline = self.next_deadline()
+                    self.missed = missed
+        while self.clock() < deadline:
+            time.sleep(0)
+        if stop_event.is_set():
+            return False
+
+        now = self.clock()
+        lateness = self.last_lateness = now - deadline
+        self.lateness_sum += lateness
+        self.lateness_max = max(self.lateness_max, lateness)
+        if self.start_time is None:
+            self.start_time = now
+        self.last_time = now
+        self.ticks += 1
+        self.rate_ticks += 1
+        return True
+
+    def stats(self):
+        achieved_rate = 0.0
+        if self.rate_ticks > 1 and self.last_time > self.start_time:
+            achieved_rate = (self.rate_ticks - 1) / (self.last_time - self.start_time)
+        return {
+            'requested_rate': 1.0 / self.period,
+            'achieved_rate': achieved_rate,
+            'ticks': self.ticks,
+            'missed': self.missed,
+            'mean_lateness': self.lateness_sum / self.ticks if self.ticks else 0.0,
+            'max_lateness': self.lateness_max,
+        }
+
+
+class SamplerWorker(threading.Thread):
+    # 后台采样线程：采集期间独占设备后端的 reader，按 SampleScheduler 的节拍采样，
+    # 每 BATCH_INTERVAL 把一批 (时间戳数组, 电压矩阵, 耗时数组, 节拍延迟数组) 放入 deque
+    # （append/popleft 线程安全，无需加锁）交给界面。每次读取只取一个时间戳，
+    # 取在读取前后两次 clock.ticks() 的中点，耗时为两者之差 (s)。
+    # read_errors 和 dropped_batches 为读取失败次数和因 deque 已满被丢弃的批次数。
+    # 连续 RECONNECT_FAILURES 次读取失败时调用 reader.reconnect()，按指数退避重试直到成功，
+    # 每次中断结束后把 (开始, 结束, 错误) 的 UTC 时间放入 outages
+    def __init__(self, reader, channel_count, sampling_rate, clock=None):
+        super().__init__(daemon=True)
+        self.reader = reader
+        self.channel_count = channel_count
+        self.clock = clock if clock is not None else SharedClock()
+        self.scheduler = SampleScheduler(sampling_rate)
+        self.samples = deque(maxlen=SAMPLE_BUFFER_SIZE)
+        self.pushed_until = self.clock()
+        self.idle = False
+        self.read_errors = 0
+        self.dropped_batches = 0
+        self.reconnects = 0
+        self.outage_start = None
+        self.outages = deque()
+        self._stop_event = threading.Event()
+
+    def set_sampling_rate(self, sampling_rate):
+        self.scheduler.set_sampling_rate(sampling_rate)
+
+    def stop(self):
+        self._stop_event.set()
+        self.scheduler.wake()
+
+    def watermark(self, now):
+        # 之后取出的样本时间戳都不早于返回值；now 须在调用前由 clock 取得
+        if not self.is_alive():
+            return np.inf
+        return now if self.idle else self.pushed_until
+
+    def push_batch(self, ticks, rows, lateness):
+        # ticks 为每次读取前后的 (开始, 结束) 时钟读数，lateness 为对应节拍的延迟 (s)
+        if ticks:
+            ticks = np.array(ticks, dtype=np.int64)
+            if len(self.samples) == self.samples.maxlen:
+                self.dropped_batches += 1
+            self.samples.append((self.clock.utc((ticks[:, 0] + ticks[:, 1]) // 2),
+                                 np.array(rows, dtype=np.float64).reshape(len(ticks), self.channel_count),
+                                 (ticks[:, 1] - ticks[:, 0]) / 1e9,
+                                 np.array(lateness, dtype=np.float64)))
+        self.pushed_until = self.clock()
+
+    def recover(self, outage_start, error):
+        # 设备无响应：按退避间隔重连直到成功；等待期间被要求停止时返回 False。
+        # 中断期间视为空闲，多台设备时不阻塞其他设备的数据写入
+        self.outage_start = outage_start
+        self.idle = True
+        print(f"Device not responding ({error}), reconnecting")
+        delay = RECONNECT_DELAY
+        recovered = False
+        while not self._stop_event.wait(delay):
+            try:
+                self.reader.reconnect()
+            except Exception as e:
+                error = e
+                delay = min(delay * 2, RECONNECT_MAX_DELAY)
+                continue
+            self.reconnects += 1
+            recovered = True
+            print("Device reconnected")
+            break
+        self.outages.append((outage_start, self.clock(), str(error)))
+        self.outage_start = None
+        return recovered
+
+    def run(self):
+        reader = self.reader
+        clock_ticks = self.clock.ticks
+        ticks = []
+        rows = []
+        lateness = []
+        failures = 0
+        batch_start = time.perf_counter()
+        while True:
+            # 没有未交出的样本时，等待期间的时间都可以算作已交出
+            self.idle = not ticks
+            if not self.scheduler.wait(self._stop_event):
+                break
+            self.idle = False
+            start = clock_ticks()
+            try:
+                rows.append(reader.read())
+                ticks.append((start, clock_ticks()))
+                lateness.append(self.scheduler.last_lateness)
+                failures = 0
+            except Exception as e:
+                self.read_errors += 1
+                failures += 1
+                print(f"Failed to read voltage: {e}")
+                if failures == 1:
+                    outage_start = self.clock.utc(start)
+                if failures >= RECONNECT_FAILURES and hasattr(reader, 'reconnect'):
+                    self.push_batch(ticks, rows, lateness)
+                    ticks = []
+                    rows = []
+                    lateness = []
+                    if not self.recover(outage_start, e):
+                        break
+                    failures = 0
+                    batch_start = time.perf_counter()
+                    continue
+            if time.perf_counter() - batch_start >= BATCH_INTERVAL:
+                self.push_batch(ticks, rows, lateness)
+                ticks = []
+                rows = []
+                lateness = []
+                batch_start = time.perf_counter()
+        self.push_batch(ticks, rows, lateness)
+
+
+def recording_file_name(plan, directory='', extension='.edf'):
+    current_time = dt.datetime.now().strftime('%Y-%m-%d_%H-%M-%S')
+    testname = plan.header.get('TestName') if 'TestName' in plan.header else ''
+
+    if not(testname =='' ):
+        file_name = current_time+'_'+str(testname)+extension
+    else:
+        file_name = f"{current_time}{extension}"
+    return os.path.join(directory, file_name)
+
+
+def create_edf_file(plan, directory=''):
+    # 写入 EDF 表头并返回文件名
+    header = plan.header
+    # 检查文件是否存在
+    file_name = recording_file_name(plan, directory)
+    if not(os.path.exists(file_name)):
+        write_edf_header(file_name, header, plan.columns, plan.column_metadata)
+    return file_name
+
+
+def create_binary_file(plan, directory=''):
+    # 写入二进制记录的文件头并返回文件名
+    file_name = recording_file_name(plan, directory, RECORDING_FORMATS['binary'])
+    write_binary_header(file_name, plan, plan.header)
+    return file_name
+
+
+def write_binary_header(file_name, plan, header):
+    # 二进制记录的文件头，JSON 表头包含与 EDF 相同的 header 和 column_metadata
+    stored, dtypes, aliases = binary_layout(plan)
+    header = json.dumps({
+        'version': 1,
+        'date': dt.datetime.now().astimezone().isoformat(),
+        'header': header,
+        'columns': list(plan.columns),
+        'column_metadata': plan.column_metadata,
+        'stored': stored,
+        'dtypes': dtypes,
+        'aliases': aliases,
+    }, default=str).encode('utf-8')
+    with open(file_name, 'xb') as f:
+        f.write(BINARY_MAGIC + struct.pack('<I', len(header)) + header)
+
+
+class SegmentedWriter:
+    # 分段记录，接口与 EdfWriter 相同。数据依次写入 <记录名>.0001.edf、.0002.edf ...（或 .sekb），
+    # 当前段超过 policy.max_bytes 字节或 policy.max_seconds 秒（按 Epoch_UTC）时在批次边界换下一段。
+    # 每段都有完整的表头（header 另加 Segment=序号），可以单独打开。
+    # file_name 为索引文件 <记录名>.sekidx（JSON）：每段的文件名、首末时间、行数，以及每隔约 index_rows 行
+    # 一个块的 [首行时间, 字节位置]，块在批次边界开始。开始新段、压缩完成和关闭时整体原子地重写；
+    # 异常中断时最后一段的首末时间可能缺失，读取时从文件本身得到。
+    # compress 时关闭的段在后台线程中压缩为 <段>.gz，每个块（以及表头）是一个独立的 gzip 成员，
+    # 成员的位置记入索引（members），读取时只解压需要的块；压缩完成后删除原文件。
+    # keep 限制保留的段数，超出时删除最早的段（正在压缩的段在压缩完成后删除）。
+    # 索引在采集线程和压缩线程中修改，由 lock 保护
+    def __init__(self, plan, directory='', file_format='edf', policy=SegmentPolicy(), metrics=None):
+        self.plan = plan
+        self.directory = directory
+        self.file_format = file_format
+        self.policy = policy
+        self.metrics = metrics
+        base = recording_file_name(plan, directory, '')
+        self.base_name = os.path.basename(base)
+        self.file_name = base + SEGMENT_INDEX_EXTENSION
+        if os.path.exists(self.file_name):
+            raise FileExistsError(f"'{self.file_name}' already exists")
+        self.index = {
+            'version': 1,
+            'format': file_format,
+            'columns': list(plan.columns),
+            'index_rows': policy.index_rows,
+            'segments': [],
+        }
+        self.lock = threading.Lock()
+        self.compressor = ThreadPoolExecutor(1, 'SegmentCompressor') if policy.compress else None
+        self.number = 0
+        self.writer = None
+        self.segment = None
+        self.block_rows = 0
+        self.open_segment()
+
+    def path(self, segment):
+        return os.path.join(self.directory, segment['file'])
+
+    def save_index(self):
+        # 调用时持有 lock
+        temp_name = self.file_name + '.tmp'
+        with open(temp_name, 'w', encoding='utf-8', newline='\n') as f:
+            json.dump(self.index, f, default=str)
+        os.replace(temp_name, self.file_name)
+
+    def open_segment(self):
+        self.number += 1
+        file_name = os.path.join(self.directory,
+                                 f"{self.base_name}.{self.number:04d}{RECORDING_FORMATS[self.file_format]}")
+        header = dict(self.plan.header, Segment=self.number)
+        if self.file_format == 'binary':
+            write_binary_header(file_name, self.plan, header)
+            self.writer = BinaryWriter(file_name, self.plan, metrics=self.metrics)
+        else:
+            write_edf_header(file_name, header, self.plan.columns, self.plan.column_metadata)
+            self.writer = EdfWriter(file_name, self.plan.columns, self.plan.column_metadata, metrics=self.metrics)
+        self.segment = {'file': os.path.basename(file_name), 'first': None, 'last': None, 'rows': 0, 'bytes': None,
+                        'blocks': [], 'compressed': False}
+        self.block_rows = 0
+        with self.lock:
+            self.index['segments'].append(self.segment)
+            self.save_index()
+
+    def segment_full(self, timestamp):
+        # 大小按已写盘的部分计算，最多相差一次写盘的数据量
+        if self.segment['first'] is None:
+            return False
+        if self.policy.max_seconds and timestamp - self.segment['first'] >= self.policy.max_seconds:
+            return True
+        return bool(self.policy.max_bytes) and os.fstat(self.writer.file.fileno()).st_size >= self.policy.max_bytes
+
+    def write(self, rows):
+        rows = np.asarray(rows, dtype=np.float64).reshape(-1, len(self.plan.columns))
+        if not len(rows):
+            return
+        if self.segment_full(rows[0, 0]):
+            self.rotate()
+        block = None
+        if not self.segment['blocks'] or self.block_rows >= self.policy.index_rows:
+            # 新块从文件当前末尾开始，先把缓冲中的行写盘
+            self.writer.flush()
+            block = [rows[0, 0], os.fstat(self.writer.file.fileno()).st_size]
+            self.block_rows = 0
+        with self.lock:
+            if block is not None:
+                self.segment['blocks'].append(block)
+            if self.segment['first'] is None:
+                self.segment['first'] = rows[0, 0]
+            self.segment['last'] = rows[-1, 0]
+            self.segment['rows'] += len(rows)
+        self.block_rows += len(rows)
+        self.writer.write(rows)
+
+    def flush(self):
+        self.writer.flush()
+
+    def close_segment(self):
+        self.writer.close()
+        segment = self.segment
+        with self.lock:
+            segment['bytes'] = os.path.getsize(self.path(segment))
+            segment['compressing'] = self.compressor is not None and segment['rows'] > 0
+            self.save_index()
+        if segment['compressing']:
+            self.compressor.submit(self.compress_segment, segment)
+
+    def rotate(self):
+        self.close_segment()
+        self.open_segment()
+        if self.policy.keep:
+            self.remove_old_segments()
+
+    def remove_old_segments(self):
+        # 正在压缩的段等压缩完成后再删除
+        with self.lock:
+            segments = self.index['segments']
+            removed = [segment for segment in segments[:max(len(segments) - self.policy.keep, 0)]
+                       if not segment.get('compressing')]
+            if not removed:
+                return
+            self.index['segments'] = [segment for segment in segments if segment not in removed]
+            self.save_index()
+        for segment in removed:
+            try:
+                os.remove(self.path(segment))
+            except OSError as e:
+                print(f"Failed to remove {segment['file']}: {e}")
+
+    def compress_segment(self, segment):
+        # 在压缩线程中运行：表头和每个块分别压缩为一个 gzip 成员，合起来仍是标准的 gzip 文件
+        path = self.path(segment)
+        offsets = [0] + [block[1] for block in segment['blocks']] + [segment['bytes']]
+        members = [0]
+        try:
+            with open(path, 'rb') as source, open(path + '.gz.tmp', 'wb') as target:
+                for start, end in zip(offsets[:-1], offsets[1:]):
+                    compressor = zlib.compressobj(SEGMENT_COMPRESS_LEVEL, zlib.DEFLATED, 31)
+                    target.write(compressor.compress(source.read(end - start)) + compressor.flush())
+                    members.append(target.tell())
+            os.replace(path + '.gz.tmp', path + '.gz')
+        except OSError as e:
+            print(f"Failed to compress {segment['file']}: {e}")
+            with self.lock:
+                segment['compressing'] = False
+        else:
+            with self.lock:
+                segment.update(file=segment['file'] + '.gz', compressed=True, members=members, compressing=False)
+                self.save_index()
+            os.remove(path)
+        # 换段时因正在压缩而跳过的段在这里删除
+        if self.policy.keep:
+            self.remove_old_segments()
+
+    def close(self):
+        # 等待所有段压缩完成，再按 keep 删除一次多余的段
+        if self.writer.file.closed:
+            return
+        self.close_segment()
+        if self.compressor is not None:
+            self.compressor.shutdown(wait=True)
+        if self.policy.keep:
+            self.remove_old_segments()
+
+
+class AcquisitionSession:
+    # 一次采集：按通道计划启动采样线程，poll() 取出已采集的批次、换算并写入记录文件
+    # （file_format 为 RECORDING_FORMATS 之一）。通道按 SampleRate 分组，每组再由
+    # backend.create_readers() 按设备分组，每台设备的每个频率一个采样线程，慢速通道不占用快速通道的
+    # 总线时间；各线程共用同一时钟并从同一节拍开始。没有 SampleRate 的通道使用 sampling_rate，
+    # 可由 set_sampling_rate 修改。多个线程时每行只含一个线程的通道（其余列为 nan），
+    # 各线程的数据按时间顺序合并后写入，每个通道的时间戳即其所在行的 Epoch_UTC。
+    # 运行指标（读取耗时、节拍延迟、公式和写盘耗时、缓冲占用、错误数）记在 metrics 中，
+    # 可用 export_metrics 定期导出到文件。设备断开后采样线程自动重连，
+    # 每次中断的时间段逐行追加到记录文件旁的 <记录名>.outages.csv。
+    # publish() 后每次 poll() 取出的数据行同时推送给本机的订阅者（见 sek_publisher）。
+    # 给出 segments（SegmentPolicy）时分段记录，file_name 为索引文件
+    def __init__(self, backend, plan, sampling_rate, directory='', file_format='edf', segments=None):
+        self.plan = plan
+        self.metrics = Metrics()
+        self.exporter = None
+        self.publisher = None
+        if segments is not None:
+            self.writer = SegmentedWriter(plan, directory, file_format, segments, metrics=self.metrics)
+            self.file_name = self.writer.file_name
+        elif file_format == 'binary':
+            self.file_name = create_binary_file(plan, directory)
+            self.writer = BinaryWriter(self.file_name, plan, metrics=self.metrics)
+        else:
+            self.file_name = create_edf_file(plan, directory)
+            self.writer = EdfWriter(self.file_name, plan.columns, plan.column_metadata, metrics=self.metrics)
+        self.clock = SharedClock()
+        self.samplers = []
+        self.sampler_channels = []
+        rate_groups = {}
+        for channel in plan.channels:
+            rate_groups.setdefault(channel.sample_rate, []).append(channel)
+        for rate, channels in rate_groups.items():
+            for reader, positions in backend.create_readers([channel.port_index for channel in channels]):
+                sampler = SamplerWorker(reader, len(positions), rate or sampling_rate, self.clock)
+                sampler.fixed_rate = rate is not None
+                self.samplers.append(sampler)
+                self.sampler_channels.append([channels[i] for i in positions])
+        self.pending = np.empty((0, len(plan.columns)))
+        # 派生信号的处理级保存跨批次的状态，每次采集重新创建
+        self.chains = {derived.index: StageChain(derived.stages)
+                       for channel in plan.channels for derived in channel.derived}
+        self.outage_file = os.path.splitext(self.file_name)[0] + '.outages.csv'
+
+    def start(self):
+        anchor = time.perf_counter() + START_DELAY if len(self.samplers) > 1 else None
+        for sampler in self.samplers:
+            sampler.scheduler.start_anchor = anchor
+            sampler.start()
+
+    def export_metrics(self, file_name, interval=METRICS_INTERVAL):
+        # 每 interval 秒把指标写入 file_name（.json 为 JSON，否则为 Prometheus 文本格式），停止时再写一次
+        self.exporter = MetricsExporter(self.metrics, file_name, interval)
+
+    def publish(self, host=None, port=None, framing='jsonl', queue_size=None, policy='drop-oldest'):
+        # 在 host:port 上开始发布数据行（默认值见 sek_publisher），返回实际监听的端口。在 start() 之前调用。
+        # asyncio 只在发布时才导入
+        from sek_publisher import PUBLISH_HOST, PUBLISH_PORT, QUEUE_SIZE, LivePublisher
+
+        hello = {
+            'file': os.path.basename(self.file_name),
+            'header': self.plan.header,
+            'columns': list(self.plan.columns),
+            'column_metadata': self.plan.column_metadata,
+        }
+        publisher = LivePublisher(hello, host or PUBLISH_HOST, PUBLISH_PORT if port is None else port, framing,
+                                  queue_size or QUEUE_SIZE, policy)
+        publisher.start()
+        self.publisher = publisher
+        return publisher.port
+
+    def set_sampling_rate(self, sampling_rate):
+        # 只影响 custom header 中没有 SampleRate 的通道
+        for sampler in self.samplers:
+            if not sampler.fixed_rate:
+                sampler.set_sampling_rate(sampling_rate)
+
+    def stats(self):
+        # 所有采样线程合计：频率取实际/目标之比最低的线程，workers 为每个线程的统计
+        workers = [sampler.scheduler.stats() for sampler in self.samplers]
+        stats = min(workers, key=lambda item: item['achieved_rate'] / item['requested_rate']).copy()
+        stats['missed'] = sum(item['missed'] for item in workers)
+        stats['max_lateness'] = max(item['max_lateness'] for item in workers)
+        stats['workers'] = workers
+        return stats
+
+    def collect(self, sampler, channels):
+        batches = []
+        while sampler.samples:
+            batches.append(sampler.samples.popleft())
+        if not batches:
+            return None
+        timestamps = np.concatenate([batch[0] for batch in batches])
+        values = np.concatenate([batch[1] for batch in batches])
+        rows = np.empty((len(timestamps), len(self.plan.columns)))
+        if len(channels) < len(self.plan.channels):
+            rows.fill(np.nan)
+        rows[:, 0] = timestamps
+        latencies = np.concatenate([batch[2] for batch in batches])
+        if self.plan.latency_index is not None:
+            rows[:, self.plan.latency_index] = latencies
+        self.metrics.observe('serial_rtt_seconds', latencies)
+        self.metrics.observe('tick_lateness_seconds', np.concatenate([batch[3] for batch in batches]))
+        start = time.perf_counter()
+        for i, channel in enumerate(channels):
+            rows[:, channel.voltage_index] = values[:, i]
+            # 计算公式结果
+            rows[:, channel.value_index] = channel.formula(values[:, i])
+        self.metrics.observe('formula_seconds', time.perf_counter() - start)
+        if self.chains:
+            start = time.perf_counter()
+            for channel in channels:
+                for derived in channel.derived:
+                    rows[:, derived.index] = self.chains[derived.index].process(timestamps,
+                                                                               rows[:, channel.value_index])
+            self.metrics.observe('filter_seconds', time.perf_counter() - start)
+        return rows
+
+    def record_outages(self, sampler, channels):
+        # 中断很少发生，每次都重新打开文件追加，不在采集期间保持打开
+        if not sampler.outages:
+            return
+        new_file = not os.path.exists(self.outage_file)
+        with open(self.outage_file, 'a', encoding='utf-8', newline='\n') as f:
+            if new_file:
+                f.write('\t'.join(OUTAGE_COLUMNS) + '\n')
+            while sampler.outages:
+                start, end, error = sampler.outages.popleft()
+                f.write(f"{start!r}\t{end!r}\t{end - start:.3f}\t"
+                        f"{' '.join(channel.port for channel in channels)}\t{error}\n")
+                self.metrics.count('outages_total')
+                self.metrics.count('outage_seconds_total', end - start)
+
+    def update_metrics(self, rows):
+        metrics = self.metrics
+        workers = [sampler.scheduler.stats() for sampler in self.samplers]
+        metrics.set_total('samples_total', sum(item['ticks'] for item in workers))
+        metrics.set_total('missed_ticks_total', sum(item['missed'] for item in workers))
+        metrics.set_total('read_errors_total', sum(sampler.read_errors for sampler in self.samplers))
+        metrics.set_total('dropped_batches_total', sum(sampler.dropped_batches for sampler in self.samplers))
+        metrics.set_total('reconnects_total', sum(sampler.reconnects for sampler in self.samplers))
+        metrics.set('devices_down', sum(sampler.outage_start is not None for sampler in self.samplers))
+        if rows is not None:
+            metrics.count('rows_written_total', len(rows))
+        metrics.set('buffer_fill_ratio',
+                    max(len(sampler.samples) / sampler.samples.maxlen for sampler in self.samplers))
+        metrics.set('pending_rows', len(self.pending))
+        for i, item in enumerate(workers):
+            metrics.set('requested_rate_hz', item['requested_rate'], worker=i)
+            metrics.set('achieved_rate_hz', item['achieved_rate'], worker=i)
+        if self.publisher is not None:
+            metrics.set('subscribers', self.publisher.subscriber_count)
+            metrics.set_total('published_batches_total', self.publisher.published)
+            metrics.set_total('subscriber_dropped_batches_total', self.publisher.dropped)
+        if self.exporter is not None:
+            self.exporter.maybe_export()
+
+    def poll(self):
+        # 返回本次取出的数据行（列顺序同 plan.columns），没有新数据时返回 None
+        for sampler, channels in zip(self.samplers, self.sampler_channels):
+            self.record_outages(sampler, channels)
+        if len(self.samplers) == 1:
+            rows = self.collect(self.samplers[0], self.sampler_channels[0])
+        else:
+            # 只输出早于所有线程水位的行，其余留到下次，保证写入的数据按时间排序
+            now = self.clock()
+            watermark = min(sampler.watermark(now) for sampler in self.samplers)
+            parts = [self.pending] + [self.collect(sampler, channels)
+                                      for sampler, channels in zip(self.samplers, self.sampler_channels)]
+            rows = np.concatenate([part for part in parts if part is not None])
+            rows = rows[np.argsort(rows[:, 0], kind='stable')]
+            split = np.searchsorted(rows[:, 0], watermark, 'right')
+            rows, self.pending = rows[:split], rows[split:]
+            if not len(rows):
+                rows = None
+        if rows is not None:
+            start = time.perf_counter()
+            self.writer.write(rows)
+            self.metrics.observe('write_seconds', time.perf_counter() - start)
+            if self.publisher is not None:
+                self.publisher.publish(rows)
+        self.update_metrics(rows)
+        return rows
+
+    def stop(self):
+        # 停止采样并把剩余数据写盘，返回最后取出的数据行
+        for sampler in self.samplers:
+            sampler.stop()
+        for sampler in self.samplers:
+            if sampler.ident is not None:  # 设置失败时可能尚未启动
+                sampler.join()
+        try:
+            return self.poll()
+        finally:
+            self.writer.close()
+            if self.publisher is not None:
+                try:
+                    self.publisher.stop()
+                except Exception as e:
+                    print(f"Failed to stop publishing: {e}")
+            if self.exporter is not None:
+                self.exporter.export()
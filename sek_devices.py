@@ -0,0 +1,453 @@
+# 采集设备后端：真实的串口 SensorBridge，以及不需要硬件的模拟设备。
+# 后端统一提供 port_dict、connect()、create_reader()、create_readers()、disconnect()，
+# create_reader() 返回的对象每次 read() 按端口顺序返回一组电压，reconnect() 重新连接设备；
+# create_readers() 按设备分组，每组 (reader, 端口在参数中的位置)，每组由一个采样线程读取。
+# SHDLC 驱动在第一次连接设备时才导入，不拖慢界面启动
+
+import math
+import os
+import random
+import struct
+import threading
+import time
+
+BAUDRATE = 460800
+PORT_DICT = {'Port1': 0, 'Port2': 1}
+# 串口下拉框中的模拟设备选项
+SIMULATED_BACKENDS = {'Simulated': 'sim', 'Simulated (SHDLC)': 'sim-shdlc'}
+WAVEFORMS = ('sine', 'square', 'triangle', 'sawtooth', 'constant')
+AIN_MAX_VOLTAGE = 5.5
+
+FLOAT_BE = struct.Struct('>f')
+FLOAT_LE = struct.Struct('<f')
+
+# SHDLC 帧的起止、转义字节
+SHDLC_START_STOP = 0x7E
+SHDLC_ESCAPE = 0x7D
+SHDLC_ESCAPE_XOR = 0x20
+SHDLC_STUFFED = (0x7E, 0x7D, 0x11, 0x13)
+
+
+class AnalogReader:
+    # 每个端口的模拟量测量命令只构造一次，逐拍只做 SHDLC 收发与解码，
+    # 省去 measure_voltage 每次调用时的端口校验和命令对象构造。
+    # SensorBridge 的 AIN 测量没有设备端周期测量/缓冲读取（驱动只对 I2C 重复收发提供），
+    # 因此仍是每端口一次往返
+    def __init__(self, device, port_indexes, backend=None):
+        from sensirion_shdlc_sensorbridge.commands import SensorBridgeCmdAnalogMeasurement
+        from sensirion_shdlc_sensorbridge.definitions import port_to_byte
+
+        self.device = device
+        self.backend = backend
+        self.commands = [SensorBridgeCmdAnalogMeasurement(port_to_byte(index, accept_all=False))
+                         for index in port_indexes]
+
+    def read(self):
+        # 固件以小端传输 float，需与 measure_voltage 一样交换字节序
+        return [FLOAT_LE.unpack(FLOAT_BE.pack(self.device.execute(command)))[0]
+                for command in self.commands]
+
+    def reconnect(self):
+        self.device = self.backend.reconnect(self.device)
+
+
+class SensorBridgeBackend:
+    # 通过 SHDLC 连接的 SensorBridge；shdlc_port 为 None 时打开 serial_port 串口
+    def __init__(self, serial_port, baudrate=BAUDRATE, shdlc_port=None):
+        self.serial_port = serial_port
+        self.baudrate = baudrate
+        self.port_dict = PORT_DICT
+        self.shdlc_port = shdlc_port
+        self.device = None
+        self.port_indexes = []
+        self.power_voltage = None
+        self.lock = threading.Lock()
+
+    def connect(self, power_voltage, port_indexes):
+        from sensirion_shdlc_driver import ShdlcConnection, ShdlcSerialPort
+        from sensirion_shdlc_sensorbridge import SensorBridgeShdlcDevice
+
+        if self.shdlc_port is None:
+            self.shdlc_port = ShdlcSerialPort(port=self.serial_port, baudrate=self.baudrate)
+        elif not self.shdlc_port.is_open:
+            self.shdlc_port.open()
+        try:
+            device = SensorBridgeShdlcDevice(ShdlcConnection(self.shdlc_port), slave_address=0)
+            for index in port_indexes:
+                device.set_supply_voltage(index, voltage=power_voltage)
+        except Exception:
+            self.shdlc_port.close()
+            raise
+        self.device = device
+        self.port_indexes = list(port_indexes)
+        self.power_voltage = power_voltage
+
+    def reconnect(self, failed_device):
+        # 重新打开串口（USB 重新插入后同名串口可以直接打开）并重新设置已选端口的供电电压，
+        # 返回新的设备对象。同一台设备的多个采样线程会先后调用，已被其他线程重连时直接返回
+        with self.lock:
+            if self.power_voltage is None:
+                raise RuntimeError("device is disconnected")
+            if self.device is not failed_device:
+                return self.device
+            try:
+                self.shdlc_port.close()
+            except Exception:
+                pass
+            self.connect(self.power_voltage, self.port_indexes)
+            return self.device
+
+    def create_reader(self, port_indexes):
+        return AnalogReader(self.device, port_indexes, self)
+
+    def create_readers(self, port_indexes):
+        return [(self.create_reader(port_indexes), list(range(len(port_indexes))))]
+
+    def disconnect(self):
+        self.power_voltage = None
+        try:
+            if self.device is not None and self.shdlc_port.is_open:
+                for index in self.port_indexes:
+                    self.device.switch_supply_off(index)
+        finally:
+            self.shdlc_port.close()
+            self.device = None
+
+
+class SignalGenerator:
+    # 模拟电压信号：offset + amplitude * 波形(frequency * t + 端口相位) + 高斯噪声，限制在 AIN 量程内
+    def __init__(self, waveform='sine', amplitude=1.0, offset=1.65, frequency=0.1, noise=0.01, seed=None):
+        if waveform not in WAVEFORMS:
+            raise ValueError(f"unknown waveform '{waveform}', expected one of {', '.join(WAVEFORMS)}")
+        self.waveform = waveform
+        self.amplitude = amplitude
+        self.offset = offset
+        self.frequency = frequency
+        self.noise = noise
+        self.random = random.Random(seed)
+        self.start = time.perf_counter()
+
+    def voltage(self, port_index):
+        phase = (time.perf_counter() - self.start) * self.frequency + port_index / 4
+        phase -= math.floor(phase)
+        if self.waveform == 'sine':
+            shape = math.sin(2 * math.pi * phase)
+        elif self.waveform == 'square':
+            shape = 1.0 if phase < 0.5 else -1.0
+        elif self.waveform == 'triangle':
+            shape = 4 * abs(phase - 0.5) - 1
+        elif self.waveform == 'sawtooth':
+            shape = 2 * phase - 1
+        else:
+            shape = 0.0
+        value = self.offset + self.amplitude * shape
+        if self.noise:
+            value += self.random.gauss(0.0, self.noise)
+        return min(max(value, 0.0), AIN_MAX_VOLTAGE)
+
+
+class SimulatedOutages:
+    # 模拟设备断开：每 period 秒的最后 duration 秒内无法通信，读取和重连都失败
+    def __init__(self, period, duration):
+        self.period = period
+        self.duration = duration
+        self.start = time.monotonic()
+
+    def check(self):
+        if (time.monotonic() - self.start) % self.period >= self.period - self.duration:
+            raise OSError("simulated SensorBridge unplugged")
+
+
+def wait_latency(latency):
+    # 模拟每条命令的往返时间；短延时用自旋，避免 sleep 的调度粒度
+    if latency <= 0:
+        return
+    deadline = time.perf_counter() + latency
+    if latency > 0.002:
+        time.sleep(latency - 0.002)
+    while time.perf_counter() < deadline:
+        time.sleep(0)
+
+
+class SimulatedReader:
+    def __init__(self, signal, port_indexes, latency, backend=None):
+        self.signal = signal
+        self.port_indexes = list(port_indexes)
+        self.latency = latency
+        self.backend = backend
+
+    def read(self):
+        if self.backend is not None and self.backend.outages is not None:
+            self.backend.outages.check()
+        values = []
+        for index in self.port_indexes:
+            wait_latency(self.latency)
+            values.append(self.signal.voltage(index))
+        return values
+
+    def reconnect(self):
+        self.backend.reconnect()
+
+
+class SimulatedBackend:
+    # 不经过 SHDLC 的模拟设备，可设置任意通道数和每条命令的延迟，用于测量程序自身的吞吐上限；
+    # outages 为 SimulatedOutages 时模拟设备周期性断开
+    def __init__(self, channels=2, latency=0.0, signal=None, outages=None):
+        self.port_dict = {f'Port{i + 1}': i for i in range(channels)}
+        self.latency = latency
+        self.signal = signal if signal is not None else SignalGenerator()
+        self.outages = outages
+        self.power_voltage = None
+
+    def connect(self, power_voltage, port_indexes):
+        self.power_voltage = power_voltage
+
+    def reconnect(self):
+        if self.power_voltage is None:
+            raise RuntimeError("device is disconnected")
+        if self.outages is not None:
+            self.outages.check()
+
+    def create_reader(self, port_indexes):
+        return SimulatedReader(self.signal, port_indexes, self.latency, self)
+
+    def create_readers(self, port_indexes):
+        return [(self.create_reader(port_indexes), list(range(len(port_indexes))))]
+
+    def disconnect(self):
+        self.power_voltage = None
+
+
+class BridgeGroup:
+    # 多台设备作为一个后端：端口按设备顺序统一编号为 Port1..PortN（第一台为 Port1、Port2，
+    # 第二台为 Port3、Port4……），create_readers() 为每台设备返回一个 reader，
+    # 各台设备在各自的串口上由各自的采样线程并行读取
+    def __init__(self, backends):
+        self.backends = list(backends)
+        self.port_dict = {}
+        self.locations = []  # 统一编号 -> (后端, 该后端上的端口号)
+        for backend in self.backends:
+            for index in sorted(backend.port_dict.values()):
+                self.port_dict[f'Port{len(self.locations) + 1}'] = len(self.locations)
+                self.locations.append((backend, index))
+        self.connected = []
+
+    def split(self, port_indexes):
+        # 按后端分组：{后端: ([该后端上的端口号], [在 port_indexes 中的位置])}
+        groups = {}
+        for position, index in enumerate(port_indexes):
+            backend, local_index = self.locations[index]
+            indexes, positions = groups.setdefault(backend, ([], []))
+            indexes.append(local_index)
+            positions.append(position)
+        return groups
+
+    def connect(self, power_voltage, port_indexes):
+        # 只连接有选中端口的设备；任何一台连接失败时断开已连接的设备
+        try:
+            for backend, (indexes, _) in self.split(port_indexes).items():
+                backend.connect(power_voltage, indexes)
+                self.connected.append(backend)
+        except Exception:
+            self.disconnect()
+            raise
+
+    def create_reader(self, port_indexes):
+        groups = self.split(port_indexes)
+        if len(groups) != 1:
+            raise ValueError("create_reader() needs ports of a single device, use create_readers()")
+        (backend, (indexes, _)), = groups.items()
+        return backend.create_reader(indexes)
+
+    def create_readers(self, port_indexes):
+        return [(backend.create_reader(indexes), positions)
+                for backend, (indexes, positions) in self.split(port_indexes).items()]
+
+    def disconnect(self):
+        errors = []
+        while self.connected:
+            try:
+                self.connected.pop().disconnect()
+            except Exception as e:
+                errors.append(e)
+        if errors:
+            raise errors[0]
+
+
+def stuff_bytes(data):
+    stuffed = bytearray()
+    for byte in data:
+        if byte in SHDLC_STUFFED:
+            stuffed += bytes([SHDLC_ESCAPE, byte ^ SHDLC_ESCAPE_XOR])
+        else:
+            stuffed.append(byte)
+    return stuffed
+
+
+def unstuff_bytes(data):
+    unstuffed = bytearray()
+    xor = 0x00
+    for byte in data:
+        if byte == SHDLC_ESCAPE:
+            xor = SHDLC_ESCAPE_XOR
+        else:
+            unstuffed.append(byte ^ xor)
+            xor = 0x00
+    return unstuffed
+
+
+class SensorBridgeSimulator:
+    # 模拟 SensorBridge 固件的 SHDLC 协议层：解析请求帧 (MOSI)，执行命令，生成响应帧 (MISO)。
+    # 支持设置/开关端口电源、模拟量测量、设备信息和版本，其他命令返回错误
+    def __init__(self, signal=None, serial_number='SIM00001', firmware=(6, 0)):
+        self.signal = signal if signal is not None else SignalGenerator()
+        self.serial_number = serial_number
+        self.firmware = firmware
+        self.supply_on = {0: False, 1: False}
+
+    def execute(self, command_id, data):
+        # 返回 (状态字节, 响应数据)
+        if command_id == 0x80 and len(data) == 1 and data[0] in self.supply_on:
+            return 0x00, FLOAT_LE.pack(self.signal.voltage(data[0]))
+        if command_id in (0x00, 0x01) and len(data) == 2:
+            ports = list(self.supply_on) if data[0] == 0xFF else [data[0]]
+            for port in ports:
+                if port in self.supply_on:
+                    self.supply_on[port] = command_id == 0x00 or bool(data[1])
+            return 0x00, b''
+        if command_id == 0xD0 and len(data) == 1:
+            info = {0x00: '00080000', 0x01: 'SensorBridge', 0x02: '', 0x03: self.serial_number}
+            if data[0] in info:
+                return 0x00, info[data[0]].encode('ascii') + b'\0'
+        if command_id == 0xD1 and not data:
+            return 0x00, bytes([self.firmware[0], self.firmware[1], 0, 1, 0, 1, 0])
+        return 0x02, b''  # 不支持的命令
+
+    def handle_frame(self, frame):
+        # frame 为去掉首尾 0x7E 的原始字节，校验失败时不响应（返回 None）
+        frame = unstuff_bytes(frame)
+        if len(frame) < 4 or frame[2] != len(frame) - 4:
+            return None
+        if (~sum(frame[:-1])) & 0xFF != frame[-1]:
+            return None
+        address, command_id = frame[0], frame[1]
+        state, data = self.execute(command_id, bytes(frame[3:-1]))
+        response = bytearray([address, command_id, state, len(data)]) + data
+        response.append((~sum(response)) & 0xFF)
+        return bytes([SHDLC_START_STOP]) + stuff_bytes(response) + bytes([SHDLC_START_STOP])
+
+
+class SimulatedShdlcPort:
+    # 进程内的 SHDLC 端口（实现 sensirion_shdlc_driver 的 ShdlcPort 接口）：请求和响应都按串口帧格式编码/解码后交给 SensorBridgeSimulator，
+    # 可直接用于 SensorBridgeShdlcDevice，latency 模拟每条命令的往返时间，
+    # outages 为 SimulatedOutages 时模拟 USB 周期性断开
+    def __init__(self, simulator=None, latency=0.0, bitrate=BAUDRATE, outages=None):
+        from sensirion_shdlc_driver.serial_frame_builder import ShdlcSerialMisoFrameBuilder, \
+            ShdlcSerialMosiFrameBuilder
+
+        self.mosi_builder = ShdlcSerialMosiFrameBuilder
+        self.miso_builder = ShdlcSerialMisoFrameBuilder
+        self.simulator = simulator if simulator is not None else SensorBridgeSimulator()
+        self.latency = latency
+        self.outages = outages
+        self._bitrate = bitrate
+        self._lock = threading.RLock()
+        self._is_open = True
+
+    @property
+    def description(self):
+        return f"Simulated SensorBridge {self.simulator.serial_number}"
+
+    @property
+    def bitrate(self):
+        return self._bitrate
+
+    @bitrate.setter
+    def bitrate(self, bitrate):
+        self._bitrate = bitrate
+
+    @property
+    def lock(self):
+        return self._lock
+
+    @property
+    def is_open(self):
+        return self._is_open
+
+    def open(self):
+        if self.outages is not None:
+            self.outages.check()
+        self._is_open = True
+
+    def close(self):
+        self._is_open = False
+
+    def transceive(self, slave_address, command_id, data, response_timeout):
+        with self._lock:
+            if self.outages is not None:
+                self.outages.check()
+            request = self.mosi_builder(slave_address, command_id, data).to_bytes()
+            response = self.simulator.handle_frame(request[1:-1])
+            wait_latency(self.latency)
+            builder = self.miso_builder()
+            builder.add_data(response)
+            return builder.interpret_data()
+
+
+class VirtualSerialSensorBridge:
+    # 本地虚拟串口（仅 POSIX，基于 pty）：后台线程在 pty 主端按 SHDLC 协议应答，
+    # port_name 可以像真实设备一样交给 ShdlcSerialPort 或其他串口工具
+    def __init__(self, simulator=None, latency=0.0):
+        import tty
+
+        self.simulator = simulator if simulator is not None else SensorBridgeSimulator()
+        self.latency = latency
+        self.master, slave = os.openpty()
+        tty.setraw(slave)
+        self.port_name = os.ttyname(slave)
+        self._slave = slave
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(target=self._serve, daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self.port_name
+
+    def stop(self):
+        self._stop_event.set()
+        self._thread.join()
+        os.close(self.master)
+        os.close(self._slave)
+
+    def _serve(self):
+        import select
+
+        buffer = bytearray()
+        while not self._stop_event.is_set():
+            ready, _, _ = select.select([self.master], [], [], 0.1)
+            if not ready:
+                continue
+            buffer += os.read(self.master, 4096)
+            # 两个 0x7E 之间为一帧
+            while buffer.count(SHDLC_START_STOP) >= 2:
+                start = buffer.index(SHDLC_START_STOP)
+                end = buffer.index(SHDLC_START_STOP, start + 1)
+                frame = bytes(buffer[start + 1:end])
+                del buffer[:end + 1]
+                if not frame:
+                    buffer.insert(0, SHDLC_START_STOP)  # 连续的 0x7E：后一个是下一帧的起始
+                    continue
+                response = self.simulator.handle_frame(frame)
+                if response is not None:
+                    wait_latency(self.latency)
+                    os.write(self.master, response)
+
+
+def create_backend(name, channels=2, latency=0.0, signal=None, outages=None):
+    # name 为串口名，或 SIMULATED_BACKENDS 中的 'sim' / 'sim-shdlc'；outages 只用于模拟设备
+    if name == 'sim':
+        return SimulatedBackend(channels, latency, signal, outages)
+    if name == 'sim-shdlc':
+        return SensorBridgeBackend(name, shdlc_port=SimulatedShdlcPort(SensorBridgeSimulator(signal), latency,
+                                                                       outages=outages))
+    return SensorBridgeBackend(name)
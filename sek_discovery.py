@@ -0,0 +1,226 @@
+# SensorBridge 自动发现：后台线程定期列出串口（插拔设备时列表变化），对新出现的串口并发地以 460800 baud
+# 发送 SHDLC 命令读取产品名、序列号和固件版本，识别出 SensorBridge，不需要用户逐个尝试连接。
+# 结果按串口名和 hwid（USB VID:PID 和序列号）缓存在用户目录的 JSON 文件中，下次启动时同一串口、
+# 同一 hwid 的结果直接使用，不再探测。无法打开（例如被其他程序占用）或没有响应的串口不缓存，下次启动时重新探测。
+# 不依赖 PyQt5，SHDLC 驱动在第一次探测时才导入
+
+import json
+import os
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, wait
+
+import serial.tools.list_ports
+
+from sek_devices import BAUDRATE
+
+DISCOVERY_CACHE = os.path.join(os.path.expanduser('~'), '.sek_bridges.json')
+SCAN_INTERVAL = 1.0  # 检查串口列表变化的间隔 (s)
+PROBE_TIMEOUT = 0.2  # 探测时每条命令在传输时间之外等待响应的时间 (s)
+PROBE_WORKERS = 8  # 同时探测的串口数
+BRIDGE_PRODUCT = 'SensorBridge'
+SERIAL_NUMBER_PREFIX = 'sn:'  # 按序列号指定设备，例如 sn:12345678
+
+# 一个串口的发现结果。state 为 'probing'（等待探测）、'bridge'、'other'（返回了产品名但不是 SensorBridge）
+# 或 'error'（无法打开或没有正确响应），error 为失败原因
+PortInfo = namedtuple('PortInfo', ['port', 'hwid', 'description', 'state', 'serial_number', 'product', 'firmware',
+                                   'error'], defaults=(None, None, None, None))
+CACHED_FIELDS = ('hwid', 'state', 'serial_number', 'product', 'firmware')
+
+
+def probe_port(port, baudrate=BAUDRATE, timeout=PROBE_TIMEOUT):
+    # 打开串口并读取设备信息，返回 PortInfo（hwid 和 description 为 None）
+    from sensirion_shdlc_driver import ShdlcConnection, ShdlcDevice, ShdlcSerialPort
+
+    try:
+        shdlc_port = ShdlcSerialPort(port, baudrate, additional_response_time=timeout)
+    except Exception as e:
+        return PortInfo(port, None, None, 'error', error=str(e))
+    try:
+        device = ShdlcDevice(ShdlcConnection(shdlc_port), slave_address=0)
+        product = device.get_product_name()
+        if not product.startswith(BRIDGE_PRODUCT):
+            return PortInfo(port, None, None, 'other', product=product)
+        return PortInfo(port, None, None, 'bridge', device.get_serial_number(), product,
+                        str(device.get_version().firmware))
+    except Exception as e:
+        return PortInfo(port, None, None, 'error', error=str(e) or type(e).__name__)
+    finally:
+        shdlc_port.close()
+
+
+def describe_port(info):
+    # 串口列表中显示的文字
+    if info.state == 'bridge':
+        return f"{info.port} - {info.product} {info.serial_number} (FW {info.firmware})"
+    return {'probing': f"{info.port} (probing...)", 'other': f"{info.port} (no SensorBridge)",
+            'error': f"{info.port} (unavailable)"}[info.state]
+
+
+class BridgeDiscovery(threading.Thread):
+    # 发现线程：每 interval 秒调用一次 refresh()。ports() 返回当前所有串口的 PortInfo，
+    # version 在结果变化时加一，界面据此刷新列表。busy 中的串口（已连接）不探测。
+    # present、cache 和 futures 在发现线程、探测线程和界面线程中访问，由 lock 保护
+    def __init__(self, cache_file=DISCOVERY_CACHE, interval=SCAN_INTERVAL, baudrate=BAUDRATE, timeout=PROBE_TIMEOUT,
+                 list_ports=serial.tools.list_ports.comports, probe=probe_port):
+        super().__init__(daemon=True)
+        self.cache_file = cache_file
+        self.interval = interval
+        self.baudrate = baudrate
+        self.timeout = timeout
+        self.list_ports = list_ports
+        self.probe = probe
+        self.lock = threading.Lock()
+        self.version = 0
+        self.busy = set()
+        self.present = {}
+        self.futures = {}
+        self.cache = self.load_cache()
+        self.executor = ThreadPoolExecutor(PROBE_WORKERS, 'BridgeProbe')
+        self._stop_event = threading.Event()
+
+    def load_cache(self):
+        # 只使用确实有响应的结果（旧版本曾把没有响应的串口记为 'other'）。cache_file 为 None 时不使用缓存
+        if self.cache_file is None:
+            return {}
+        try:
+            with open(self.cache_file, encoding='utf-8') as f:
+                ports = json.load(f)['ports']
+            return {name: entry for name, entry in ports.items()
+                    if entry.get('state') in ('bridge', 'other') and entry.get('product')}
+        except (OSError, ValueError, KeyError, TypeError, AttributeError):
+            return {}
+
+    def save_cache(self):
+        # 调用时持有 lock；缓存只是加速，写入失败时忽略
+        if self.cache_file is None:
+            return
+        temp_name = self.cache_file + '.tmp'
+        try:
+            with open(temp_name, 'w', encoding='utf-8', newline='\n') as f:
+                json.dump({'version': 1, 'ports': self.cache}, f, indent=1)
+            os.replace(temp_name, self.cache_file)
+        except OSError:
+            pass
+
+    def ports(self):
+        with self.lock:
+            return sorted(self.present.values())
+
+    def bridges(self):
+        return [info for info in self.ports() if info.state == 'bridge']
+
+    def refresh(self, probe=True):
+        # 列出串口：新出现或 hwid 变化的串口先查缓存，没有缓存时探测；probe 为 False 时只列出不探测
+        listed = {port.device: port for port in self.list_ports()}
+        with self.lock:
+            present = {}
+            for name, port in listed.items():
+                current = self.present.get(name)
+                if current is not None and current.hwid == port.hwid:
+                    present[name] = current
+                    continue
+                cached = self.cache.get(name)
+                if cached is not None and cached.get('hwid') == port.hwid:
+                    present[name] = PortInfo(name, port.hwid, port.description,
+                                             **{key: cached.get(key) for key in CACHED_FIELDS[1:]})
+                else:
+                    present[name] = PortInfo(name, port.hwid, port.description, 'probing')
+            if present != self.present:
+                self.present = present
+                self.version += 1
+            if probe:
+                for name, info in present.items():
+                    if info.state == 'probing' and name not in self.futures and name not in self.busy:
+                        future = self.executor.submit(self.probe, name, self.baudrate, self.timeout)
+                        self.futures[name] = future
+                        future.add_done_callback(lambda future, name=name: self.finish_probe(name, future))
+
+    def finish_probe(self, name, future):
+        # 在探测线程中调用
+        try:
+            result = future.result()
+        except Exception as e:
+            result = PortInfo(name, None, None, 'error', error=str(e))
+        with self.lock:
+            self.futures.pop(name, None)
+            current = self.present.get(name)
+            if current is None:  # 探测期间已拔出
+                return
+            self.present[name] = current._replace(state=result.state, serial_number=result.serial_number,
+                                                  product=result.product, firmware=result.firmware,
+                                                  error=result.error)
+            if result.state == 'error':
+                if self.cache.pop(name, None) is not None:
+                    self.save_cache()
+            else:
+                self.cache[name] = dict(zip(CACHED_FIELDS, (current.hwid, result.state, result.serial_number,
+                                                            result.product, result.firmware)),
+                                        checked=time.time())
+                self.save_cache()
+            self.version += 1
+
+    def set_busy(self, names):
+        # names 为已连接的串口
+        with self.lock:
+            self.busy = set(names)
+
+    def rescan(self):
+        # 重新探测所有未连接的串口（忽略缓存）
+        with self.lock:
+            for name, info in self.present.items():
+                if name not in self.busy:
+                    self.present[name] = info._replace(state='probing')
+            self.version += 1
+        self.refresh()
+
+    def probing(self, names):
+        # names 中是否有串口正在探测
+        with self.lock:
+            return any(name in self.futures for name in names)
+
+    def wait(self, names=None, timeout=None):
+        # 等待 names（默认全部）中正在进行的探测完成
+        with self.lock:
+            futures = [future for name, future in self.futures.items() if names is None or name in names]
+        wait(futures, timeout)
+
+    def run(self):
+        while not self._stop_event.is_set():
+            try:
+                self.refresh()
+            except Exception as e:
+                print(f"Failed to list serial ports: {e}")
+            self._stop_event.wait(self.interval)
+
+    def stop(self):
+        self._stop_event.set()
+        if self.is_alive():
+            self.join()
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+def discover(timeout=None, cache_file=DISCOVERY_CACHE):
+    # 不启动发现线程，列出并并发探测一次所有串口（有缓存的不探测），返回所有串口的 PortInfo
+    discovery = BridgeDiscovery(cache_file)
+    discovery.refresh()
+    discovery.wait(timeout=timeout)
+    discovery.stop()
+    return discovery.ports()
+
+
+def resolve_serial_ports(names, timeout=None):
+    # 把 'sn:序列号' 换成该 SensorBridge 当前所在的串口，其他名称不变。串口名随插入顺序变化，序列号不变
+    if not any(name.startswith(SERIAL_NUMBER_PREFIX) for name in names):
+        return list(names)
+    bridges = {info.serial_number: info.port for info in discover(timeout) if info.state == 'bridge'}
+    ports = []
+    for name in names:
+        if name.startswith(SERIAL_NUMBER_PREFIX):
+            serial_number = name[len(SERIAL_NUMBER_PREFIX):]
+            if serial_number not in bridges:
+                raise ValueError(f"no SensorBridge with serial number {serial_number} found")
+            name = bridges[serial_number]
+        ports.append(name)
+    return ports
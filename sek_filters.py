@@ -0,0 +1,336 @@
+# 通道的流式派生信号：若干处理级用 | 串联，例如 'median(5) | ema(0.1) | above(2.5, 0.05)'。
+# 每级按批处理 NumPy 数组（时间戳, 数值）并保存跨批次的状态，结果与一次处理整段数据相同
+# （ma/std 只有舍入误差的差别）。滚动窗口在窗口填满之前、以及窗口内含 nan 时输出 nan
+
+import ast
+import math
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+MAX_WINDOW = 100000  # 滚动窗口的最大样本数
+EMA_BLOCK_DECAY = 1e-6  # 指数平均按块求闭式解，块内衰减不小于该值以保证精度
+
+
+def window_size(window):
+    if window != int(window) or not 1 <= window <= MAX_WINDOW:
+        raise ValueError(f"window must be an integer between 1 and {MAX_WINDOW}")
+    return int(window)
+
+
+class WindowStage:
+    # 滚动窗口的公共部分：保留上一批的最后 window - 1 个样本与本批拼接，
+    # compute(data) 返回 data 中每个完整窗口（按结束位置排列）的统计量。每批 O(window + 批长)，只用于 median
+    def __init__(self, window):
+        self.window = window_size(window)
+        self.tail = np.empty(0)
+
+    def process(self, t, x):
+        data = np.concatenate([self.tail, x])
+        self.tail = data[max(len(data) - (self.window - 1), 0):]
+        out = np.full(len(x), np.nan)
+        count = len(data) - self.window + 1
+        if count > 0:
+            out[len(x) - count:] = self.compute(data)
+        return out
+
+
+class RunningWindow:
+    # ma/std 的公共部分：保存窗口内样本的和、平方和与 nan 的个数，每批只加上进入窗口的样本、
+    # 减去离开窗口的样本，每个样本 O(1)。样本先减去第一个有效样本以减小误差，
+    # 每 window 个样本按窗口内的样本重新求和一次，舍入误差不随运行时间累积（均摊每个样本 O(1)）。
+    # values/invalid 按顺序保存最近的样本（nan 记为 0），开头 window 个 0 代表窗口填满前离开窗口的样本；
+    # 写满时把最后 window 个样本移到开头
+    def __init__(self, window):
+        self.window = window_size(window)
+        self.values = np.zeros(2 * self.window)
+        self.invalid = np.zeros(2 * self.window)
+        self.end = self.window
+        self.seen = 0
+        self.since_resync = 0
+        self.shift = None
+        self.sum = self.squares = self.invalid_count = 0.0
+
+    def process(self, t, x):
+        n = self.window
+        if self.end + len(x) > len(self.values):
+            size = max(len(self.values), 2 * (n + len(x)))
+            values, invalid = np.zeros(size), np.zeros(size)
+            values[:n] = self.values[self.end - n:self.end]
+            invalid[:n] = self.invalid[self.end - n:self.end]
+            self.values, self.invalid, self.end = values, invalid, n
+        invalid = np.isnan(x)
+        if self.shift is None and not invalid.all():
+            self.shift = x[~invalid][0]
+        shifted = np.where(invalid, 0.0, x - (self.shift or 0.0))
+        start, end = self.end, self.end + len(x)
+        self.values[start:end] = shifted
+        self.invalid[start:end] = invalid
+        leaving = self.values[start - n:end - n]
+        sums = self.sum + np.cumsum(shifted - leaving)
+        squares = self.squares + np.cumsum(shifted * shifted - leaving * leaving)
+        counts = self.invalid_count + np.cumsum(invalid - self.invalid[start - n:end - n])
+        self.end = end
+        self.since_resync += len(x)
+        if self.since_resync >= n:
+            window = self.values[end - n:end]
+            self.sum, self.squares = window.sum(), np.dot(window, window)
+            self.invalid_count = self.invalid[end - n:end].sum()
+            self.since_resync = 0
+        elif len(x):
+            self.sum, self.squares, self.invalid_count = sums[-1], squares[-1], counts[-1]
+        out = self.compute(sums, squares)
+        out[counts > 0.5] = np.nan
+        out[:max(n - 1 - self.seen, 0)] = np.nan
+        self.seen += len(x)
+        return out
+
+
+class MovingAverage(RunningWindow):
+    # ma(n)：最近 n 个样本的平均值
+    def compute(self, sums, squares):
+        return sums / self.window + (self.shift or 0.0)
+
+
+class RollingStd(RunningWindow):
+    # std(n)：最近 n 个样本的标准差（总体标准差）
+    def compute(self, sums, squares):
+        mean = sums / self.window
+        return np.sqrt(np.maximum(squares / self.window - mean * mean, 0.0))
+
+
+class RollingExtreme:
+    # min(n) / max(n)：van Herk/Gil-Werman 算法。样本按绝对位置分成长度为 n 的块，结束于位置 p 的窗口
+    # 由上一块从 p - n + 1 开始的后缀极值和本块到 p 为止的前缀极值组成。前缀极值从当前块已有样本的极值
+    # 跨批次延续，块结束时求一次整块的后缀极值留给下一块，每个样本只需常数次比较
+    function = np.minimum
+    padding = np.inf
+
+    def __init__(self, window):
+        self.window = window_size(window)
+        self.block = np.empty(self.window)  # 当前块已有的样本
+        self.suffix = np.full(self.window + 1, self.padding)  # 上一块的后缀极值，最后一个为 padding
+        self.prefix = self.padding  # 当前块已有样本的极值
+        self.seen = 0
+
+    def extend(self, segment, out):
+        # segment 不跨块
+        if not len(segment):
+            return
+        column = self.seen % self.window
+        prefix = self.function(self.function.accumulate(segment), self.prefix)
+        out[:] = self.function(self.suffix[column + 1:column + 1 + len(segment)], prefix)
+        self.block[column:column + len(segment)] = segment
+        self.seen += len(segment)
+        if column + len(segment) == self.window:
+            self.suffix[:-1] = self.function.accumulate(self.block[::-1])[::-1]
+            self.prefix = self.padding
+        else:
+            self.prefix = prefix[-1]
+
+    def process(self, t, x):
+        n = self.window
+        out = np.empty(len(x))
+        missing = max(n - 1 - self.seen, 0)
+        head = min(-self.seen % n, len(x))
+        self.extend(x[:head], out[:head])
+        # 中间的整块一起计算
+        blocks = (len(x) - head) // n
+        if blocks:
+            rows = x[head:head + blocks * n].reshape(blocks, n)
+            prefix = self.function.accumulate(rows, axis=1)
+            suffix = self.function.accumulate(rows[:, ::-1], axis=1)[:, ::-1]
+            left = np.full((blocks, n), self.padding)
+            left[0] = self.suffix[1:]
+            left[1:, :-1] = suffix[:-1, 1:]
+            out[head:head + blocks * n] = self.function(left, prefix).ravel()
+            self.suffix[:-1] = suffix[-1]
+            self.seen += blocks * n
+        self.extend(x[head + blocks * n:], out[head + blocks * n:])
+        out[:missing] = np.nan
+        return out
+
+
+class RollingMin(RollingExtreme):
+    pass
+
+
+class RollingMax(RollingExtreme):
+    function = np.maximum
+    padding = -np.inf
+
+
+class RollingMedian(WindowStage):
+    # median(n)：最近 n 个样本的中位数，用于去除尖峰；每个样本 O(n)，适合较短的窗口
+    def compute(self, data):
+        return np.median(sliding_window_view(data, self.window), axis=1)
+
+
+class ExponentialStage:
+    # 一阶 IIR：y[k] = a * x[k] + (1 - a) * y[k - 1]。按块求闭式解
+    # y[k] = d^k * (y0 + a * sum(x[j] / d^j))，d = 1 - a，块长使 d^块长 不小于 EMA_BLOCK_DECAY。
+    # 第一个样本直接作为初值；nan 样本输出 nan 并跳过，不改变状态
+    def __init__(self):
+        self.state = np.nan
+
+    def alpha(self, t):
+        raise NotImplementedError
+
+    def process(self, t, x):
+        a = self.alpha(t)
+        valid = ~np.isnan(x)
+        values = x[valid]
+        if not len(values):
+            return np.full(len(x), np.nan)
+        y = values[0] if np.isnan(self.state) else self.state
+        if a >= 1.0:
+            filtered = values.copy()
+        else:
+            decay = 1.0 - a
+            block = max(int(math.log(EMA_BLOCK_DECAY) / math.log(decay)), 1)
+            filtered = np.empty(len(values))
+            for start in range(0, len(values), block):
+                chunk = values[start:start + block]
+                powers = decay ** np.arange(1, len(chunk) + 1)
+                filtered[start:start + len(chunk)] = powers * (y + a * np.cumsum(chunk / powers))
+                y = filtered[start + len(chunk) - 1]
+        self.state = filtered[-1]
+        out = np.full(len(x), np.nan)
+        out[valid] = filtered
+        return out
+
+
+class ExponentialAverage(ExponentialStage):
+    # ema(a)：指数滑动平均，0 < a <= 1，a 越小越平滑
+    def __init__(self, alpha):
+        if not 0 < alpha <= 1:
+            raise ValueError("alpha must be in (0, 1]")
+        super().__init__()
+        self.value = float(alpha)
+
+    def alpha(self, t):
+        return self.value
+
+
+class LowPass(ExponentialStage):
+    # lowpass(fc)：截止频率 fc (Hz) 的一阶低通。采样间隔取本批时间戳间隔的中位数，
+    # 采集中修改采样频率后自动适应
+    def __init__(self, cutoff):
+        if not cutoff > 0:
+            raise ValueError("cutoff frequency must be > 0 Hz")
+        super().__init__()
+        self.cutoff = float(cutoff)
+        self.last_time = None
+
+    def alpha(self, t):
+        times = t if self.last_time is None else np.concatenate([[self.last_time], t])
+        if len(t):
+            self.last_time = t[-1]
+        if len(times) < 2:
+            return 1.0
+        interval = float(np.median(np.diff(times)))
+        return 1.0 - math.exp(-2 * math.pi * self.cutoff * max(interval, 0.0))
+
+
+class Threshold:
+    # above(level, hysteresis=0)：超过 level + hysteresis 时输出 1，低于 level - hysteresis 时回到 0，
+    # 两者之间（以及 nan）保持上一个状态。below 相反。状态用事件位置的前向填充得到，无需逐点循环
+    invert = False
+
+    def __init__(self, level, hysteresis=0.0):
+        if hysteresis < 0:
+            raise ValueError("hysteresis must not be negative")
+        self.level = float(level)
+        self.hysteresis = float(hysteresis)
+        self.state = 0.0
+
+    def states(self, x):
+        high = x > self.level + self.hysteresis
+        low = x < self.level - self.hysteresis
+        on, off = (low, high) if self.invert else (high, low)
+        events = np.where(on | off, np.arange(len(x)), -1)
+        np.maximum.accumulate(events, out=events)
+        states = np.where(events >= 0, on[np.maximum(events, 0)], self.state).astype(np.float64)
+        previous = self.state
+        if len(states):
+            self.state = states[-1]
+        return previous, states
+
+    def process(self, t, x):
+        return self.states(x)[1]
+
+
+class Below(Threshold):
+    invert = True
+
+
+class Edge(Threshold):
+    # rising(level, hysteresis=0)：above 由 0 变为 1 的样本输出 1，其余为 0；falling 为由 1 变为 0
+    falling = False
+
+    def process(self, t, x):
+        previous, states = self.states(x)
+        changes = np.diff(np.concatenate([[previous], states]))
+        return (changes < 0 if self.falling else changes > 0).astype(np.float64)
+
+
+class FallingEdge(Edge):
+    falling = True
+
+
+STAGES = {
+    'ma': MovingAverage,
+    'ema': ExponentialAverage,
+    'lowpass': LowPass,
+    'median': RollingMedian,
+    'min': RollingMin,
+    'max': RollingMax,
+    'std': RollingStd,
+    'above': Threshold,
+    'below': Below,
+    'rising': Edge,
+    'falling': FallingEdge,
+}
+
+
+def parse_stage(text):
+    # 'name(数字, ...)' -> 处理级对象，参数只允许数字字面量
+    try:
+        node = ast.parse(text.strip(), mode='eval').body
+    except SyntaxError:
+        raise ValueError(f"invalid stage '{text.strip()}'") from None
+    if not isinstance(node, ast.Call) or not isinstance(node.func, ast.Name) or node.keywords:
+        raise ValueError(f"stage '{text.strip()}' must look like name(arguments)")
+    name = node.func.id
+    if name not in STAGES:
+        raise ValueError(f"unknown stage '{name}', expected one of {', '.join(STAGES)}")
+    args = []
+    for arg in node.args:
+        try:
+            value = ast.literal_eval(arg)
+        except ValueError:
+            value = None
+        if not isinstance(value, (int, float)) or isinstance(value, bool):
+            raise ValueError(f"arguments of '{name}' must be numbers")
+        args.append(float(value))
+    try:
+        return STAGES[name](*args)
+    except TypeError:
+        raise ValueError(f"wrong number of arguments for '{name}'") from None
+    except ValueError as e:
+        raise ValueError(f"{name}: {e}") from None
+
+
+class StageChain:
+    # 串联的处理级，每个派生信号一个实例（各自保存状态）
+    def __init__(self, text):
+        self.text = text.strip()
+        if not self.text:
+            raise ValueError("empty stage chain")
+        self.stages = [parse_stage(part) for part in self.text.split('|')]
+
+    def process(self, t, x):
+        x = np.asarray(x, dtype=np.float64)
+        for stage in self.stages:
+            x = stage.process(t, x)
+        return x
@@ -0,0 +1,209 @@
+# 采集过程的运行指标：计数器、仪表值和直方图，供界面状态面板显示，
+# 并可定期导出为 JSON 或 Prometheus 文本格式文件，便于无人值守的长时间采集。
+# 所有指标只在调用 AcquisitionSession.poll() 的线程中更新，不需要加锁
+
+import json
+import os
+import time
+
+import numpy as np
+
+METRICS_INTERVAL = 10.0  # 导出指标文件的间隔 (s)
+METRICS_PREFIX = 'sek_'
+# 直方图的桶上界 (s)：1 us 到 10 s 的 1-2-5 序列
+HISTOGRAM_BOUNDS = tuple(m * 10.0 ** e for e in range(-6, 1) for m in (1, 2, 5)) + (10.0,)
+
+METRIC_HELP = {
+    'samples_total': "Samples read from the SensorBridges.",
+    'missed_ticks_total': "Sampling ticks skipped because the sampler fell behind.",
+    'read_errors_total': "Failed reads from the SensorBridges.",
+    'dropped_batches_total': "Sample batches dropped because the sampler buffer was full.",
+    'rows_written_total': "Rows written to the recording.",
+    'update_errors_total': "Errors while updating the plot.",
+    'reconnects_total': "Successful reconnects after a device stopped responding.",
+    'outages_total': "Device outages recorded in the outage log.",
+    'outage_seconds_total': "Total duration of the recorded device outages.",
+    'published_batches_total': "Batches of rows published to live-data subscribers.",
+    'subscriber_dropped_batches_total': "Batches dropped because a live-data subscriber's queue was full.",
+    'devices_down': "Samplers currently waiting for their device to reconnect.",
+    'subscribers': "Connected live-data subscribers.",
+    'buffer_fill_ratio': "Highest fill level of the sampler buffers (0-1).",
+    'pending_rows': "Rows held back to keep the recording time-ordered.",
+    'requested_rate_hz': "Requested sampling rate per sampler.",
+    'achieved_rate_hz': "Achieved sampling rate per sampler.",
+    'serial_rtt_seconds': "Duration of one read of all ports of a sampler.",
+    'tick_lateness_seconds': "Delay between the scheduled and the actual sampling time.",
+    'formula_seconds': "Time to evaluate the formulas of one batch.",
+    'filter_seconds': "Time to run the derived-signal stages of one batch.",
+    'write_seconds': "Time to hand one batch to the recording writer.",
+    'flush_seconds': "Time to format and write the writer buffer to disk.",
+}
+
+
+class Histogram:
+    # 固定桶的直方图，counts[i] 为落在 (bounds[i-1], bounds[i]] 内的个数，最后一个桶为 +Inf
+    def __init__(self, bounds=HISTOGRAM_BOUNDS):
+        self.bounds = np.asarray(bounds, dtype=np.float64)
+        self.counts = np.zeros(len(self.bounds) + 1, dtype=np.int64)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, values):
+        values = np.atleast_1d(np.asarray(values, dtype=np.float64))
+        values = values[~np.isnan(values)]
+        if not len(values):
+            return
+        self.counts += np.bincount(np.searchsorted(self.bounds, values), minlength=len(self.counts))
+        self.count += len(values)
+        self.sum += float(values.sum())
+        self.max = max(self.max, float(values.max()))
+
+    def quantile(self, q):
+        # 按桶内线性插值估计分位数
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        cumulative = np.cumsum(self.counts)
+        i = int(np.searchsorted(cumulative, rank))
+        if i >= len(self.bounds):
+            return self.max
+        lower = self.bounds[i - 1] if i else 0.0
+        below = cumulative[i - 1] if i else 0
+        fraction = (rank - below) / self.counts[i] if self.counts[i] else 0.0
+        return min(lower + (self.bounds[i] - lower) * fraction, self.max)
+
+    def summary(self):
+        return {
+            'count': self.count,
+            'sum': self.sum,
+            'mean': self.sum / self.count if self.count else 0.0,
+            'p50': self.quantile(0.5),
+            'p90': self.quantile(0.9),
+            'p99': self.quantile(0.99),
+            'max': self.max,
+        }
+
+
+class Metrics:
+    # 按名称保存的计数器、仪表值（可带标签）和直方图，名称见 METRIC_HELP
+    def __init__(self):
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+
+    def count(self, name, value=1):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def set_total(self, name, value):
+        # 由其他对象累计的计数，直接设为当前总数
+        self.counters[name] = value
+
+    def set(self, name, value, **labels):
+        self.gauges[(name, tuple(sorted(labels.items())))] = value
+
+    def observe(self, name, values):
+        if name not in self.histograms:
+            self.histograms[name] = Histogram()
+        self.histograms[name].observe(values)
+
+    def counter(self, name):
+        return self.counters.get(name, 0)
+
+    def gauge(self, name, **labels):
+        return self.gauges.get((name, tuple(sorted(labels.items()))), 0)
+
+    def histogram(self, name):
+        return self.histograms.get(name) or Histogram()
+
+    def snapshot(self):
+        gauges = {}
+        for (name, labels), value in self.gauges.items():
+            if labels:
+                gauges.setdefault(name, []).append(dict(labels, value=value))
+            else:
+                gauges[name] = value
+        return {
+            'time': time.time(),
+            'counters': dict(self.counters),
+            'gauges': gauges,
+            'histograms': {name: histogram.summary() for name, histogram in self.histograms.items()},
+        }
+
+    def to_json(self):
+        return json.dumps(self.snapshot(), indent=1)
+
+    def to_prometheus(self):
+        lines = []
+
+        def describe(name, kind):
+            lines.append(f"# HELP {METRICS_PREFIX}{name} {METRIC_HELP.get(name, name)}")
+            lines.append(f"# TYPE {METRICS_PREFIX}{name} {kind}")
+
+        for name, value in sorted(self.counters.items()):
+            describe(name, 'counter')
+            lines.append(f"{METRICS_PREFIX}{name} {value}")
+        described = set()
+        for (name, labels), value in sorted(self.gauges.items()):
+            if name not in described:
+                describe(name, 'gauge')
+                described.add(name)
+            label_text = ','.join(f'{key}="{label}"' for key, label in labels)
+            lines.append(f"{METRICS_PREFIX}{name}{{{label_text}}} {value}" if labels
+                         else f"{METRICS_PREFIX}{name} {value}")
+        for name, histogram in sorted(self.histograms.items()):
+            describe(name, 'histogram')
+            for bound, count in zip(histogram.bounds, np.cumsum(histogram.counts)):
+                lines.append(f'{METRICS_PREFIX}{name}_bucket{{le="{bound:g}"}} {count}')
+            lines.append(f'{METRICS_PREFIX}{name}_bucket{{le="+Inf"}} {histogram.count}')
+            lines.append(f"{METRICS_PREFIX}{name}_sum {histogram.sum!r}")
+            lines.append(f"{METRICS_PREFIX}{name}_count {histogram.count}")
+        return '\n'.join(lines) + '\n'
+
+
+class MetricsExporter:
+    # 每 interval 秒把指标写入 file_name：扩展名为 .json 时写 JSON，否则写 Prometheus 文本格式
+    # （可由 node_exporter 的 textfile collector 读取）。先写临时文件再替换，读取方不会读到半个文件
+    def __init__(self, metrics, file_name, interval=METRICS_INTERVAL):
+        self.metrics = metrics
+        self.file_name = file_name
+        self.interval = interval
+        self.last_export = None
+
+    def maybe_export(self):
+        if self.last_export is None or time.monotonic() - self.last_export >= self.interval:
+            self.export()
+
+    def export(self):
+        if self.file_name.lower().endswith('.json'):
+            text = self.metrics.to_json()
+        else:
+            text = self.metrics.to_prometheus()
+        temp_name = self.file_name + '.tmp'
+        with open(temp_name, 'w', encoding='utf-8', newline='\n') as f:
+            f.write(text)
+        os.replace(temp_name, self.file_name)
+        self.last_export = time.monotonic()
+
+
+def format_status(metrics):
+    # 状态面板的多行文本
+    rtt = metrics.histogram('serial_rtt_seconds')
+    lateness = metrics.histogram('tick_lateness_seconds')
+    flush = metrics.histogram('flush_seconds')
+    return '\n'.join([
+        f"Samples: {metrics.counter('samples_total')}  Missed: {metrics.counter('missed_ticks_total')}",
+        f"Read errors: {metrics.counter('read_errors_total')}  Dropped batches: "
+        f"{metrics.counter('dropped_batches_total')}  UI errors: {metrics.counter('update_errors_total')}",
+        f"Devices down: {metrics.gauge('devices_down')}  Reconnects: {metrics.counter('reconnects_total')}  "
+        f"Outages: {metrics.counter('outage_seconds_total'):.1f} s",
+        f"Serial RTT p50/p99: {rtt.quantile(0.5) * 1e3:.2f} / {rtt.quantile(0.99) * 1e3:.2f} ms",
+        f"Lateness p99/max: {lateness.quantile(0.99) * 1e3:.2f} / {lateness.max * 1e3:.2f} ms",
+        f"Formula/filter mean: {metrics.histogram('formula_seconds').summary()['mean'] * 1e6:.0f} / "
+        f"{metrics.histogram('filter_seconds').summary()['mean'] * 1e6:.0f} us",
+        f"Flush p99/max: {flush.quantile(0.99) * 1e3:.1f} / {flush.max * 1e3:.1f} ms",
+        f"Buffer fill: {metrics.gauge('buffer_fill_ratio') * 100:.1f} %  "
+        f"Pending rows: {metrics.gauge('pending_rows')}",
+        f"Subscribers: {metrics.gauge('subscribers')}  "
+        f"Dropped for subscribers: {metrics.counter('subscriber_dropped_batches_total')}",
+    ])
@@ -0,0 +1,229 @@
+# 本机实时数据发布：采集时把每次 poll() 取出的数据行通过 localhost 的 TCP 连接推送给任意多个订阅者，
+# 其他程序不必再读取正在写入的记录文件。服务器在单独线程的 asyncio 事件循环中运行，
+# publish() 只把已编码的帧交给事件循环，不等待网络，慢的订阅者不会拖慢采集。
+#
+# 连接后服务器先发送一个 hello 消息（columns、column_metadata、header、记录文件名），之后每批数据一个消息，
+# seq 为批次序号，不连续表示该订阅者有批次被丢弃。两种格式：
+#   jsonl：每行一个 JSON 对象，{"type": "hello", ...} 和 {"type": "rows", "seq": n, "rows": [[Epoch_UTC, ...], ...]}，
+#          nan 写为 null
+#   binary：每帧为 FRAME 帧头（b'SEKP'、类型、seq、负载字节数）加负载，hello 的负载为 UTF-8 JSON，
+#           数据帧的负载为按行排列的小端 float64，每行 len(columns) 个值
+# 每个订阅者有自己的有界队列，满时按 policy 处理：drop-oldest 丢弃最旧的批次，drop-newest 丢弃新批次，
+# disconnect 断开该订阅者。asyncio 在创建服务器和订阅者时才导入，只使用本模块的常量时不加载
+
+import json
+import socket
+import struct
+import threading
+
+import numpy as np
+
+PUBLISH_HOST = '127.0.0.1'
+PUBLISH_PORT = 47810
+PUBLISH_FORMATS = ('jsonl', 'binary')
+QUEUE_POLICIES = ('drop-oldest', 'drop-newest', 'disconnect')
+QUEUE_SIZE = 256  # 每个订阅者最多缓存的批次数
+MAX_SUBSCRIBERS = 32
+WRITE_BUFFER_LIMIT = 1024 * 1024  # 套接字发送缓冲超过该字节数时等待订阅者读取，之后的批次进入队列
+START_TIMEOUT = 5.0  # 等待服务器开始监听的时间 (s)
+
+FRAME = struct.Struct('<4sBII')
+FRAME_MAGIC = b'SEKP'
+FRAME_HELLO = 0
+FRAME_ROWS = 1
+
+
+def encode_frame(kind, seq, payload, framing):
+    # hello 的 payload 为字典，数据帧为二维数组
+    if framing == 'binary':
+        if kind == FRAME_HELLO:
+            data = json.dumps(payload, default=str).encode('utf-8')
+        else:
+            data = np.ascontiguousarray(payload, dtype='<f8').tobytes()
+        return FRAME.pack(FRAME_MAGIC, kind, seq, len(data)) + data
+    if kind == FRAME_HELLO:
+        message = dict(payload, type='hello')
+    else:
+        rows = np.asarray(payload, dtype=np.float64)
+        invalid = np.isnan(rows)
+        message = {'type': 'rows', 'seq': seq,
+                   'rows': np.where(invalid, None, rows).tolist() if invalid.any() else rows.tolist()}
+    return (json.dumps(message, default=str, separators=(',', ':')) + '\n').encode('utf-8')
+
+
+class Subscriber:
+    # 一个连接：队列中为已编码的帧，由 send() 任务依次写出
+    def __init__(self, writer, queue_size, policy):
+        import asyncio
+
+        self.writer = writer
+        self.queue = asyncio.Queue(queue_size)
+        self.policy = policy
+        self.closed = False
+
+    def offer(self, frame):
+        # 返回是否有批次被丢弃
+        if self.closed:
+            return False
+        if not self.queue.full():
+            self.queue.put_nowait(frame)
+            return False
+        if self.policy == 'drop-oldest':
+            self.queue.get_nowait()
+            self.queue.put_nowait(frame)
+        elif self.policy == 'disconnect':
+            self.close(abort=True)
+        return True
+
+    async def send(self):
+        try:
+            while True:
+                self.writer.write(await self.queue.get())
+                await self.writer.drain()
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            self.close()
+
+    def close(self, abort=False):
+        # abort 时丢弃发送缓冲立即断开：不读取数据的订阅者上正常关闭要等缓冲发完，永远不会结束
+        if not self.closed:
+            self.closed = True
+            if abort:
+                self.writer.transport.abort()
+            else:
+                self.writer.close()
+
+
+class LivePublisher:
+    # 在 host:port 上监听（port 为 0 时由系统分配，start() 后见 self.port），hello 为连接时发送的字典。
+    # start()/stop()/publish() 由采集线程调用；subscribers 只在事件循环中修改，
+    # 采集线程只读取 subscriber_count、dropped（所有订阅者丢弃的批次数）和 published
+    def __init__(self, hello, host=PUBLISH_HOST, port=PUBLISH_PORT, framing='jsonl', queue_size=QUEUE_SIZE,
+                 policy='drop-oldest'):
+        if framing not in PUBLISH_FORMATS:
+            raise ValueError(f"unknown framing '{framing}', expected one of {', '.join(PUBLISH_FORMATS)}")
+        if policy not in QUEUE_POLICIES:
+            raise ValueError(f"unknown queue policy '{policy}', expected one of {', '.join(QUEUE_POLICIES)}")
+        if queue_size < 1:
+            raise ValueError("queue size must be at least 1")
+        self.hello = hello
+        self.host = host
+        self.port = port
+        self.framing = framing
+        self.queue_size = queue_size
+        self.policy = policy
+        self.subscribers = set()
+        self.subscriber_count = 0
+        self.handlers = set()
+        self.dropped = 0
+        self.published = 0
+        self.loop = None
+        self.server = None
+        self.thread = None
+
+    def start(self):
+        import asyncio
+
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, name='LivePublisher', daemon=True)
+        self.thread.start()
+        try:
+            self.server = asyncio.run_coroutine_threadsafe(
+                asyncio.start_server(self.handle, self.host, self.port), self.loop).result(START_TIMEOUT)
+        except Exception:
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.thread.join()
+            self.loop.close()
+            self.loop = None
+            raise
+        self.port = self.server.sockets[0].getsockname()[1]
+
+    async def handle(self, reader, writer):
+        import asyncio
+
+        if len(self.subscribers) >= MAX_SUBSCRIBERS:
+            writer.close()
+            return
+        writer.transport.set_write_buffer_limits(WRITE_BUFFER_LIMIT)
+        subscriber = Subscriber(writer, self.queue_size, self.policy)
+        subscriber.queue.put_nowait(encode_frame(FRAME_HELLO, 0, self.hello, self.framing))
+        self.subscribers.add(subscriber)
+        self.subscriber_count = len(self.subscribers)
+        self.handlers.add(asyncio.current_task())
+        sender = asyncio.ensure_future(subscriber.send())
+        try:
+            # 订阅者发来的数据忽略，读到 EOF 表示对方已断开
+            while not subscriber.closed and await reader.read(4096):
+                pass
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            sender.cancel()
+            subscriber.close()
+            self.subscribers.discard(subscriber)
+            self.subscriber_count = len(self.subscribers)
+            self.handlers.discard(asyncio.current_task())
+
+    def publish(self, rows):
+        # rows 为 poll() 返回的数据行，编码一次后分发给所有订阅者
+        if rows is None or not len(rows) or self.loop is None:
+            return
+        self.published += 1
+        if self.subscriber_count:
+            self.loop.call_soon_threadsafe(self.fan_out, encode_frame(FRAME_ROWS, self.published, rows, self.framing))
+
+    def fan_out(self, frame):
+        for subscriber in list(self.subscribers):
+            if subscriber.offer(frame):
+                self.dropped += 1
+
+    def stop(self):
+        # 停止监听并断开所有订阅者，已在队列中的批次不再发送
+        if self.loop is None:
+            return
+        import asyncio
+
+        async def shutdown():
+            self.server.close()
+            for subscriber in list(self.subscribers):
+                subscriber.close(abort=True)
+            await asyncio.gather(*self.handlers, return_exceptions=True)
+            await self.server.wait_closed()
+
+        try:
+            asyncio.run_coroutine_threadsafe(shutdown(), self.loop).result(START_TIMEOUT)
+        finally:
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.thread.join()
+            self.loop.close()
+            self.loop = None
+
+
+def subscribe(host=PUBLISH_HOST, port=PUBLISH_PORT, framing='jsonl', timeout=None):
+    # 简单的同步订阅端，供其他程序参考：先返回 hello 字典，之后每批返回 (seq, 数据行数组)
+    with socket.create_connection((host, port), timeout=timeout) as sock:
+        stream = sock.makefile('rb')
+        if framing == 'jsonl':
+            for line in stream:
+                message = json.loads(line)
+                if message.pop('type') == 'hello':
+                    yield message
+                else:
+                    yield message['seq'], np.array(message['rows'], dtype=np.float64)
+            return
+        columns = None
+        while True:
+            header = stream.read(FRAME.size)
+            if len(header) < FRAME.size:
+                return
+            magic, kind, seq, length = FRAME.unpack(header)
+            if magic != FRAME_MAGIC:
+                raise ValueError("invalid frame")
+            data = stream.read(length)
+            if kind == FRAME_HELLO:
+                hello = json.loads(data.decode('utf-8'))
+                columns = len(hello['columns'])
+                yield hello
+            else:
+                yield seq, np.frombuffer(data, dtype='<f8').reshape(-1, columns)
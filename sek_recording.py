@@ -0,0 +1,583 @@
+# 读取已记录的 EDF 文件、二进制记录和分段记录：用 mmap 按需解析数据，按时间二分查找只加载需要的时间段，
+# 并为每列建立 min/max 多分辨率聚合（MinMaxPyramid），用于回放时在百万行级别上缩放；
+# 以及把记录转换为 EDF/CSV/Parquet。不依赖 PyQt5/pyqtgraph
+
+import gzip
+import io
+import json
+import mmap
+import os
+import struct
+import warnings
+import zlib
+
+import numpy as np
+
+from sek_acquisition import BINARY_MAGIC, FRAME_HEADER, FRAME_MAGIC, SEGMENT_INDEX_EXTENSION, EdfWriter, \
+    write_edf_header
+
+LOD_BASE = 64  # 最细一层每个桶包含的样本数
+LOD_FACTOR = 4  # 相邻两层桶大小之比
+CHUNK_BYTES = 16 * 1024 * 1024  # 流式解析每块的字节数
+CACHE_SUFFIX = '.lod.npz'  # 聚合结果缓存文件后缀，文件大小或修改时间变化后失效
+
+# EDF Format 行中 Type 对应的 NumPy 类型
+EDF_TYPES = {'float64': np.float64, 'double': np.float64, 'float': np.float32, 'float32': np.float32,
+             'int': np.int64, 'int64': np.int64, 'int32': np.int32}
+EXPORT_FORMATS = {'.edf': 'edf', '.csv': 'csv', '.parquet': 'parquet'}
+
+
+class MinMaxLevel:
+    # 聚合的一层：第 i 个桶从 x[i] 开始，lo/hi 为桶内最小/最大值。
+    # merged 为已合并到上一层的桶数
+    def __init__(self, x=None, lo=None, hi=None, merged=0):
+        self.x = np.empty(1024) if x is None else x
+        self.lo = np.empty(1024) if lo is None else lo
+        self.hi = np.empty(1024) if hi is None else hi
+        self.count = 0 if x is None else len(x)
+        self.merged = merged
+
+    def append(self, x, lo, hi):
+        end = self.count + len(x)
+        if end > len(self.x):
+            capacity = max(end, 2 * len(self.x))
+            for name in ('x', 'lo', 'hi'):
+                buf = np.empty(capacity)
+                buf[:self.count] = getattr(self, name)[:self.count]
+                setattr(self, name, buf)
+        self.x[self.count:end] = x
+        self.lo[self.count:end] = lo
+        self.hi[self.count:end] = hi
+        self.count = end
+
+    def span(self, x0, x1):
+        # 与 [x0, x1] 相交的桶的下标范围
+        x = self.x[:self.count]
+        return max(np.searchsorted(x, x0, 'right') - 1, 0), np.searchsorted(x, x1, 'right')
+
+
+class MinMaxPyramid:
+    # 一个通道的多分辨率 min/max 聚合，第 k 层每个桶覆盖 base * factor**k 个样本。
+    # extend 增量更新，不足一个桶的样本暂存在 tail 中；query 选择桶数不超过
+    # max_points 的最细一层，代价与屏幕宽度相当，且不会丢失尖峰
+    def __init__(self, base=LOD_BASE, factor=LOD_FACTOR):
+        self.base = base
+        self.factor = factor
+        self.levels = []
+        self.tail_x = np.empty(0)
+        self.tail_y = np.empty(0)
+
+    def __len__(self):
+        return (self.levels[0].count * self.base if self.levels else 0) + len(self.tail_x)
+
+    def extend(self, x, y):
+        x = np.concatenate((self.tail_x, x))
+        y = np.concatenate((self.tail_y, y))
+        n = len(x) // self.base * self.base
+        if n:
+            buckets = y[:n].reshape(-1, self.base)
+            self._append(0, x[:n:self.base], np.fmin.reduce(buckets, axis=1), np.fmax.reduce(buckets, axis=1))
+        self.tail_x = x[n:].copy()
+        self.tail_y = y[n:].copy()
+
+    def _append(self, k, x, lo, hi):
+        if k == len(self.levels):
+            self.levels.append(MinMaxLevel())
+        level = self.levels[k]
+        level.append(x, lo, hi)
+        n = (level.count - level.merged) // self.factor * self.factor
+        if n:
+            start, end = level.merged, level.merged + n
+            level.merged = end
+            self._append(k + 1, level.x[start:end:self.factor],
+                         np.fmin.reduce(level.lo[start:end].reshape(-1, self.factor), axis=1),
+                         np.fmax.reduce(level.hi[start:end].reshape(-1, self.factor), axis=1))
+
+    def count(self, x0, x1):
+        # [x0, x1] 内样本数的估计值（按最细一层的桶计）
+        i0, i1 = np.searchsorted(self.tail_x, (x0, x1), 'right')
+        if not self.levels:
+            return i1 - i0
+        start, end = self.levels[0].span(x0, x1)
+        return (end - start) * self.base + i1 - i0
+
+    def query(self, x0, x1, max_points):
+        # 返回 [x0, x1] 内的 (x, y)，每个桶给出最小值和最大值两个点
+        chosen = len(self.levels) - 1
+        for k, level in enumerate(self.levels):
+            start, end = level.span(x0, x1)
+            if end - start <= max_points:
+                chosen = k
+                break
+        xs, los, his = [], [], []
+        # 所选层之后尚未合并成整桶的部分由更细的层补齐
+        for k in range(chosen, -1, -1):
+            level = self.levels[k]
+            start, end = level.span(x0, x1)
+            if k < chosen:
+                start = max(start, level.merged)
+            if end > start:
+                xs.append(level.x[start:end])
+                los.append(level.lo[start:end])
+                his.append(level.hi[start:end])
+        i0, i1 = np.searchsorted(self.tail_x, (x0, x1), 'right')
+        i0 = max(i0 - 1, 0)
+        x = np.concatenate(xs + [self.tail_x[i0:i1]])
+        y = np.empty(2 * len(x))
+        n = len(x) - (i1 - i0)
+        y[0:2 * n:2] = np.concatenate(los) if los else []
+        y[1:2 * n:2] = np.concatenate(his) if his else []
+        y[2 * n:] = np.repeat(self.tail_y[i0:i1], 2)
+        return np.repeat(x, 2), y
+
+    def to_arrays(self, prefix):
+        arrays = {f'{prefix}tail_x': self.tail_x, f'{prefix}tail_y': self.tail_y,
+                  f'{prefix}shape': np.array([self.base, self.factor, len(self.levels)])}
+        for k, level in enumerate(self.levels):
+            for name in ('x', 'lo', 'hi'):
+                arrays[f'{prefix}{k}_{name}'] = getattr(level, name)[:level.count]
+            arrays[f'{prefix}{k}_merged'] = np.array(level.merged)
+        return arrays
+
+    @classmethod
+    def from_arrays(cls, arrays, prefix):
+        base, factor, levels = arrays[f'{prefix}shape']
+        pyramid = cls(int(base), int(factor))
+        pyramid.tail_x = arrays[f'{prefix}tail_x']
+        pyramid.tail_y = arrays[f'{prefix}tail_y']
+        for k in range(levels):
+            pyramid.levels.append(MinMaxLevel(*(np.array(arrays[f'{prefix}{k}_{name}']) for name in ('x', 'lo', 'hi')),
+                                              merged=int(arrays[f'{prefix}{k}_merged'])))
+        return pyramid
+
+
+def parse_format_line(line):
+    # '# Format=.2f,Type=float64,Unit=s\tFormat=...' -> [{'Format': '.2f', 'Type': 'float64', 'Unit': 's'}, ...]
+    column_metadata = []
+    for item in line.lstrip('#').strip().split('\t'):
+        column_metadata.append(dict(field.split('=', 1) for field in item.split(',') if '=' in field))
+    return column_metadata
+
+
+class Recording:
+    # EdfRecording 与 BinaryRecording 的公共部分。子类提供 columns、column_metadata（列表）、
+    # header（custom header 字典）、data_offset/data_end（数据所在的字节范围）、
+    # close()、time_range()、load(start_time, end_time) 和
+    # iter_chunks(start_time, end_time, chunk_bytes)，后者逐块返回 (起始字节, 结束字节, {列名: 数组})
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def build_pyramids(self, columns=None, progress=None, cache=True):
+        # 流式读取整个文件，为指定列（默认除时间列外的全部列）建立 MinMaxPyramid。
+        # progress(已处理字节, 总字节) 返回 False 时中止并返回 None
+        columns = self.columns[1:] if columns is None else columns
+        cache_file = self.file_name + CACHE_SUFFIX
+        stat = os.stat(self.file_name)
+        key = np.array([stat.st_size, stat.st_mtime_ns])
+        if cache and os.path.exists(cache_file):
+            try:
+                with np.load(cache_file) as arrays:
+                    if np.array_equal(arrays['key'], key) and list(arrays['columns']) == list(columns):
+                        return {column: MinMaxPyramid.from_arrays(arrays, f'{i}:') for i, column in enumerate(columns)}
+            except (OSError, ValueError, KeyError):
+                pass
+        pyramids = {column: MinMaxPyramid() for column in columns}
+        total = self.data_end - self.data_offset
+        for start, stop, data in self.iter_chunks():
+            for column, pyramid in pyramids.items():
+                pyramid.extend(data[self.columns[0]], data[column])
+            if progress is not None and progress(stop - self.data_offset, total) is False:
+                return None
+        if cache:
+            arrays = {'key': key, 'columns': np.array(columns)}
+            for i, column in enumerate(columns):
+                arrays.update(pyramids[column].to_arrays(f'{i}:'))
+            try:
+                with open(cache_file, 'wb') as f:
+                    np.savez(f, **arrays)
+            except OSError:
+                pass
+        return pyramids
+
+
+class EdfRecording(Recording):
+    # 以 mmap 方式打开 create_edf_file/EdfWriter 写出的 EDF 文件，只解析表头，
+    # 数据行在需要时按块解析为 NumPy 列。要求第一列（Epoch_UTC）单调递增，
+    # 按时间加载时用二分查找定位，不读取整个文件。给出 data 时解析内存中的文件内容（解压后的分段）
+    def __init__(self, file_name, data=None):
+        self.file_name = file_name
+        self.metadata = {}
+        self.column_metadata = []
+        self._file = open(file_name, 'rb') if data is None else io.BytesIO(data)
+        try:
+            self._read_header()
+            if data is None:
+                self.size = os.fstat(self._file.fileno()).st_size
+                self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if self.size else b''
+            else:
+                self.size = len(data)
+                self._map = data
+        except Exception:
+            self._file.close()
+            raise
+        # 只处理完整的行，忽略正在写入或异常中断的最后一行
+        self.data_end = self._map.rfind(b'\n', self.data_offset) + 1 or self.data_offset
+        self.dtypes = [EDF_TYPES.get(meta.get('Type'), np.float64) for meta in self.column_metadata]
+        self.dtypes[0] = np.float64
+
+    def _read_header(self):
+        while True:
+            line = self._file.readline()
+            if not line:
+                raise ValueError(f"'{self.file_name}' has no column names")
+            text = line.decode('utf-8').rstrip('\r\n')
+            if not text.startswith('#'):
+                break
+            if text[1:].strip().startswith('Format='):
+                self.column_metadata = parse_format_line(text)
+            else:
+                key, _, value = text[1:].strip().partition('=')
+                self.metadata[key] = value
+        self.header = {key: value for key, value in self.metadata.items() if key not in ('EdfVersion', 'Date')}
+        self.columns = text.split('\t')
+        if len(self.column_metadata) != len(self.columns):
+            self.column_metadata = [{} for _ in self.columns]
+        self.data_offset = self._file.tell()
+
+    def close(self):
+        if isinstance(self._map, mmap.mmap):
+            self._map.close()
+        self._file.close()
+
+    def _row_start(self, offset):
+        # offset 处或之后第一个完整行的起始位置
+        if offset <= self.data_offset:
+            return self.data_offset
+        return self._map.find(b'\n', offset - 1, self.data_end) + 1 or self.data_end
+
+    def _time_at(self, offset):
+        end = self._map.find(b'\t', offset, self.data_end)
+        return float(self._map[offset:end])
+
+    def find_offset(self, timestamp):
+        # 第一行时间不小于 timestamp 的行的起始位置
+        lo, hi = self.data_offset, self.data_end
+        while lo < hi:
+            mid = max(self._map.rfind(b'\n', lo, (lo + hi) // 2) + 1, lo)
+            if self._time_at(mid) < timestamp:
+                lo = self._map.find(b'\n', mid, self.data_end) + 1
+            else:
+                hi = mid
+        return lo
+
+    def time_range(self):
+        if self.data_end <= self.data_offset:
+            return None
+        last = self._map.rfind(b'\n', self.data_offset, self.data_end - 1) + 1 or self.data_offset
+        return self._time_at(self.data_offset), self._time_at(max(last, self.data_offset))
+
+    def parse(self, start, end):
+        # 将 [start, end) 字节范围内的完整行解析为 {列名: 数组}
+        if end > start:
+            with warnings.catch_warnings():
+                warnings.simplefilter('error', DeprecationWarning)
+                try:
+                    values = np.fromstring(self._map[start:end], dtype=np.float64, sep=' ')
+                except (DeprecationWarning, ValueError) as e:
+                    raise ValueError(f"malformed data in '{self.file_name}' between bytes {start} and {end}") from e
+        else:
+            values = np.empty(0)
+        values = values.reshape(-1, len(self.columns))
+        return {column: values[:, i].astype(dtype) for i, (column, dtype) in enumerate(zip(self.columns, self.dtypes))}
+
+    def _byte_range(self, start_time, end_time):
+        start = self.data_offset if start_time is None else self.find_offset(start_time)
+        end = self.data_end if end_time is None else self.find_offset(np.nextafter(end_time, np.inf))
+        return start, end
+
+    def load(self, start_time=None, end_time=None):
+        return self.parse(*self._byte_range(start_time, end_time))
+
+    def iter_chunks(self, start_time=None, end_time=None, chunk_bytes=CHUNK_BYTES):
+        start, end = self._byte_range(start_time, end_time)
+        while start < end:
+            stop = min(self._row_start(start + chunk_bytes), end)
+            yield start, stop, self.parse(start, stop)
+            start = stop
+
+
+class BinaryRecording(Recording):
+    # 以 mmap 方式打开 BinaryWriter 写出的二进制记录。打开时只扫描各帧的帧头建立索引，
+    # 忽略末尾不完整或校验失败的帧；按时间加载时按每帧的第一个时间戳定位。data 同 EdfRecording
+    def __init__(self, file_name, data=None):
+        self.file_name = file_name
+        self._file = open(file_name, 'rb') if data is None else io.BytesIO(data)
+        try:
+            magic = self._file.read(len(BINARY_MAGIC) + 4)
+            if len(magic) < len(BINARY_MAGIC) + 4 or not magic.startswith(BINARY_MAGIC):
+                raise ValueError(f"'{file_name}' is not a binary recording")
+            info = json.loads(self._file.read(struct.unpack('<I', magic[-4:])[0]).decode('utf-8'))
+            self.data_offset = self._file.tell()
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if data is None else data
+        except Exception:
+            self._file.close()
+            raise
+        self.metadata = {'Date': info['date']}
+        self.header = info['header']
+        self.columns = info['columns']
+        self.column_metadata = [info['column_metadata'].get(column, {}) for column in self.columns]
+        self.aliases = info['aliases']
+        self.record = np.dtype([(column, dtype) for column, dtype in zip(info['stored'], info['dtypes'])])
+        self.dtypes = [self.record[self.aliases.get(column, column)].type for column in self.columns]
+        self._index_frames()
+
+    def _index_frames(self):
+        offsets, rows = [], []
+        offset, size = self.data_offset, len(self._map)
+        while offset + FRAME_HEADER.size <= size:
+            magic, count, _ = FRAME_HEADER.unpack_from(self._map, offset)
+            end = offset + FRAME_HEADER.size + count * self.record.itemsize
+            if magic != FRAME_MAGIC or end > size:
+                break
+            offsets.append(offset)
+            rows.append(count)
+            offset = end
+        # 最后一帧可能在写入过程中断电，校验失败则丢弃
+        if offsets and not self._frame_valid(offsets[-1]):
+            offset = offsets.pop()
+            rows.pop()
+        self.frame_offsets = np.array(offsets + [offset], dtype=np.int64)
+        self.frame_rows = np.array(rows, dtype=np.int64)
+        self.frame_times = np.array([np.frombuffer(self._map, '<f8', 1, o + FRAME_HEADER.size)[0]
+                                     for o in offsets])
+        self.data_end = offset
+
+    def _frame_valid(self, offset):
+        _, count, crc = FRAME_HEADER.unpack_from(self._map, offset)
+        start = offset + FRAME_HEADER.size
+        return zlib.crc32(self._map[start:start + count * self.record.itemsize]) == crc
+
+    def close(self):
+        if isinstance(self._map, mmap.mmap):
+            self._map.close()
+        self._file.close()
+
+    def __len__(self):
+        return int(self.frame_rows.sum())
+
+    def time_range(self):
+        if not len(self.frame_rows):
+            return None
+        last = self.frame_offsets[-1] - self.record.itemsize
+        return self.frame_times[0], np.frombuffer(self._map, '<f8', 1, last)[0]
+
+    def parse_frames(self, first, last):
+        # 第 first 到 last - 1 帧的数据，{列名: 数组}
+        parts = []
+        for i in range(first, last):
+            offset = int(self.frame_offsets[i])
+            _, count, crc = FRAME_HEADER.unpack_from(self._map, offset)
+            payload = self._map[offset + FRAME_HEADER.size:offset + FRAME_HEADER.size + count * self.record.itemsize]
+            if zlib.crc32(payload) != crc:
+                raise ValueError(f"corrupted frame at byte {offset} of '{self.file_name}'")
+            parts.append(np.frombuffer(payload, dtype=self.record))
+        records = np.concatenate(parts) if parts else np.empty(0, dtype=self.record)
+        return {column: records[self.aliases.get(column, column)] for column in self.columns}
+
+    def _frame_range(self, start_time, end_time):
+        first = 0 if start_time is None else max(np.searchsorted(self.frame_times, start_time, 'right') - 1, 0)
+        last = len(self.frame_rows) if end_time is None else np.searchsorted(self.frame_times, end_time, 'right')
+        return first, last
+
+    def _select(self, data, start_time, end_time):
+        x = data[self.columns[0]]
+        start = 0 if start_time is None else np.searchsorted(x, start_time)
+        end = len(x) if end_time is None else np.searchsorted(x, end_time, 'right')
+        return {column: values[start:end] for column, values in data.items()}
+
+    def load(self, start_time=None, end_time=None):
+        return self._select(self.parse_frames(*self._frame_range(start_time, end_time)), start_time, end_time)
+
+    def iter_chunks(self, start_time=None, end_time=None, chunk_bytes=CHUNK_BYTES):
+        first, last = self._frame_range(start_time, end_time)
+        while first < last:
+            stop = int(np.searchsorted(self.frame_offsets, self.frame_offsets[first] + chunk_bytes, 'right'))
+            stop = min(max(stop - 1, first + 1), last)
+            yield (int(self.frame_offsets[first]), int(self.frame_offsets[stop]),
+                   self._select(self.parse_frames(first, stop), start_time, end_time))
+            first = stop
+
+
+class SegmentedRecording(Recording):
+    # SegmentedWriter 写出的分段记录，按索引文件 (.sekidx) 打开，接口同 EdfRecording。
+    # 按时间加载时先按各段的首行时间二分查找需要的段：未压缩的段直接打开（段内再二分查找），
+    # 压缩的段按索引块的首行时间二分查找，只读取并解压表头和需要的块。
+    # 列和表头取自第一段（去掉 Segment）；字节位置按各段未压缩的大小依次累加
+    def __init__(self, file_name):
+        self.file_name = file_name
+        self.directory = os.path.dirname(file_name)
+        with open(file_name, encoding='utf-8') as f:
+            self.index = json.load(f)
+        self.recording_class = BinaryRecording if self.index['format'] == 'binary' else EdfRecording
+        segments = self.index['segments']
+        if not segments:
+            raise ValueError(f"'{file_name}' has no segments")
+        with self.open_segment(segments[0], 0, 0) as first:
+            self.metadata = first.metadata
+            self.header = {key: value for key, value in first.header.items() if key != 'Segment'}
+            self.columns = first.columns
+            self.column_metadata = first.column_metadata
+            self.dtypes = first.dtypes
+        # 异常中断时最后一段（未压缩）的首末时间和大小不在索引中，从文件本身得到
+        last = segments[-1]
+        if not last['compressed'] and os.path.exists(self.path(last)):
+            with self.open_segment(last) as recording:
+                time_range = recording.time_range()
+                last['first'], last['last'] = time_range if time_range is not None else (None, None)
+                last['bytes'] = recording.data_end
+        self.segments = [segment for segment in segments if segment['first'] is not None]
+        self.first_times = np.array([segment['first'] for segment in self.segments], dtype=np.float64)
+        sizes = [segment['bytes'] or 0 for segment in self.segments]
+        self.segment_offsets = np.concatenate([[0], np.cumsum(sizes)]).astype(np.int64)
+        self.data_offset = 0
+        self.data_end = int(self.segment_offsets[-1])
+
+    def path(self, segment):
+        return os.path.join(self.directory, segment['file'])
+
+    def open_segment(self, segment, first_block=None, last_block=None):
+        # 未压缩的段打开整个文件；压缩的段只解压表头和第 first_block 到 last_block - 1 块（默认全部）
+        if not segment['compressed']:
+            return self.recording_class(self.path(segment))
+        members = segment['members']
+        first_block = 0 if first_block is None else first_block
+        last_block = len(members) - 2 if last_block is None else last_block
+        with open(self.path(segment), 'rb') as f:
+            data = gzip.decompress(f.read(members[1]))
+            if last_block > first_block:
+                f.seek(members[first_block + 1])
+                data += gzip.decompress(f.read(members[last_block + 1] - members[first_block + 1]))
+        return self.recording_class(self.path(segment), data)
+
+    def close(self):
+        pass
+
+    def time_range(self):
+        if not self.segments:
+            return None
+        return self.segments[0]['first'], self.segments[-1]['last']
+
+    def _segment_range(self, start_time, end_time):
+        first = 0 if start_time is None else max(int(np.searchsorted(self.first_times, start_time, 'right')) - 1, 0)
+        last = len(self.segments) if end_time is None else int(np.searchsorted(self.first_times, end_time, 'right'))
+        return first, last
+
+    def _block_range(self, segment, start_time, end_time):
+        times = [block[0] for block in segment['blocks']]
+        first = 0 if start_time is None else max(int(np.searchsorted(times, start_time, 'right')) - 1, 0)
+        last = len(times) if end_time is None else int(np.searchsorted(times, end_time, 'right'))
+        return first, last
+
+    def load(self, start_time=None, end_time=None):
+        parts = []
+        first, last = self._segment_range(start_time, end_time)
+        for segment in self.segments[first:last]:
+            blocks = self._block_range(segment, start_time, end_time) if segment['compressed'] else ()
+            with self.open_segment(segment, *blocks) as recording:
+                parts.append(recording.load(start_time, end_time))
+        if not parts:
+            return {column: np.empty(0, dtype=dtype) for column, dtype in zip(self.columns, self.dtypes)}
+        return {column: np.concatenate([part[column] for part in parts]) for column in self.columns}
+
+    def iter_chunks(self, start_time=None, end_time=None, chunk_bytes=CHUNK_BYTES):
+        first, last = self._segment_range(start_time, end_time)
+        for i in range(first, last):
+            segment, offset = self.segments[i], int(self.segment_offsets[i])
+            if not segment['compressed']:
+                with self.open_segment(segment) as recording:
+                    for start, stop, data in recording.iter_chunks(start_time, end_time, chunk_bytes):
+                        yield offset + start, offset + stop, data
+                continue
+            # 压缩的段：按未压缩的大小把相邻的块合为一块
+            ends = [block[1] for block in segment['blocks'][1:]] + [segment['bytes']]
+            block, last_block = self._block_range(segment, start_time, end_time)
+            while block < last_block:
+                stop = block + 1
+                while stop < last_block and ends[stop] - segment['blocks'][block][1] <= chunk_bytes:
+                    stop += 1
+                with self.open_segment(segment, block, stop) as recording:
+                    yield (offset + segment['blocks'][block][1], offset + ends[stop - 1],
+                           recording.load(start_time, end_time))
+                block = stop
+
+
+def open_recording_file(file_name):
+    # 分段记录按扩展名识别，其余按文件开头的标识选择 BinaryRecording 或 EdfRecording
+    if file_name.lower().endswith(SEGMENT_INDEX_EXTENSION):
+        return SegmentedRecording(file_name)
+    with open(file_name, 'rb') as f:
+        binary = f.read(len(BINARY_MAGIC)) == BINARY_MAGIC
+    return BinaryRecording(file_name) if binary else EdfRecording(file_name)
+
+
+class ExportWriter:
+    # 按块写出 EDF、CSV 或 Parquet（需要 pyarrow）：write({列名: 数组}) 追加一块，file_format 默认按扩展名判断。
+    # dtypes 为各列的 NumPy 类型，决定 CSV 的有效数字位数和 Parquet 的列类型
+    def __init__(self, file_name, columns, column_metadata, dtypes, header, file_format=None):
+        file_format = file_format or EXPORT_FORMATS.get(os.path.splitext(file_name)[1].lower())
+        if file_format not in EXPORT_FORMATS.values():
+            raise ValueError(f"unknown export format for '{file_name}', expected one of {', '.join(EXPORT_FORMATS)}")
+        self.columns = list(columns)
+        self.dtypes = list(dtypes)
+        self.file_format = file_format
+        if file_format == 'edf':
+            column_metadata = dict(zip(self.columns, column_metadata))
+            write_edf_header(file_name, header, self.columns, column_metadata)
+            self.output = EdfWriter(file_name, self.columns, column_metadata)
+        elif file_format == 'csv':
+            self.output = open(file_name, 'w', encoding='utf-8', newline='\n')
+            self.output.write(','.join(self.columns) + '\n')
+            # float32 列写 9 位有效数字即可精确还原
+            self.fmt = ['%.17g' if dtype == np.float64 else '%.9g' for dtype in self.dtypes]
+        else:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+
+            self.pa = pa
+            self.schema = pa.schema([(column, pa.from_numpy_dtype(dtype))
+                                     for column, dtype in zip(self.columns, self.dtypes)],
+                                    metadata={'header': json.dumps(header, default=str),
+                                              'column_metadata': json.dumps(list(column_metadata))})
+            self.output = pq.ParquetWriter(file_name, self.schema)
+
+    def write(self, data):
+        if self.file_format == 'edf':
+            self.output.write(np.column_stack([data[column] for column in self.columns]))
+        elif self.file_format == 'csv':
+            np.savetxt(self.output, np.column_stack([data[column] for column in self.columns]), fmt=self.fmt,
+                       delimiter=',')
+        else:
+            self.output.write_table(self.pa.table({column: np.asarray(data[column]).astype(dtype)
+                                                   for column, dtype in zip(self.columns, self.dtypes)},
+                                                  schema=self.schema))
+
+    def close(self):
+        self.output.close()
+
+
+def export_recording(recording, file_name, file_format=None, progress=None):
+    # 流式转换为 EDF、CSV 或 Parquet，file_format 默认按扩展名判断。
+    # progress(已处理字节, 总字节) 的用法同 build_pyramids
+    output = ExportWriter(file_name, recording.columns, recording.column_metadata, recording.dtypes,
+                          recording.header, file_format)
+    total = recording.data_end - recording.data_offset
+    try:
+        for start, stop, data in recording.iter_chunks():
+            output.write(data)
+            if progress is not None and progress(stop - recording.data_offset, total) is False:
+                break
+    finally:
+        output.close()